@@ -1,10 +1,10 @@
-from flask import Flask, render_template, request, redirect, url_for, session, Response, make_response, flash, jsonify
-from xhtml2pdf import pisa
+from flask import Flask, render_template, request, redirect, url_for, session, Response, make_response, flash, jsonify, g, send_file
 import mysql.connector
 import csv
 import random
 import string
 import sys
+import threading
 from io import StringIO, BytesIO
 from datetime import datetime
 from functools import wraps
@@ -12,42 +12,196 @@ from functools import wraps
 # Imports for image generation (although not directly used in the provided logic for now)
 from PIL import Image, ImageDraw, ImageFont
 import requests
-import os 
+import os
+
+from barcode_codec import encode, decode, is_valid_barcode, is_sandbox_barcode # Barcode Encoding/Decoding Functions
+from cart_ops import MAX_BATCH_SCANS, ScanError, add_scanned_item, add_scanned_items, order_line_with_totals, order_totals
+from csv_export import open_export_cursor, stream_csv
+from db_config import DB_CONFIG
+from db_pool import ConnectionPool, PoolTimeout
+from migrations import run_migrations
+from pdf_batches import BATCH_ROWS
+from presence import PresenceTracker
+from product_import import CSV_HEADER as PRODUCT_CSV_HEADER, ImportFileError, import_csv as import_products_csv
+from receipt_image import ReceiptImageCache, find_font
+from sandbox import SandboxRegistry
+import barcode_images
+from report_jobs import ReportJobQueue, build_orders_pdf, order_filter_sql
+from server_session import FileStore, MemoryStore, SQLStore, ServerSessionInterface
+from sequences import next_order_number, next_order_barcode
+from pagination import parse_page_args, keyset_page, numbered_page
+import data_versions
+import janitor
+import ref_data
+import receipts
+import inventory
+import search_index
+import site_stats
 
 app = Flask(__name__)
 app.secret_key = 'trash-for-coin-secret-key-2025' # *** สำคัญมาก: เปลี่ยนเป็นคีย์ลับที่ปลอดภัยของคุณ ***
 
-# --- Barcode Encoding/Decoding Functions ---
-def encode(x: int) -> int:
-    a = 982451653
-    b = 1234567891234
-    m = 10000000000039 # จำนวนเฉพาะที่ใกล้เคียง 10^13
-    return (a * x + b) % m
-
-def decode(y: int) -> int:
-    a = 982451653
-    b = 1234567891234
-    m = 10000000000039 # ต้องเป็นค่าเดียวกับ m ใน encode
-    a_inv = pow(a, m - 2, m) # หา inverse ของ a mod m โดยใช้ Fermat's Little Theorem
-    return (a_inv * (y - b)) % m
-
 # --- Database Connection ---
+# DB_CONFIG lives in db_config.py (shared with the command line tools)
+
+# Pool sizing is per worker process; override with environment variables when deploying
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    size=int(os.environ.get('DB_POOL_SIZE', 5)),
+    max_overflow=int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+    timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    max_lifetime=int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+    health_check=os.environ.get('DB_POOL_HEALTH_CHECK', '1') != '0',
+)
+
+# --- Server-side Sessions ---
+# The session cookie carries only a session id; the data (current orders, receipts) stays on the server.
+# SESSION_BACKEND: 'filesystem' (default, shared by the workers of one host), 'memory' (single process),
+# 'sql' (tbl_session, shared by every host) or 'cookie' (Flask's signed cookie, the old behaviour).
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'filesystem')
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 12 * 3600)) # Seconds an idle session is kept
+if SESSION_BACKEND == 'memory':
+    app.session_interface = ServerSessionInterface(MemoryStore(), ttl=SESSION_TTL)
+elif SESSION_BACKEND == 'sql':
+    app.session_interface = ServerSessionInterface(SQLStore(lambda: get_db_connection()), ttl=SESSION_TTL)
+elif SESSION_BACKEND == 'filesystem':
+    app.session_interface = ServerSessionInterface(
+        FileStore(os.environ.get('SESSION_DIR', os.path.join(app.root_path, 'session_cache'))), ttl=SESSION_TTL)
+
 def get_db_connection():
     """
-    Establishes a connection to the MySQL database.
+    Borrows a connection from the database pool.
+    Calling close() on it returns it to the pool.
     Returns the connection object or None if connection fails.
     """
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="project_bin" # Make sure this matches your database name
-        )
-        return conn
+        return db_pool.get_connection()
     except mysql.connector.Error as err:
         print(f"Error connecting to database: {err}")
         return None
+    except PoolTimeout as err:
+        print(f"Error connecting to database: {err}")
+        return None
+
+# --- Viewer Sandboxes (sandbox.py) ---
+# A viewer works in a private in-memory copy of a store that is thrown away at logout, so demo
+# traffic never reaches the production database. Sandboxes live in the worker process: run one
+# worker or sticky sessions. VIEWER_SANDBOX=0 gives viewers a real temporary store again.
+VIEWER_SANDBOX = os.environ.get('VIEWER_SANDBOX', '1') != '0'
+viewer_sandboxes = SandboxRegistry(
+    max_sandboxes=int(os.environ.get('VIEWER_SANDBOX_MAX', 200)), # Least recently used sandboxes are dropped beyond this
+    idle_ttl=SESSION_TTL,
+)
+
+def get_session_connection():
+    """
+    Borrows a connection for the logged-in user: the viewer's sandbox if they work in one,
+    otherwise a pooled connection. Calling close() releases it.
+    Returns None if no connection could be obtained.
+    """
+    if session.get('sandbox') and session.get('store_id'):
+        conn = viewer_sandboxes.connect(session['store_id'], {
+            'id': session['id'], 'email': session['email'], 'role': session['role'],
+            'firstname': session.get('firstname'), 'lastname': session.get('lastname'),
+        })
+        if conn is None:
+            print(f"Error connecting to viewer sandbox {session['store_id']}")
+        return conn
+    return get_db_connection()
+
+# --- Request-scoped Database Session ---
+def get_db():
+    """
+    Returns the connection bound to the current request (flask.g).
+    The route and every helper it calls share this one connection and transaction;
+    it is returned to the pool by close_db() when the request ends.
+    For a sandboxed viewer this is their sandbox (see get_session_connection()).
+    Returns None if no connection could be obtained.
+    """
+    if 'db_conn' not in g:
+        g.db_conn = get_session_connection()
+    return g.db_conn
+
+def get_production_db():
+    """Like get_db(), but always the production database, also for a viewer working in a sandbox."""
+    if not session.get('sandbox'):
+        return get_db()
+    if 'production_conn' not in g:
+        g.production_conn = get_db_connection()
+    return g.production_conn
+
+def is_order_barcode(code):
+    """is_valid_barcode(), plus the sandbox barcode range for a sandboxed viewer."""
+    return is_valid_barcode(code) or bool(session.get('sandbox') and is_sandbox_barcode(code))
+
+# --- Online presence (presence.py) ---
+# Requests of logged-in users are heartbeats; tbl_users.is_online is written in batches
+presence_tracker = PresenceTracker(
+    ttl=int(os.environ.get('PRESENCE_TTL', 300)),                     # Seconds without a request before a user counts as offline
+    flush_interval=int(os.environ.get('PRESENCE_FLUSH_INTERVAL', 30)), # Seconds between is_online writes
+)
+
+@app.before_request
+def presence_heartbeat():
+    if session.get('loggedin') and session.get('id'):
+        presence_tracker.touch(session['id'], session.get('store_id'), session.get('email'))
+
+@app.after_request
+def presence_flush(response):
+    presence_tracker.tick(get_db_connection)
+    return response
+
+# --- Background maintenance ---
+# Hourly threads started by the first request of each worker process, so they also run under a
+# WSGI server (gunicorn, mod_wsgi) and not only with `python app.py`. A forked worker does not
+# inherit its parent's threads, hence the pid check. BACKGROUND_JOBS=0 turns them off.
+BACKGROUND_JOBS = os.environ.get('BACKGROUND_JOBS', '1') != '0'
+_background_jobs_pid = None
+_background_jobs_lock = threading.Lock()
+
+def start_background_jobs():
+    """Starts the maintenance threads once per process."""
+    global _background_jobs_pid
+    with _background_jobs_lock:
+        if _background_jobs_pid == os.getpid():
+            return
+        _background_jobs_pid = os.getpid()
+    # Drift correction for the homepage counters
+    site_stats.start_reconcile_thread(get_db_connection)
+    # Removal of viewer stores left behind by expired sessions (see janitor.py)
+    janitor.start_janitor_thread(
+        get_db_connection,
+        max_age=int(os.environ.get('JANITOR_VIEWER_STORE_AGE', 2 * SESSION_TTL)), # Seconds after which an idle viewer store is removed
+        is_active=lambda store_id: presence_tracker.count(store_id) > 0,
+        null_store=os.environ.get('JANITOR_NULL_STORE', '0') == '1', # Also purge rows without a store (opt-in)
+    )
+
+@app.before_request
+def ensure_background_jobs():
+    if BACKGROUND_JOBS and _background_jobs_pid != os.getpid():
+        start_background_jobs()
+
+@app.after_request
+def add_db_query_count(response):
+    """Reports how many SQL statements the request executed (X-DB-Queries header)."""
+    conn = g.get('db_conn')
+    if conn is not None:
+        response.headers['X-DB-Queries'] = str(conn.query_count)
+    return response
+
+@app.teardown_appcontext
+def close_db(exception):
+    """Rolls back on unhandled errors and returns the request's connection(s) to the pool."""
+    for name in ('db_conn', 'production_conn'):
+        conn = g.pop(name, None)
+        if conn is None:
+            continue
+        if exception is not None:
+            try:
+                conn.rollback()
+            except mysql.connector.Error as err:
+                print(f"Error rolling back request transaction: {err}")
+        conn.close()
 
 # --- Helper functions for Viewer's dynamic store ---
 def generate_unique_store_id(conn, cursor):
@@ -68,6 +222,7 @@ def generate_unique_store_id(conn, cursor):
 
             cursor.execute("INSERT INTO tbl_stores (store_id, store_name, address, phone) VALUES (%s, %s, %s, %s)",
                            (new_store_id, new_store_name, new_address, new_phone))
+            data_versions.bump(cursor, 'stores', new_store_id)
             conn.commit()
             return new_store_id, new_store_name
         except mysql.connector.Error as err:
@@ -78,34 +233,27 @@ def generate_unique_store_id(conn, cursor):
     raise Exception("ไม่สามารถสร้าง store_id ที่ไม่ซ้ำกันได้หลังจากพยายามหลายครั้ง")
 
 def delete_viewer_store_and_data(store_id):
-    """Deletes all data associated with a viewer's store_id and the store itself."""
-    conn = get_db_connection()
+    """
+    Deletes all data associated with a viewer's store_id and the store itself.
+    The rows are deleted in batches (janitor.py) instead of being left behind with store_id NULL;
+    users tied to the store are kept and detached from it.
+    """
+    conn = get_db()
     if not conn:
         print("Error: Could not connect to DB to delete viewer store data.")
         return False
-    cursor = conn.cursor()
     try:
-        # Before deleting the store, set foreign keys in dependent tables to NULL
-        # (Assuming ON DELETE SET NULL is enabled for these relationships in DB)
-        cursor.execute("UPDATE tbl_order SET store_id = NULL WHERE store_id = %s", (store_id,))
-        cursor.execute("UPDATE tbl_products SET store_id = NULL WHERE store_id = %s", (store_id,))
-        cursor.execute("UPDATE tbl_category SET store_id = NULL WHERE store_id = %s", (store_id,))
-        cursor.execute("UPDATE tbl_users SET store_id = NULL WHERE store_id = %s", (store_id,)) # Users can also be tied to a store
-
-        # Finally, delete the store itself
-        cursor.execute("DELETE FROM tbl_stores WHERE store_id = %s", (store_id,))
-        conn.commit()
-        print(f"Viewer store (ID: {store_id}) and its associated data deleted successfully.")
+        reclaimed = janitor.delete_store(conn, store_id)
+        print(f"Viewer store (ID: {store_id}) and its associated data deleted successfully: {reclaimed}")
         return True
     except mysql.connector.Error as err:
-        conn.rollback()
         print(f"Error deleting viewer store (ID: {store_id}) and data: {err}")
         return False
-    finally:
-        if cursor: # Ensure cursor is closed
-            cursor.close()
-        if conn:
-            conn.close()
+
+def bump_stock_version(cursor, *products_ids):
+    """Stock shows in the product dropdowns: bumps the 'products' data version of every store holding these products."""
+    placeholders = ', '.join(['%s'] * len(products_ids))
+    data_versions.bump_stores_of(cursor, 'products', f"SELECT store_id FROM tbl_products WHERE products_id IN ({placeholders})", products_ids)
 
 
 # --- Role-based Access Control (RBAC) Decorators ---
@@ -149,26 +297,14 @@ def index():
         'satisfaction': 0
     }
 
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-
-            # 1. ดึงจำนวนผู้ใช้งานทั้งหมดจาก tbl_users
-            cursor.execute("SELECT COUNT(*) FROM tbl_users")
-            # fetchone() จะ trả về một tuple, เราจึงเลือก item แรก ([0])
-            total_users = cursor.fetchone()[0]
-            stats['total_users'] = total_users
-
-            # 2. ดึงผลรวมของ quantity และ disquantity จาก tbl_order
-            cursor.execute("SELECT SUM(quantity), SUM(disquantity) FROM tbl_order")
-            order_data = cursor.fetchone()
-            total_quantity, total_disquantity = order_data
-
-            # ตรวจสอบว่าค่าที่ได้ไม่เป็น None (กรณีตารางว่าง)
-            total_quantity = total_quantity or 0
-            total_disquantity = total_disquantity or 0
-            
+    try:
+        # 1-2. อ่านตัวนับที่อัปเดตทีละส่วนจาก tbl_stats (แคชไว้ในหน่วยความจำ, ดู site_stats.py)
+        counters = site_stats.get_counters(get_production_db) # Site-wide, also for a sandboxed viewer
+        if counters:
+            stats['total_users'] = counters['total_users']
+            total_quantity = counters['total_quantity']
+            total_disquantity = counters['total_disquantity']
+
             # 3. คำนวณค่าขยะที่รีไซเคิล (disquantity ทั้งหมด)
             stats['recycled_waste'] = int(total_disquantity)
 
@@ -182,12 +318,8 @@ def index():
             # จัดรูปแบบให้เป็นจำนวนเต็ม
             stats['satisfaction'] = int(satisfaction_rate)
 
-        except Exception as e:
-            print(f"An error occurred: {e}")
-        finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+    except Exception as e:
+        print(f"An error occurred: {e}")
 
     # ส่งค่า stats ไปยัง template 'index.html'
     return render_template("index.html", stats=stats)
@@ -197,15 +329,19 @@ def login():
     """
     Handles user login.
     Authenticates user credentials against tbl_users table.
-    Sets session variables upon successful login and updates online status.
-    For 'viewer' role, a temporary store_id is created and assigned.
+    Sets session variables upon successful login and marks the user online (presence.py).
+    For 'viewer' role, a sandbox store (sandbox.py) or a temporary store_id is created and assigned.
     """
     msg = ''
     if request.method == 'POST' and 'email' in request.form and 'password' in request.form:
         email = request.form['email']
         password = request.form['password']
-        
-        conn = get_db_connection()
+
+        # Logging in again without logging out: drop the previous sandbox, accounts live in production
+        if session.pop('sandbox', None):
+            viewer_sandboxes.discard(session.get('store_id'))
+
+        conn = get_db()
         cursor = None # Initialize cursor to None
         if conn:
             try:
@@ -222,8 +358,13 @@ def login():
                     session['lastname'] = account['lastname']
                     session['role'] = account['role']
                     
+                    # Viewers get a private in-memory store that costs the database nothing
+                    if account['role'] == 'viewer' and VIEWER_SANDBOX:
+                        session['store_id'], session['store_name'] = viewer_sandboxes.create(account)
+                        session['sandbox'] = True
+                        print(f"Viewer (ID: {account['id']}) logged in to sandbox store: {session['store_id']}")
                     # Logic for Viewer to create a new, temporary store_id
-                    if account['role'] == 'viewer':
+                    elif account['role'] == 'viewer':
                         try:
                             new_temp_store_id, new_temp_store_name = generate_unique_store_id(conn, cursor)
                             session['store_id'] = new_temp_store_id
@@ -243,9 +384,8 @@ def login():
                         else:
                             session['store_name'] = 'ไม่มีร้านค้า' # For root_admin/administrator/member without a specific store
 
-                    # Update user's online status to TRUE
-                    cursor.execute("UPDATE tbl_users SET is_online = TRUE WHERE id = %s", (account['id'],))
-                    conn.commit()
+                    # Online status is tracked in memory and written to is_online in batches
+                    presence_tracker.touch(account['id'], session['store_id'], account['email'])
 
                     msg = 'เข้าสู่ระบบสำเร็จ!'
                     flash(msg, 'success')
@@ -259,8 +399,6 @@ def login():
             finally:
                 if cursor:
                     cursor.close()
-                if conn:
-                    conn.close()
     return render_template('login.html', msg=msg)
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -277,7 +415,7 @@ def register():
         email = request.form['email']
         password = request.form['password']
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = None # Initialize cursor to None
         if conn:
             try:
@@ -295,6 +433,10 @@ def register():
                     # Default role is 'member', store_id is NULL by default or can be set by admin later
                     # New user is offline by default
                     cursor.execute('INSERT INTO tbl_users (firstname, lastname, email, password, role, is_online) VALUES (%s, %s, %s, %s, %s, FALSE)', (firstname, lastname, email, password, 'member',))
+                    new_user_id = cursor.lastrowid # Read before the tbl_stats upsert resets it
+                    site_stats.bump(cursor, total_users=1)
+                    search_index.reindex(cursor, 'user', [new_user_id])
+                    data_versions.bump(cursor, 'users') # No store yet: only the all-stores lists change
                     conn.commit()
                     msg = 'คุณสมัครสมาชิกสำเร็จแล้ว!'
                     flash(msg, 'success')
@@ -305,8 +447,6 @@ def register():
             finally:
                 if cursor:
                     cursor.close()
-                if conn:
-                    conn.close()
     elif request.method == 'POST':
         msg = 'กรุณากรอกข้อมูลให้ครบถ้วน!'
         flash(msg, 'danger')
@@ -328,7 +468,7 @@ def profile():
 
     # Calculate user statistics
     if 'loggedin' in session and 'email' in session:
-        stats_conn = get_db_connection()
+        stats_conn = get_db()
         if stats_conn:
             try:
                 cursor = stats_conn.cursor()
@@ -347,7 +487,6 @@ def profile():
             finally:
                 if 'cursor' in locals() and cursor:
                     cursor.close()
-                stats_conn.close()
 
     # Handle profile update form submission
     if request.method == 'POST':
@@ -365,7 +504,7 @@ def profile():
         is_password_set = new_password and len(new_password.strip()) > 0
         needs_security_check = is_email_changed or is_password_set
 
-        update_conn = get_db_connection()
+        update_conn = get_db()
         if update_conn:
             try:
                 cursor = update_conn.cursor(dictionary=True)
@@ -400,6 +539,8 @@ def profile():
                 
                 update_query = f"UPDATE tbl_users SET {', '.join(update_query_parts)} WHERE id = %s"
                 cursor.execute(update_query, tuple(update_params))
+                search_index.reindex(cursor, 'user', [session['id']])
+                data_versions.bump(cursor, 'users') # Name/email show in the user dropdowns (rare: bump every store)
                 update_conn.commit()
                 
                 # Update Session
@@ -412,7 +553,6 @@ def profile():
             finally:
                 if 'cursor' in locals() and cursor:
                     cursor.close()
-                update_conn.close()
         else:
             flash('ไม่สามารถเชื่อมต่อฐานข้อมูลได้', 'danger')
 
@@ -451,7 +591,7 @@ def delete_account():
     if not password:
         return jsonify({'status': 'error', 'message': 'กรุณากรอกรหัสผ่านเพื่อยืนยัน'}), 400
 
-    conn = get_db_connection()
+    conn = get_db()
     if not conn:
         return jsonify({'status': 'error', 'message': 'ไม่สามารถเชื่อมต่อฐานข้อมูล'}), 500
     
@@ -470,6 +610,9 @@ def delete_account():
             
             # ลบข้อมูลผู้ใช้
             cursor.execute('DELETE FROM tbl_users WHERE id = %s', (session['id'],))
+            site_stats.bump(cursor, total_users=-cursor.rowcount)
+            search_index.reindex(cursor, 'user', [session['id']])
+            data_versions.bump(cursor, 'users')
             
             # commit การเปลี่ยนแปลง
             conn.commit()
@@ -494,29 +637,18 @@ def delete_account():
         # ปิด cursor และ connection เสมอ
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
         
 @app.route('/logout')
 def logout():
-    """Logs out the current user by clearing session variables and updates online status.
-    For 'viewer' role, deletes the temporary store and its data."""
-    conn = get_db_connection()
-    if conn and session.get('id'): # Only connect if session ID exists
-        cursor = conn.cursor()
-        try:
-            cursor.execute("UPDATE tbl_users SET is_online = FALSE WHERE id = %s", (session['id'],))
-            conn.commit()
-        except mysql.connector.Error as err:
-            print(f"Error updating online status on logout: {err}")
-        finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
-
-    # If the user was a viewer, delete their temporary store and all its data
-    if session.get('role') == 'viewer' and session.get('store_id'):
+    """Logs out the current user by clearing session variables and marks them offline (presence.py).
+    For 'viewer' role, discards the sandbox or deletes the temporary store and its data."""
+    if session.get('id'):
+        presence_tracker.leave(session['id'])
+
+    # If the user was a viewer, throw their sandbox away (or delete their temporary store and all its data)
+    if session.pop('sandbox', None):
+        viewer_sandboxes.discard(session.get('store_id'))
+    elif session.get('role') == 'viewer' and session.get('store_id'):
         delete_viewer_store_and_data(session['store_id'])
 
     session.pop('loggedin', None)
@@ -562,7 +694,7 @@ def tbl_stores():
     Supports adding, editing, deleting, and searching stores.
     """
     msg = ''
-    conn = get_db_connection()
+    conn = get_db()
     cursor = None # Initialize cursor to None
     if not conn:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
@@ -586,6 +718,7 @@ def tbl_stores():
                 try:
                     cursor.execute("INSERT INTO tbl_stores (store_name, address, phone, moderator_user_id) VALUES (%s, %s, %s, %s)",
                                    (store_name, address, phone, moderator_user_id))
+                    data_versions.bump(cursor, 'stores', cursor.lastrowid)
                     conn.commit()
                     msg = 'เพิ่มร้านค้าสำเร็จ!'
                     flash(msg, 'success')
@@ -602,6 +735,7 @@ def tbl_stores():
                 try:
                     cursor.execute("UPDATE tbl_stores SET store_name = %s, address = %s, phone = %s, moderator_user_id = %s WHERE store_id = %s",
                                    (store_name, address, phone, moderator_user_id, store_id))
+                    data_versions.bump(cursor, 'stores', store_id)
                     conn.commit()
                     msg = 'อัปเดตร้านค้าสำเร็จ!'
                     flash(msg, 'success')
@@ -616,6 +750,7 @@ def tbl_stores():
                     cursor.execute("UPDATE tbl_products SET store_id = NULL WHERE store_id = %s", (store_id,))
                     cursor.execute("UPDATE tbl_order SET store_id = NULL WHERE store_id = %s", (store_id,))
                     cursor.execute("UPDATE tbl_users SET store_id = NULL WHERE store_id = %s", (store_id,))
+                    data_versions.bump(cursor, ('orders', 'stores', 'categories', 'products', 'users'), store_id)
 
                     cursor.execute("DELETE FROM tbl_stores WHERE store_id = %s", (store_id,))
                     conn.commit()
@@ -650,8 +785,6 @@ def tbl_stores():
     finally:
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
     return render_template("tbl_stores.html", stores=stores, users=users, search='', msg=msg)
 
 # --- Category Management ---
@@ -664,7 +797,7 @@ def tbl_category():
     Moderators/Members/Viewers can only manage categories for their assigned store.
     """
     msg = ''
-    conn = get_db_connection()
+    conn = get_db()
     cursor = None
     if not conn:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
@@ -706,6 +839,7 @@ def tbl_category():
                 
                 try:
                     cursor.execute("INSERT INTO tbl_category (category_id, category_name, store_id) VALUES (%s, %s, %s)", (category_id, category_name, op_store_id))
+                    data_versions.bump(cursor, 'categories', op_store_id)
                     conn.commit()
                     msg = 'เพิ่มหมวดหมู่สำเร็จ!'
                     flash(msg, 'success')
@@ -729,8 +863,15 @@ def tbl_category():
                         return redirect(url_for('tbl_category'))
                 
                 try:
+                    # Products show the category name in search results: reindex those under the old and new id
+                    affected_products = search_index.ids_where(cursor, 'product', "p.category_id = (SELECT category_id FROM tbl_category WHERE id = %s)", (cat_db_id,))
+                    cursor.execute("SELECT store_id FROM tbl_category WHERE id = %s", (cat_db_id,))
+                    old_category = cursor.fetchone()
                     # Update category with new values, including store_id
                     cursor.execute("UPDATE tbl_category SET category_id = %s, category_name = %s, store_id = %s WHERE id = %s", (category_id, category_name, op_store_id, cat_db_id))
+                    affected_products += search_index.ids_where(cursor, 'product', "p.category_id = %s", (category_id,))
+                    search_index.reindex(cursor, 'product', affected_products)
+                    data_versions.bump(cursor, 'categories', old_category['store_id'] if old_category else None, op_store_id)
                     conn.commit()
                     msg = 'อัปเดตหมวดหมู่สำเร็จ!'
                     flash(msg, 'success')
@@ -749,10 +890,15 @@ def tbl_category():
                         return redirect(url_for('tbl_category'))
 
                 try:
+                    affected_products = search_index.ids_where(cursor, 'product', "p.category_id = (SELECT category_id FROM tbl_category WHERE id = %s)", (cat_db_id,))
                     cursor.execute("UPDATE tbl_products SET category_id = NULL WHERE category_id = (SELECT category_id FROM tbl_category WHERE id = %s)", (cat_db_id,))
+                    search_index.reindex(cursor, 'product', affected_products)
                     conn.commit()
 
+                    cursor.execute("SELECT store_id FROM tbl_category WHERE id = %s", (cat_db_id,))
+                    deleted_category = cursor.fetchone()
                     cursor.execute("DELETE FROM tbl_category WHERE id = %s", (cat_db_id,))
+                    data_versions.bump(cursor, 'categories', deleted_category['store_id'] if deleted_category else None)
                     conn.commit()
                     msg = 'ลบหมวดหมู่สำเร็จ!'
                     flash(msg, 'success')
@@ -801,9 +947,10 @@ def tbl_category():
     finally:
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
     return render_template("tbl_category.html", categories=categories, search='', msg=msg, stores=stores)
+
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 50)) # Ranked search results per page (products, users)
+
 @app.route("/tbl_products", methods=["GET", "POST"]) 
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer']) # Allow viewer access 
 def tbl_products(): 
@@ -813,7 +960,8 @@ def tbl_products():
     Moderators/Members/Viewers can only manage products for their assigned store. 
     """ 
     msg = '' 
-    conn = get_db_connection() 
+    search_query = request.args.get('search', '').strip() 
+    conn = get_db() 
     cursor = None # Initialize cursor to None 
     if not conn: 
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger') 
@@ -821,29 +969,13 @@ def tbl_products():
     try: 
         cursor = conn.cursor(dictionary=True) 
          
-        # Fetch stores for dropdown (all for root_admin/administrator, only assigned for moderator/member/viewer) 
-        stores = [] 
+        # Stores and categories for the modal dropdowns, from the reference-data cache (see ref_data.py): 
+        # everything for root_admin/administrator, only the assigned store for moderator/member/viewer 
+        stores, categories = [], [] 
         if session.get('role') in ['root_admin', 'administrator']: 
-            cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name") 
-            stores = cursor.fetchall() 
-        elif session.get('role') in ['moderator', 'member', 'viewer']: 
-            # Moderator/Member/Viewer can only see their own store 
-            if session.get('store_id'): 
-                cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (session['store_id'],)) 
-                store_info = cursor.fetchone() 
-                if store_info: 
-                    stores = [store_info] 
-
-
-        # Fetch all categories for the product dropdowns in modals (filtered by store_id for moderators/members/viewers) 
-        category_base_query = "SELECT category_id, category_name FROM tbl_category" 
-        category_query_params = () 
-        if session.get('role') in ['moderator', 'member', 'viewer']: 
-            category_base_query += " WHERE store_id = %s" 
-            category_query_params = (session.get('store_id'),) 
-        category_base_query += " ORDER BY category_name" 
-        cursor.execute(category_base_query, category_query_params) 
-        categories = cursor.fetchall() 
+            stores, categories = ref_data.get(conn, ('stores', None), ('categories', None)) 
+        elif session.get('store_id'): 
+            stores, categories = ref_data.get(conn, ('stores', session['store_id']), ('categories', session['store_id'])) 
 
         if request.method == "POST": 
             action = request.form.get('action') 
@@ -873,6 +1005,8 @@ def tbl_products():
                     # *** ลบ barcode_id ออกจาก INSERT Statement ***
                     cursor.execute("INSERT INTO tbl_products (products_id, products_name, stock, price, category_id, description, store_id) VALUES (%s, %s, %s, %s, %s, %s, %s)",  
                                    (products_id, product_name, stock, price, category_id, description, op_store_id)) 
+                    search_index.reindex(cursor, 'product', [cursor.lastrowid]) 
+                    data_versions.bump(cursor, 'products', op_store_id) 
                     conn.commit() 
                     msg = 'เพิ่มสินค้าสำเร็จ!' 
                     flash(msg, 'success') 
@@ -903,6 +1037,8 @@ def tbl_products():
                     # *** ลบ barcode_id ออกจาก UPDATE Statement ***
                     cursor.execute("UPDATE tbl_products SET products_id = %s, products_name = %s, stock = %s, price = %s, category_id = %s, description = %s WHERE id = %s",  
                                    (products_id, product_name, stock, price, category_id, description, product_db_id)) 
+                    search_index.reindex(cursor, 'product', [product_db_id]) 
+                    data_versions.bump(cursor, ('orders', 'products')) # Order reports show the product's price, dropdowns its name and stock 
                     conn.commit() 
                     msg = 'อัปเดตสินค้าสำเร็จ!' 
                     flash(msg, 'success') 
@@ -928,9 +1064,12 @@ def tbl_products():
                     actual_products_id = cursor.fetchone()['products_id'] 
 
                     cursor.execute("UPDATE tbl_order SET products_id = NULL WHERE products_id = %s", (actual_products_id,)) 
+                    data_versions.bump(cursor, 'orders') 
                     conn.commit() # Commit update before delete 
 
                     cursor.execute("DELETE FROM tbl_products WHERE id = %s", (product_db_id,)) 
+                    search_index.reindex(cursor, 'product', [product_db_id]) 
+                    data_versions.bump(cursor, 'products') 
                     conn.commit() 
                     msg = 'ลบสินค้าสำเร็จ!' 
                     flash(msg, 'success') 
@@ -939,23 +1078,39 @@ def tbl_products():
                     flash(msg, 'danger') 
             elif 'search' in request.form: 
                 search_query = request.form['search'] 
-                base_query = """ 
-                    SELECT p.*, c.category_name, s.store_name 
-                    FROM tbl_products p 
-                    LEFT JOIN tbl_category c ON p.category_id = c.category_id 
-                    LEFT JOIN tbl_stores s ON p.store_id = s.store_id 
-                    WHERE (p.products_name LIKE %s OR p.products_id LIKE %s OR c.category_name LIKE %s) 
-                """ 
-                query_params = ('%' + search_query + '%', '%' + search_query + '%', '%' + search_query + '%') 
-
-                if session.get('role') in ['moderator', 'member', 'viewer']: # Filter by store for moderator/member/viewer 
-                    base_query += " AND p.store_id = %s" 
-                    query_params += (session.get('store_id'),) 
-                 
-                base_query += " ORDER BY p.id DESC" 
-                cursor.execute(base_query, tuple(query_params)) 
+
+        # Search results, ranked by the search index (search_index.py) and paginated with ?page=
+        if search_query: 
+            page_args = parse_page_args(request.args, SEARCH_PAGE_SIZE) 
+            base_query = """ 
+                SELECT p.*, c.category_name, s.store_name 
+                FROM tbl_products p 
+                LEFT JOIN tbl_category c ON p.category_id = c.category_id 
+                LEFT JOIN tbl_stores s ON p.store_id = s.store_id 
+            """ 
+            filter_clauses, filter_params = [], [] 
+            if session.get('role') in ['moderator', 'member', 'viewer']: # Filter by store for moderator/member/viewer 
+                filter_clauses.append("p.store_id = %s") 
+                filter_params.append(session.get('store_id')) 
+
+            ranked = search_index.search(cursor, 'product', search_query, filter_clauses, filter_params, 
+                                         per_page=page_args['per_page'], page=page_args['page']) 
+            if ranked is None: 
+                # One-character terms have no n-gram: fall back to LIKE 
+                like_clauses = ["p.products_name LIKE %s OR p.products_id LIKE %s OR c.category_name LIKE %s"] + filter_clauses 
+                cursor.execute(base_query + " WHERE " + " AND ".join(f"({c})" for c in like_clauses) + " ORDER BY p.id DESC LIMIT %s OFFSET %s", 
+                               tuple(['%' + search_query + '%'] * 3 + filter_params + [page_args['per_page'] + 1, (page_args['page'] - 1) * page_args['per_page']])) 
                 products = cursor.fetchall() 
-                return render_template("tbl_products.html", products=products, categories=categories, search=search_query, msg=msg, stores=stores) 
+                has_more = len(products) > page_args['per_page'] 
+                products = products[:page_args['per_page']] 
+            else: 
+                ids, has_more = ranked 
+                products = [] 
+                if ids: 
+                    cursor.execute(base_query + " WHERE p.id IN (" + ", ".join(["%s"] * len(ids)) + ")", tuple(ids)) 
+                    products = search_index.order_by_ids(cursor.fetchall(), ids) 
+            page = numbered_page(page_args['page'], page_args['per_page'], has_more) 
+            return render_template("tbl_products.html", products=products, categories=categories, search=search_query, msg=msg, stores=stores, page=page) 
 
         # Fetch all products for initial display (filtered by store_id for moderators/members/viewers) 
         base_query = """ 
@@ -977,22 +1132,26 @@ def tbl_products():
     finally: 
         if cursor: 
             cursor.close() 
-        if conn: 
-            conn.close() 
     return render_template("tbl_products.html", products=products, categories=categories, search='', msg=msg, stores=stores)
 
 # --- Order Management ---
+ORDER_PAGE_SIZE = int(os.environ.get('ORDER_PAGE_SIZE', 50)) # Orders per page; ?per_page= overrides up to pagination.MAX_PAGE_SIZE
+
 @app.route("/tbl_order", methods=["GET", "POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def tbl_order():
     """
     Manages customer orders, including quantity tracking and disposed quantity.
     Supports adding, editing, deleting, and searching orders.
+    Search results are not ranked like the product and user searches: the search index only
+    filters the listing, which stays newest first with keyset pages (see pagination.py).
     Stock is updated based on ordered quantity.
     Moderators/Members/Viewers can only view/manage orders related to their store.
     """
     msg = ''
-    conn = get_db_connection()
+    search_query = request.args.get('search', '').strip()
+    page = None # Keyset cursors for the next/prev links (see pagination.py)
+    conn = get_db()
     cursor = None # Initialize cursor to None
     if not conn:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
@@ -1000,39 +1159,18 @@ def tbl_order():
     try:
         cursor = conn.cursor(dictionary=True)
         
-        # Fetch stores for dropdown (all for root_admin/administrator, only assigned for moderator/member/viewer)
-        stores = []
-        if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name")
-            stores = cursor.fetchall()
-        elif session.get('role') in ['moderator', 'member', 'viewer']: # Viewer can also see their store
-            # Moderator/Member/Viewer can only see their own store
-            if session.get('store_id'):
-                cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (session['store_id'],))
-                store_info = cursor.fetchone()
-                if store_info:
-                    stores = [store_info]
-
-
-        # Fetch all products for the product dropdowns in modals (filtered by store_id)
-        product_base_query = "SELECT products_id, products_name, stock, price, barcode_id, store_id FROM tbl_products"
-        product_query_params = ()
-        if session.get('role') in ['moderator', 'member', 'viewer']:
-            product_base_query += " WHERE store_id = %s"
-            product_query_params = (session.get('store_id'),)
-        product_base_query += " ORDER BY products_name"
-        cursor.execute(product_base_query, product_query_params)
-        products_data = cursor.fetchall()
-
-        users_data = []
-        # Fetch all users for the email dropdown in modals (filtered by store_id for moderators/members/viewers)
+        # Stores, products and users for the modal dropdowns, from the reference-data cache (see ref_data.py):
+        # everything for root_admin/administrator, only the assigned store for moderator/member/viewer
+        stores, products_data, users_data = [], [], []
         if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users ORDER BY firstname")
-            users_data = cursor.fetchall()
-        elif session.get('role') in ['moderator', 'viewer']:
-            cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users WHERE store_id = %s AND (role = 'member' OR role = 'viewer') ORDER BY firstname", (session.get('store_id'),))
-            users_data = cursor.fetchall()
-        elif session.get('role') == 'member': # Member can only select their own email
+            stores, products_data, users_data = ref_data.get(conn, ('stores', None), ('products', None), ('users', None))
+        elif session.get('store_id'):
+            dropdown_keys = [('stores', session['store_id']), ('products', session['store_id'])]
+            if session.get('role') in ['moderator', 'viewer']: # Members and viewers of the store
+                dropdown_keys.append(('users', session['store_id'], 'members'))
+            stores, products_data, *store_users = ref_data.get(conn, *dropdown_keys)
+            users_data = store_users[0] if store_users else []
+        if session.get('role') == 'member': # Member can only select their own email
             users_data = [{'email': session['email'], 'fullname': f"{session['firstname']} {session['lastname']}"}]
 
 
@@ -1045,6 +1183,8 @@ def tbl_order():
                 op_store_id = request.form.get('store_id') # Admins can specify
             elif session.get('role') in ['moderator', 'member', 'viewer']:
                 op_store_id = session.get('store_id') # Moderator/Member/Viewer restricted to their store
+            # Stock updates are scoped to the caller's store too (admins: any store), like cart_ops
+            stock_store_id = None if session.get('role') in ['root_admin', 'administrator'] else session.get('store_id')
 
             if not op_store_id and session.get('role') in ['moderator', 'member', 'viewer']: # Ensure they have a store_id
                  flash("คุณไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.", 'danger')
@@ -1059,6 +1199,9 @@ def tbl_order():
                 quantity = int(request.form['quantity'])
                 disquantity = int(request.form['disquantity'])
                 barcode_id = request.form['barcode_id'].strip() if request.form['barcode_id'] else None 
+                if barcode_id and not is_order_barcode(barcode_id):
+                    flash(f"บาร์โค้ด '{barcode_id}' ไม่ใช่บาร์โค้ดคำสั่งซื้อที่ระบบออกให้", 'danger')
+                    return redirect(url_for('tbl_order'))
                 
                 # Determine order email based on user role and store_id
                 email = request.form.get('email')
@@ -1076,23 +1219,24 @@ def tbl_order():
 
                 # All roles allowed to modify data in their respective stores
                 try: # Wrapped in an inner try-except for specific add errors
-                    # Validate product existence, stock availability AND store_id
-                    cursor.execute("SELECT products_name, stock, price, store_id FROM tbl_products WHERE products_id = %s", (products_id,))
+                    # Validate product existence AND store_id
+                    cursor.execute("SELECT products_name, store_id FROM tbl_products WHERE products_id = %s", (products_id,))
                     product_info = cursor.fetchone()
                     
                     if not product_info:
                         msg = "ไม่พบสินค้า!"
                         flash(msg, 'danger')
-                    # Ensure product_info['stock'] and product_info['price'] are treated as numbers
-                    # Default to 0 if they are None (though DB schema has NOT NULL DEFAULT 0, defensive check)
-                    product_stock = int(product_info['stock'] or 0)
-                    product_price = float(product_info['price'] or 0.0)
-
                     # Admins are not restricted by store_id
-                    if product_info['store_id'] != op_store_id and session.get('role') not in ['root_admin', 'administrator']: # Ensure product belongs to the current store context
+                    elif product_info['store_id'] != op_store_id and session.get('role') not in ['root_admin', 'administrator']: # Ensure product belongs to the current store context
                         msg = "สินค้าไม่ได้อยู่ในร้านค้าที่คุณเลือก/รับผิดชอบ!"
                         flash(msg, 'danger')
-                    elif quantity > product_stock:
+                    elif quantity <= 0:
+                        msg = "จำนวนสินค้าต้องมากกว่า 0"
+                        flash(msg, 'danger')
+                    # Stock is checked and deducted in one statement, in the same transaction as the insert
+                    elif not inventory.take(cursor, products_id, quantity, stock_store_id):
+                        conn.rollback()
+                        product_stock = inventory.shortage(cursor, products_id, stock_store_id)[1]
                         msg = f"สินค้า {product_info['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {product_stock}"
                         flash(msg, 'danger')
                     else:
@@ -1103,15 +1247,18 @@ def tbl_order():
                             INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id)
                             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                         """, (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, op_store_id))
-                        
-                        # Update product stock (deduct ordered quantity)
-                        cursor.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (quantity, products_id))
+                        new_order_row_id = cursor.lastrowid
+                        site_stats.bump(cursor, total_quantity=quantity, total_disquantity=disquantity)
+                        search_index.reindex(cursor, 'order', [new_order_row_id])
+                        data_versions.bump(cursor, 'orders', op_store_id)
+                        bump_stock_version(cursor, products_id)
                         conn.commit()
                         msg = 'เพิ่มคำสั่งซื้อสำเร็จและอัปเดตสต็อกสินค้าแล้ว!'
                         flash(msg, 'success')
                 except mysql.connector.Error as err:
                     msg = f"เกิดข้อผิดพลาดในการเพิ่มคำสั่งซื้อ: {err}"
                     flash(msg, 'danger')
+                    conn.rollback() # Gives back stock taken before a failed insert
             elif action == 'edit':
                 ord_id = request.form['ord_id']
                 order_id = request.form['order_id']
@@ -1141,7 +1288,7 @@ def tbl_order():
 
                 try:
                     # Get current order information to calculate stock change
-                    cursor.execute("SELECT products_id, quantity, store_id FROM tbl_order WHERE id = %s", (ord_id,))
+                    cursor.execute("SELECT products_id, quantity, disquantity, store_id, barcode_id FROM tbl_order WHERE id = %s", (ord_id,))
                     old_order_info = cursor.fetchone()
 
                     if not old_order_info:
@@ -1150,6 +1297,13 @@ def tbl_order():
                         conn.rollback()
                         return redirect(url_for('tbl_order'))
 
+                    # Only a changed barcode is checked: orders with legacy barcodes (typed in or
+                    # issued before the barcode counter) stay editable
+                    if barcode_id and barcode_id != old_order_info['barcode_id'] and not is_order_barcode(barcode_id):
+                        flash(f"บาร์โค้ด '{barcode_id}' ไม่ใช่บาร์โค้ดคำสั่งซื้อที่ระบบออกให้", 'danger')
+                        conn.rollback()
+                        return redirect(url_for('tbl_order'))
+
                     # Admins are not restricted by store_id
                     if old_order_info['store_id'] != op_store_id and session.get('role') not in ['root_admin', 'administrator']:
                         flash("คุณไม่มีสิทธิ์แก้ไขคำสั่งซื้อนี้ เพราะไม่ได้อยู่ในร้านค้าของคุณ/ที่รับผิดชอบ", 'danger')
@@ -1159,8 +1313,8 @@ def tbl_order():
                     old_products_id = old_order_info['products_id']
                     old_quantity = old_order_info['quantity']
 
-                    # Get new product information and its current stock
-                    cursor.execute("SELECT products_name, stock, store_id FROM tbl_products WHERE products_id = %s", (products_id,))
+                    # Get new product information
+                    cursor.execute("SELECT products_name, store_id FROM tbl_products WHERE products_id = %s", (products_id,))
                     new_product_info = cursor.fetchone()
 
                     if not new_product_info:
@@ -1169,9 +1323,6 @@ def tbl_order():
                         conn.rollback()
                         return redirect(url_for('tbl_order'))
                     
-                    # Ensure new_product_info['stock'] is treated as a number
-                    new_product_stock = int(new_product_info['stock'] or 0)
-
                     # Admins are not restricted by store_id
                     if new_product_info['store_id'] != op_store_id and session.get('role') not in ['root_admin', 'administrator']:
                         flash("สินค้าใหม่ที่เลือกไม่ได้อยู่ในร้านค้าที่คุณเลือก/รับผิดชอบ!", 'danger')
@@ -1180,33 +1331,32 @@ def tbl_order():
 
                     products_name = new_product_info['products_name']
                     
-                    # --- Stock Adjustment Logic ---
+                    # --- Stock Adjustment Logic (checked and applied atomically, see inventory.py) ---
                     if products_id != old_products_id:
-                        # If product ID changes, restore old product's stock
-                        cursor.execute("UPDATE tbl_products SET stock = stock + %s WHERE products_id = %s", (old_quantity, old_products_id))
-                        
-                        # Then deduct from the new product's stock
-                        if quantity > new_product_stock: # Check if new quantity exceeds available stock
-                            msg = f"สินค้า {products_name} มีสต็อกไม่พอสำหรับการสั่งซื้อใหม่. มีในสต็อก: {new_product_stock}"
-                            flash(msg, 'danger')
+                        # If product ID changes, restore old product's stock, then deduct from the new product's stock
+                        inventory.give_back(cursor, old_products_id, old_quantity, stock_store_id)
+                        if not inventory.take(cursor, products_id, quantity, stock_store_id):
                             conn.rollback() # Rollback if stock is insufficient
+                            msg = f"สินค้า {products_name} มีสต็อกไม่พอสำหรับการสั่งซื้อใหม่. มีในสต็อก: {inventory.shortage(cursor, products_id, stock_store_id)[1]}"
+                            flash(msg, 'danger')
                             return redirect(url_for('tbl_order'))
-                        cursor.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (quantity, products_id))
                     else:
                         # If product ID is the same, adjust stock based on the difference in quantity
-                        quantity_difference = quantity - old_quantity
-                        if new_product_stock - quantity_difference < 0: # Check if stock becomes negative
-                            msg = f"สินค้า {products_name} มีสต็อกไม่พอสำหรับการเปลี่ยนแปลงจำนวน. มีในสต็อก: {new_product_stock}"
-                            flash(msg, 'danger')
+                        if not inventory.take(cursor, products_id, quantity - old_quantity, stock_store_id):
                             conn.rollback() # Rollback if stock is insufficient
+                            msg = f"สินค้า {products_name} มีสต็อกไม่พอสำหรับการเปลี่ยนแปลงจำนวน. มีในสต็อก: {inventory.shortage(cursor, products_id, stock_store_id)[1]}"
+                            flash(msg, 'danger')
                             return redirect(url_for('tbl_order'))
-                        cursor.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (quantity_difference, products_id))
                     
                     # Update the order in tbl_order with new values, including disquantity, barcode_id, and store_id
                     cursor.execute("""
                         UPDATE tbl_order SET order_id = %s, products_id = %s, products_name = %s, quantity = %s, disquantity = %s, email = %s, barcode_id = %s, store_id = %s
                         WHERE id = %s
                     """, (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, op_store_id, ord_id))
+                    site_stats.bump(cursor, total_quantity=quantity - old_quantity, total_disquantity=disquantity - old_order_info['disquantity'])
+                    search_index.reindex(cursor, 'order', [ord_id])
+                    data_versions.bump(cursor, 'orders', old_order_info['store_id'], op_store_id)
+                    bump_stock_version(cursor, old_products_id, products_id)
                     conn.commit()
                     msg = 'อัปเดตคำสั่งซื้อสำเร็จและอัปเดตสต็อกสินค้าแล้ว!'
                     flash(msg, 'success')
@@ -1237,7 +1387,7 @@ def tbl_order():
 
                 try:
                     # Get order information before deleting to restore stock
-                    cursor.execute("SELECT products_id, quantity, store_id FROM tbl_order WHERE id = %s", (ord_id,))
+                    cursor.execute("SELECT products_id, quantity, disquantity, store_id FROM tbl_order WHERE id = %s", (ord_id,))
                     order_to_delete = cursor.fetchone()
 
                     if not order_to_delete:
@@ -1258,7 +1408,11 @@ def tbl_order():
                     # Delete the order from tbl_order
                     cursor.execute("DELETE FROM tbl_order WHERE id = %s", (ord_id,))
                     # Restore product stock in tbl_products (based on original ordered quantity)
-                    cursor.execute("UPDATE tbl_products SET stock = stock + %s WHERE products_id = %s", (quantity_to_restore, product_id_to_restore))
+                    inventory.give_back(cursor, product_id_to_restore, quantity_to_restore, stock_store_id)
+                    site_stats.bump(cursor, total_quantity=-quantity_to_restore, total_disquantity=-order_to_delete['disquantity'])
+                    search_index.reindex(cursor, 'order', [ord_id])
+                    data_versions.bump(cursor, 'orders', order_to_delete['store_id'])
+                    bump_stock_version(cursor, product_id_to_restore)
                     conn.commit()
                     msg = 'ลบคำสั่งซื้อสำเร็จและคืนสต็อกสินค้าแล้ว!'
                     flash(msg, 'success')
@@ -1267,42 +1421,36 @@ def tbl_order():
                     flash(msg, 'danger')
                     conn.rollback() # Rollback in case of error
             elif 'search' in request.form:
+                # Legacy POST search: show the first page of results
                 search_query = request.form['search']
-                query_params = ['%' + search_query + '%'] * 3
-                
-                base_query = """
-                    SELECT 
-                        o.*, 
-                        p.category_id,
-                        p.price,
-                        s.store_name -- Added store_name from tbl_stores
-                    FROM tbl_order o
-                    LEFT JOIN tbl_products p ON o.products_id = p.products_id
-                    LEFT JOIN tbl_stores s ON o.store_id = s.store_id
-                    WHERE (o.order_id LIKE %s OR o.products_name LIKE %s OR o.email LIKE %s)
-                """
-                if session.get('role') == 'member':
-                    base_query += " AND o.email = %s AND o.store_id = %s"
-                    query_params.append(session['email'])
-                    query_params.append(session['store_id'])
-                elif session.get('role') in ['moderator', 'viewer']: # Viewer now acts like moderator
-                    base_query += " AND o.store_id = %s"
-                    query_params.append(session['store_id'])
-
-                base_query += " ORDER BY o.id DESC"
-                cursor.execute(base_query, tuple(query_params))
-                orders_raw = cursor.fetchall()
-
-                orders = []
-                for order_raw in orders_raw:
-                    order = order_raw.copy()
-                    order['price'] = float(order['price'] or 0.0) # Ensure price is float
-                    orders.append(order)
-
-                return render_template("tbl_order.html", orders=orders, products=products_data, users=users_data, search=search_query, msg=msg, stores=stores)
-
-        # SQL query for initial display of orders, explicitly selecting barcode_id, price, and store_name
-        base_query = """
+
+        # Order listing (initial view and search results), one keyset page at a time.
+        # Searches arrive as GET ?search=... so the next/prev links can carry them.
+        page_args = parse_page_args(request.args, ORDER_PAGE_SIZE)
+
+        where_clauses = []
+        query_params = []
+        if search_query:
+            # Inverted-index lookup (search_index.py), unranked: the listing keeps its keyset order.
+            # One-character terms fall back to LIKE
+            index_match = search_index.match_condition('order', search_query, 'o.id')
+            if index_match:
+                where_clauses.append(index_match[0])
+                query_params.extend(index_match[1])
+            else:
+                where_clauses.append("o.order_id LIKE %s OR o.products_name LIKE %s OR o.email LIKE %s")
+                query_params.extend(['%' + search_query + '%'] * 3)
+        if session.get('role') == 'member' and search_query:
+            # Members searching see only their own orders
+            where_clauses.append("o.email = %s AND o.store_id = %s")
+            query_params.extend([session['email'], session['store_id']])
+        elif session.get('role') in ['moderator', 'member', 'viewer']: # For moderator/member/viewer, filter by their store
+            where_clauses.append("o.store_id = %s")
+            query_params.append(session.get('store_id'))
+
+        orders, page = keyset_page(
+            cursor,
+            """
             SELECT 
                 o.*, 
                 p.category_id,
@@ -1311,31 +1459,21 @@ def tbl_order():
             FROM tbl_order o
             LEFT JOIN tbl_products p ON o.products_id = p.products_id
             LEFT JOIN tbl_stores s ON o.store_id = s.store_id
-        """
-        query_params = ()
-        if session.get('role') in ['moderator', 'member', 'viewer']: # For moderator/member/viewer, filter by their store
-            base_query += " WHERE o.store_id = %s"
-            query_params = (session.get('store_id'),)
-
-        base_query += " ORDER BY o.id DESC"
-        cursor.execute(base_query, query_params)
-        orders_raw = cursor.fetchall()
+            """,
+            where_clauses, query_params, 'o.id',
+            after=page_args['after'], before=page_args['before'], per_page=page_args['per_page'],
+        )
 
         # Ensure price is converted to float for display
-        orders = []
-        for order_raw in orders_raw:
-            order = order_raw.copy()
+        for order in orders:
             order['price'] = float(order['price'] or 0.0) # Handle NoneType for price here for display
-            orders.append(order)
     except mysql.connector.Error as err:
         flash(f"เกิดข้อผิดพลาดในการดึงข้อมูลคำสั่งซื้อ: {err}", 'danger')
         orders = [] # Set orders to empty in case of error
     finally:
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
-    return render_template("tbl_order.html", orders=orders, products=products_data, users=users_data, search='', msg=msg, stores=stores)
+    return render_template("tbl_order.html", orders=orders, products=products_data, users=users_data, search=search_query, msg=msg, stores=stores, page=page)
 
 # --- User Management ---
 @app.route("/tbl_users", methods=["GET", "POST"])
@@ -1348,7 +1486,8 @@ def tbl_users():
     Moderators/Members can only manage 'member' and 'viewer' roles within their assigned store.
     """
     msg = ''
-    conn = get_db_connection()
+    search_query = request.args.get('search', '').strip()
+    conn = get_db()
     cursor = None # Initialize cursor to None
     if not conn:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
@@ -1364,17 +1503,12 @@ def tbl_users():
         except mysql.connector.Error as err:
             print(f"Error fetching root_admin_id: {err}")
 
-        # Fetch stores for dropdown (all for root_admin/administrator, only assigned for moderator/member)
+        # Stores for the dropdown from the reference-data cache (all for root_admin/administrator, only assigned for moderator/member)
         stores = []
         if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name")
-            stores = cursor.fetchall()
-        elif session.get('role') in ['moderator', 'member']: # Member can also see their store
-            if session.get('store_id'):
-                cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (session['store_id'],))
-                store_info = cursor.fetchone()
-                if store_info:
-                    stores = [store_info]
+            stores, = ref_data.get(conn, ('stores', None))
+        elif session.get('store_id'): # Member can also see their store
+            stores, = ref_data.get(conn, ('stores', session['store_id']))
 
 
         if request.method == "POST":
@@ -1431,6 +1565,10 @@ def tbl_users():
                 try:
                     # Add store_id to user insertion, new user is offline by default
                     cursor.execute('INSERT INTO tbl_users (firstname, lastname, email, password, role, store_id, is_online) VALUES (%s, %s, %s, %s, %s, %s, FALSE)', (firstname, lastname, email, password, role, op_store_id))
+                    new_user_id = cursor.lastrowid # Read before the tbl_stats upsert resets it
+                    site_stats.bump(cursor, total_users=1)
+                    search_index.reindex(cursor, 'user', [new_user_id])
+                    data_versions.bump(cursor, 'users', op_store_id)
                     conn.commit()
                     msg = 'เพิ่มผู้ใช้งานสำเร็จ!'
                     flash(msg, 'success')
@@ -1503,6 +1641,8 @@ def tbl_users():
                     # UPDATED: If email changes, update tbl_order
                     if email != old_email:
                         cursor.execute("UPDATE tbl_order SET email = %s WHERE email = %s", (email, old_email,))
+                        search_index.reindex(cursor, 'order', search_index.ids_where(cursor, 'order', "o.email = %s", (email,)))
+                        data_versions.bump(cursor, 'orders')
                         conn.commit() # Commit this update immediately
 
                     if password:
@@ -1511,6 +1651,8 @@ def tbl_users():
                     else:
                         cursor.execute('UPDATE tbl_users SET firstname = %s, lastname = %s, email = %s, role = %s, store_id = %s WHERE id = %s', 
                                         (firstname, lastname, email, role, op_store_id, user_id)) # Update store_id
+                    search_index.reindex(cursor, 'user', [user_id])
+                    data_versions.bump(cursor, 'users', target_user_store_id, op_store_id)
                     conn.commit()
                     msg = 'อัปเดตผู้ใช้งานสำเร็จ!'
                     flash(msg, 'success')
@@ -1573,11 +1715,17 @@ def tbl_users():
 
                 try:
                     # UPDATED: Set foreign keys to NULL in dependent tables before deleting user
+                    orphaned_orders = search_index.ids_where(cursor, 'order', "o.email = %s", (target_user_email,))
                     cursor.execute("UPDATE tbl_order SET email = NULL WHERE email = %s", (target_user_email,))
                     cursor.execute("UPDATE tbl_stores SET moderator_user_id = NULL WHERE moderator_user_id = %s", (user_id,))
+                    search_index.reindex(cursor, 'order', orphaned_orders)
+                    data_versions.bump(cursor, 'orders')
                     conn.commit() # Commit updates before delete
 
                     cursor.execute("DELETE FROM tbl_users WHERE id = %s", (user_id,))
+                    site_stats.bump(cursor, total_users=-cursor.rowcount)
+                    search_index.reindex(cursor, 'user', [user_id])
+                    data_versions.bump(cursor, 'users', target_user_store_id)
                     conn.commit()
                     msg = 'ลบผู้ใช้งานสำเร็จ!'
                     flash(msg, 'success')
@@ -1586,17 +1734,34 @@ def tbl_users():
                     flash(msg, 'danger')
             elif 'search' in request.form:
                 search_query = request.form.get('search')
-                base_query = "SELECT u.*, s.store_name FROM tbl_users u LEFT JOIN tbl_stores s ON u.store_id = s.store_id WHERE (u.firstname LIKE %s OR u.lastname LIKE %s OR u.email LIKE %s OR u.role LIKE %s)"
-                query_params = ('%' + search_query + '%', '%' + search_query + '%', '%' + search_query + '%', '%' + search_query + '%')
 
-                if session.get('role') in ['moderator', 'member']: # Filter by store for moderator/member
-                    base_query += " AND u.store_id = %s"
-                    query_params += (session.get('store_id'),)
-                
-                base_query += " ORDER BY u.id DESC"
-                cursor.execute(base_query, query_params)
+        # Search results, ranked by the search index (search_index.py) and paginated with ?page=
+        if search_query:
+            page_args = parse_page_args(request.args, SEARCH_PAGE_SIZE)
+            base_query = "SELECT u.*, s.store_name FROM tbl_users u LEFT JOIN tbl_stores s ON u.store_id = s.store_id"
+            filter_clauses, filter_params = [], []
+            if session.get('role') in ['moderator', 'member']: # Filter by store for moderator/member
+                filter_clauses.append("u.store_id = %s")
+                filter_params.append(session.get('store_id'))
+
+            ranked = search_index.search(cursor, 'user', search_query, filter_clauses, filter_params,
+                                         per_page=page_args['per_page'], page=page_args['page'])
+            if ranked is None:
+                # One-character terms have no n-gram: fall back to LIKE
+                like_clauses = ["u.firstname LIKE %s OR u.lastname LIKE %s OR u.email LIKE %s OR u.role LIKE %s"] + filter_clauses
+                cursor.execute(base_query + " WHERE " + " AND ".join(f"({c})" for c in like_clauses) + " ORDER BY u.id DESC LIMIT %s OFFSET %s",
+                               tuple(['%' + search_query + '%'] * 4 + filter_params + [page_args['per_page'] + 1, (page_args['page'] - 1) * page_args['per_page']]))
                 users = cursor.fetchall()
-                return render_template("tbl_users.html", users=users, search=search_query, msg=msg, stores=stores)
+                has_more = len(users) > page_args['per_page']
+                users = users[:page_args['per_page']]
+            else:
+                ids, has_more = ranked
+                users = []
+                if ids:
+                    cursor.execute(base_query + " WHERE u.id IN (" + ", ".join(["%s"] * len(ids)) + ")", tuple(ids))
+                    users = search_index.order_by_ids(cursor.fetchall(), ids)
+            page = numbered_page(page_args['page'], page_args['per_page'], has_more)
+            return render_template("tbl_users.html", users=users, search=search_query, msg=msg, stores=stores, page=page)
 
         # Fetch all users for initial display (filtered by store_id for moderators/members)
         base_query = "SELECT u.*, s.store_name FROM tbl_users u LEFT JOIN tbl_stores s ON u.store_id = s.store_id"
@@ -1613,55 +1778,174 @@ def tbl_users():
     finally:
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
     return render_template("tbl_users.html", users=users, search='', msg=msg, stores=stores)
 # --- Report Generation ---
 
+def order_report_filters(include_member_email=False):
+    """
+    Reads the order report filters from the query string: date_from / date_to (YYYY-MM-DD) and,
+    for admins, store_id. Other roles are always limited to their own store (members optionally
+    to their own orders too). Flashes and returns None when the input is invalid.
+    """
+    filters = {'date_from': None, 'date_to': None, 'store_id': None, 'email': None}
+    for name in ('date_from', 'date_to'):
+        value = request.args.get(name, '').strip()
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                flash("รูปแบบวันที่ไม่ถูกต้อง (ต้องเป็น YYYY-MM-DD)", 'danger')
+                return None
+            filters[name] = value
+
+    if session.get('role') in ['root_admin', 'administrator']:
+        filters['store_id'] = request.args.get('store_id', '').strip() or None
+    else:
+        if not session.get('store_id'):
+            flash("คุณไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.", 'danger')
+            return None
+        filters['store_id'] = str(session['store_id'])
+        if include_member_email and session.get('role') == 'member':
+            filters['email'] = session['email']
+    return filters
+
 @app.route("/export_products_csv")
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer']) # Allow viewer to export
 def export_products_csv():
-    """Exports product data to a CSV file."""
-    conn = get_db_connection()
-    cursor = None # Initialize cursor to None
+    """
+    Exports product data to a CSV file.
+    Rows are streamed in fetchmany() batches (see csv_export.py), so memory stays flat however large the catalog is.
+    """
+    # The download outlives this request, so it gets its own connection (closed by the generator)
+    conn = get_session_connection()
     if not conn:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
         return redirect(url_for('tbl_products'))
     
     try:
-        cursor = conn.cursor(dictionary=True)
         base_query = "SELECT products_id, products_name, stock, price, category_id, description, barcode_id, store_id FROM tbl_products"
         query_params = ()
         if session.get('role') in ['moderator', 'member', 'viewer']:
             base_query += " WHERE store_id = %s"
             query_params = (session.get('store_id'),)
-
-        cursor.execute(base_query, query_params)
-        products = cursor.fetchall()
-        
-        si = StringIO()
-        cw = csv.writer(si)
-        
-        cw.writerow(['Product ID', 'Product Name', 'Stock', 'Price', 'Category ID', 'Description', 'Barcode ID', 'Store ID'])
-        
-        for product in products:
-            # Ensure stock and price are handled as numbers, defaulting to 0 if None
-            display_stock = product['stock'] if product['stock'] is not None else 0
-            display_price = product['price'] if product['price'] is not None else 0.0
-            cw.writerow([product['products_id'], product['products_name'], display_stock, display_price, product['category_id'], product['description'], product['barcode_id'], product['store_id']])
-        
-        output = make_response(si.getvalue())
-        output.headers["Content-Disposition"] = "attachment; filename=products_report.csv"
-        output.headers["Content-type"] = "text/csv"
-        return output
+        cursor = open_export_cursor(conn, base_query, query_params)
     except mysql.connector.Error as err:
+        conn.close()
         flash(f"เกิดข้อผิดพลาดในการส่งออกข้อมูลสินค้า: {err}", 'danger')
         return redirect(url_for('tbl_products'))
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+
+    def product_row(product):
+        # Ensure stock and price are handled as numbers, defaulting to 0 if None
+        display_stock = product['stock'] if product['stock'] is not None else 0
+        display_price = product['price'] if product['price'] is not None else 0.0
+        return [product['products_id'], product['products_name'], display_stock, display_price, product['category_id'], product['description'], product['barcode_id'], product['store_id']]
+
+    # Same columns import_products() reads (see product_import.py), so an export can be edited and imported again
+    output = Response(stream_csv(conn, cursor, PRODUCT_CSV_HEADER, product_row), mimetype="text/csv")
+    output.headers["Content-Disposition"] = "attachment; filename=products_report.csv"
+    return output
+
+@app.route("/tbl_products/import", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def import_products():
+    """
+    Bulk product import from an uploaded CSV with the columns export_products_csv() writes.
+    The file is read and validated row by row and upserted in batches (see product_import.py);
+    existing products (same Product ID, same store) are updated. Shows a per-row error report;
+    `?format=json` returns the report as JSON instead.
+    Moderators/Members/Viewers import into their own store, whatever the Store ID column says.
+    """
+    wants_json = request.args.get('format') == 'json'
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        if wants_json:
+            return jsonify({'error': 'กรุณาเลือกไฟล์ CSV'}), 400
+        flash("กรุณาเลือกไฟล์ CSV ที่จะนำเข้า", 'danger')
+        return redirect(url_for('tbl_products'))
+
+    is_admin = session.get('role') in ['root_admin', 'administrator']
+    if not is_admin and not session.get('store_id'):
+        flash("คุณไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.", 'danger')
+        return redirect(url_for('tbl_products'))
+
+    conn = get_db()
+    if not conn:
+        flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
+        return redirect(url_for('tbl_products'))
+    try:
+        # Allowed stores and categories, from the reference-data cache (see ref_data.py)
+        if is_admin:
+            stores, categories = ref_data.get(conn, ('stores', None), ('categories', None))
+        else:
+            stores, categories = ref_data.get(conn, ('stores', session['store_id']), ('categories', session['store_id']))
+        report = import_products_csv(
+            conn, upload.stream,
+            store_id=None if is_admin else session['store_id'],
+            stores={store['store_id'] for store in stores},
+            categories={category['category_id'] for category in categories},
+        )
+    except ImportFileError as err:
+        if wants_json:
+            return jsonify({'error': str(err)}), 400
+        flash(str(err), 'danger')
+        return redirect(url_for('tbl_products'))
+    except mysql.connector.Error as err:
+        if wants_json:
+            return jsonify({'error': str(err)}), 500
+        flash(f"เกิดข้อผิดพลาดในการนำเข้าสินค้า: {err}", 'danger')
+        return redirect(url_for('tbl_products'))
+
+    if wants_json:
+        return jsonify(report)
+    return render_template("product_import.html", report=report, filename=upload.filename)
+
+@app.route("/export_orders_csv")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def export_orders_csv():
+    """
+    Exports orders to a CSV file, streamed in fetchmany() batches.
+    Optional filters: date_from / date_to (YYYY-MM-DD, inclusive) and store_id (admins only;
+    other roles always export their own store; members only their own orders).
+    """
+    filters = order_report_filters(include_member_email=True)
+    if filters is None:
+        return redirect(url_for('tbl_order'))
+    conditions, query_params = order_filter_sql(filters)
+
+    # The download outlives this request, so it gets its own connection (closed by the generator)
+    conn = get_session_connection()
+    if not conn:
+        flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
+        return redirect(url_for('tbl_order'))
+
+    try:
+        base_query = """
+            SELECT o.id, o.order_id, o.products_id, o.products_name, o.quantity, o.disquantity, p.price,
+                   o.email, o.barcode_id, o.store_id, s.store_name, o.order_date
+            FROM tbl_order o
+            LEFT JOIN tbl_products p ON o.products_id = p.products_id
+            LEFT JOIN tbl_stores s ON o.store_id = s.store_id
+        """
+        if conditions:
+            base_query += " WHERE " + " AND ".join(conditions)
+        base_query += " ORDER BY o.id"
+        cursor = open_export_cursor(conn, base_query, tuple(query_params))
+    except mysql.connector.Error as err:
+        conn.close()
+        flash(f"เกิดข้อผิดพลาดในการส่งออกข้อมูลคำสั่งซื้อ: {err}", 'danger')
+        return redirect(url_for('tbl_order'))
+
+    def order_row(order):
+        price = float(order['price'] or 0.0)
+        order_date = order['order_date'].strftime('%Y-%m-%d %H:%M:%S') if order['order_date'] else ''
+        return [order['id'], order['order_id'], order['products_id'], order['products_name'], order['quantity'], order['disquantity'],
+                f"{price:.2f}", f"{order['quantity'] * price:.2f}", order['email'], order['barcode_id'], order['store_id'], order['store_name'], order_date]
+
+    header = ['ID', 'Order ID', 'Product ID', 'Product Name', 'Quantity', 'Disposed Quantity', 'Unit Price', 'Total Price',
+              'Email', 'Barcode ID', 'Store ID', 'Store Name', 'Order Date']
+    output = Response(stream_csv(conn, cursor, header, order_row), mimetype="text/csv")
+    output.headers["Content-Disposition"] = f"attachment; filename=orders_report_{datetime.now().strftime('%Y%m%d')}.csv"
+    return output
 
 # --- Route จัดการคำสั่งซื้อ (cart) ---
 @app.route("/cart", methods=["GET", "POST"])
@@ -1674,7 +1958,7 @@ def cart():
     Order IDs are generated based on the latest order_id for the specific store.
     Viewers can access and persist data to their temporary store.
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = None # Initialize cursor to None
     msg = ''
     pre_filled_products_id_input = ''
@@ -1691,17 +1975,16 @@ def cart():
 
     try:
         cursor = conn.cursor(dictionary=True)
-        # Fetch stores for dropdown (all for root_admin/administrator, only assigned for moderator/member/viewer)
-        stores = []
-        if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name")
-            stores = cursor.fetchall()
-        elif session.get('role') in ['moderator', 'member', 'viewer']:
-            if session.get('store_id'):
-                cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (session['store_id'],))
-                store_info = cursor.fetchone()
-                if store_info:
-                    stores = [store_info]
+        # Stores and the store's users for the dropdowns, from the reference-data cache (see ref_data.py).
+        # The product catalog is not embedded: cart.html loads it from /api/products and keeps it in the browser cache.
+        dropdown_keys = [('stores', None if session.get('role') in ['root_admin', 'administrator'] else get_current_store())]
+        if get_current_store():
+            if session.get('role') in ['root_admin', 'administrator']:
+                dropdown_keys.append(('users', get_current_store()))
+            elif session.get('role') in ['moderator', 'viewer']:
+                dropdown_keys.append(('users', get_current_store(), 'members'))
+        stores, *store_lists = ref_data.get(conn, *dropdown_keys)
+        store_users = store_lists[0] if store_lists else []
 
 
         # --- Logic for creating/managing current_order_id and barcode_id for the order ---
@@ -1714,92 +1997,50 @@ def cart():
         selected_product_barcode = session.get(current_order_barcode_key)
 
         if not current_order_id:
-            # Fetch max order_id for the specific store_id
-            cursor.execute("SELECT MAX(CAST(order_id AS UNSIGNED)) AS max_order_id FROM tbl_order WHERE order_id REGEXP '^[0-9]+$' AND store_id = %s", (get_current_store(),))
-            result = cursor.fetchone()
-            current_order_id = str(int(result['max_order_id'] or 0) + 1) if result and result['max_order_id'] is not None else '100001' # Handles first order for a new store
-            session[current_order_id_key] = current_order_id
+            # The allocators commit, so they run on their own pooled connection rather than the
+            # request's. A sandbox allows one connection at a time; nothing is pending on it here.
+            sequence_conn = conn if session.get('sandbox') else get_db_connection()
+            if not sequence_conn:
+                flash('ไม่สามารถเชื่อมต่อฐานข้อมูลได้', 'danger')
+                return redirect(url_for('index'))
+            try:
+                # Allocate the next order number from the store's sequence (atomic, no table scan)
+                current_order_id = next_order_number(sequence_conn, get_current_store())
 
-            # Generate a new unique barcode_id for this order
-            # This barcode needs to be unique globally, even for viewer's temporary stores
-            is_unique = False
-            attempts = 0
-            max_attempts = 5000
-            cursor.execute("SELECT barcode_id FROM tbl_order WHERE barcode_id IS NOT NULL AND barcode_id != ''")
-            existing_barcode_ids_in_db = {item['barcode_id'] for item in cursor.fetchall()}
-            while not is_unique and attempts < max_attempts:
-                seed = random.randint(10**11, 10**12 - 1)
-                encoded_barcode_int = encode(seed)
-                new_barcode = str(encoded_barcode_int).zfill(13)
-                if new_barcode not in existing_barcode_ids_in_db:
-                    is_unique = True
-                    selected_product_barcode = new_barcode # Update the selected_product_barcode for this session
-                    session[current_order_barcode_key] = new_barcode # Fixed: use new_barcode, not selected_barcode
-                attempts += 1
-            if not is_unique:
-                flash("ไม่สามารถสร้างบาร์โค้ดที่ไม่ซ้ำกันสำหรับคำสั่งซื้อใหม่ได้. โปรดลองอีกครั้ง.", 'warning')
-                return redirect(url_for('cart'))
+                # Generate a new barcode_id for this order from the global barcode counter.
+                # encode() is a bijection, so a fresh seed always gives a globally unique barcode
+                # (even across viewer's temporary stores) without looking up existing ones.
+                new_barcode = next_order_barcode(sequence_conn)
+            finally:
+                if sequence_conn is not conn:
+                    sequence_conn.close()
+            session[current_order_id_key] = current_order_id
+            selected_product_barcode = new_barcode # Update the selected_product_barcode for this session
+            session[current_order_barcode_key] = new_barcode
 
-        # Fetch all product data and user data for the frontend (filtered by store_id)
-        # Ensure stock and price are converted to numbers or default to 0 if None
-        cursor.execute("SELECT products_id, products_name, stock, price, barcode_id FROM tbl_products WHERE store_id = %s ORDER BY products_id", (get_current_store(),))
-        products_data_raw = cursor.fetchall()
-        products_data = []
-        for p_raw in products_data_raw:
-            p = p_raw.copy()
-            p['stock'] = int(p['stock'] or 0) # Convert stock to int, default 0
-            p['price'] = float(p['price'] or 0.0) # Convert price to float, default 0.0
-            products_data.append(p)
-
-        products_data_parts = [f"{p['products_id']}|{str(p['products_name']).replace('|', ' ').replace('///', ' ')}|{p['stock']}|{p['price']}|{str(p['barcode_id'] or '').replace('|', ' ').replace('///', ' ')}" for p in products_data]
-        products_data_string = "///".join(products_data_parts)
-        
-        users_data = []
-        # Filter users for the dropdown based on the current store (Viewer can select any member/viewer in their temp store)
-        if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users WHERE store_id = %s ORDER BY firstname", (get_current_store(),))
-        elif session.get('role') in ['moderator', 'viewer']:
-            cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users WHERE store_id = %s AND (role = 'member' OR role = 'viewer') ORDER BY firstname", (get_current_store(),))
-        elif session.get('role') == 'member':
+        # Users for the dropdown are filtered by the current store (Viewer can select any member/viewer in their temp store)
+        users_data = store_users
+        if session.get('role') == 'member':
             cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname FROM tbl_users WHERE id = %s AND store_id = %s", (session['id'], get_current_store(),))
-        users_data = cursor.fetchall()
+            users_data = cursor.fetchall()
 
         # --- Handle 'complete_order' action ---
         if request.method == "POST" and request.form.get('action') == 'complete_order':
             # Viewers can complete orders, as the data is stored to their temporary store
             
             # Fetch all items in the current order for this store
-            cursor.execute("""
-                SELECT o.*, p.price
-                FROM tbl_order o
-                JOIN tbl_products p ON o.products_id = p.products_id
-                WHERE o.order_id = %s AND o.store_id = %s
-                ORDER BY o.id
-            """, (current_order_id, get_current_store()))
-            orders_to_complete = cursor.fetchall()
-            
-            if not orders_to_complete:
+            cursor.execute("SELECT id FROM tbl_order WHERE order_id = %s AND store_id = %s LIMIT 1", (current_order_id, get_current_store()))
+            if not cursor.fetchone():
                 flash('ไม่พบรายการสินค้าในคำสั่งซื้อนี้.', 'danger')
                 return redirect(url_for('cart'))
 
-            total_quantity = sum(item['quantity'] for item in orders_to_complete)
-            # Ensure price is converted to float before multiplication
-            total_price = sum(item['quantity'] * float(item['price'] or 0.0) for item in orders_to_complete)
-            
-            # Store receipt data in session and clear current order info
-            session['receipt_data'] = {
-                'orders': orders_to_complete,
-                'barcode_id': selected_product_barcode, # Use selected_product_barcode here
-                'total_quantity': total_quantity,
-                'total_price': total_price,
-                'current_order_id': current_order_id,
-                'store_id': get_current_store()
-            }
+            # The receipt is rebuilt from tbl_order by receipt(), so it can be opened again later;
+            # only the current order info is cleared from the session
             session.pop(current_order_id_key, None)
             session.pop(current_order_barcode_key, None)
             
             flash('คำสั่งซื้อเสร็จสมบูรณ์แล้ว!', 'success')
-            return redirect(url_for('receipt_display'))
+            return redirect(url_for('receipt', store_id=get_current_store(), order_id=current_order_id))
 
         # --- Main logic for adding item automatically when products_id_input length is 13 ---
         if request.method == "POST" and 'products_id_input' in request.form:
@@ -1807,73 +2048,26 @@ def cart():
             pre_filled_products_id_input = products_id_input
             
             if len(products_id_input) == 13:
-                product_info = None
-                
-                # Search for the product by products_id and ensure it belongs to the current store
-                cursor.execute("SELECT products_id, products_name, stock, price, store_id FROM tbl_products WHERE products_id = %s AND store_id = %s", (products_id_input, get_current_store()))
-                product_info_raw = cursor.fetchone()
-                
-                if not product_info_raw:
-                    flash("ไม่พบสินค้าตามบาร์โค้ดที่ระบุในร้านค้าของคุณ!", 'danger')
-                    return redirect(url_for('cart'))
-                
-                product_info = product_info_raw.copy()
-                # Ensure product_info['stock'] is treated as a number
-                product_info['stock'] = int(product_info['stock'] or 0)
-                product_info['price'] = float(product_info['price'] or 0.0) # Ensure price is float
-
-                # --- Proceed to add the product to the cart ---
                 order_id_to_use = session.get(current_order_id_key)
                 barcode_to_use_for_add = session.get(current_order_barcode_key)
 
                 if not order_id_to_use or not barcode_to_use_for_add:
                     flash("ไม่สามารถดำเนินการได้: รหัสคำสั่งซื้อหรือบาร์โค้ดคำสั่งซื้อปัจจุบันไม่พร้อมใช้งาน.", 'danger')
                     return redirect(url_for('cart'))
-                
-                email = request.form.get('email')
-                if session.get('role') == 'member':
-                    email = session['email']
-                elif session.get('role') in ['moderator', 'viewer']:
-                    # Validate that the selected email belongs to a member/viewer of the current store
-                    cursor.execute("SELECT id FROM tbl_users WHERE email = %s AND store_id = %s", (email, session['store_id']))
-                    if not cursor.fetchone():
-                        flash("ไม่สามารถเพิ่มคำสั่งซื้อ: อีเมลลูกค้าไม่อยู่ในร้านค้าของคุณ/จำลอง", 'danger')
-                        return redirect(url_for('cart'))
-                elif not email:
-                    flash("กรุณาระบุอีเมลลูกค้า.", 'danger')
-                    return redirect(url_for('cart'))
 
-                # All roles allowed to modify data in their respective stores
-                quantity = 1
-                disquantity = 0
-                if quantity > product_info['stock']:
-                    flash(f"สินค้า {product_info['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {product_info['stock']}", 'danger')
+                email, email_error = cart_scan_email(cursor, request.form.get('email'))
+                if email_error:
+                    flash(email_error, 'danger')
                     return redirect(url_for('cart'))
-                
-                products_name = product_info['products_name']
-                products_id_to_use = product_info['products_id']
 
-                cursor.execute("SELECT id, quantity FROM tbl_order WHERE products_id = %s AND order_id = %s AND email = %s AND store_id = %s",
-                               (products_id_to_use, order_id_to_use, email, get_current_store()))
-                existing_order_item = cursor.fetchone()
-
-                if existing_order_item:
-                    new_qty = existing_order_item['quantity'] + quantity
-                    if new_qty > product_info['stock']:
-                        flash(f"ไม่สามารถเพิ่มได้ สินค้า {products_name} มีสต็อกไม่พอสำหรับยอดรวม. มีในสต็อก: {product_info['stock']}", 'danger')
-                    else:
-                        cursor.execute("UPDATE tbl_order SET quantity = %s WHERE id = %s", (new_qty, existing_order_item['id']))
-                        cursor.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (quantity, products_id_to_use))
-                        conn.commit()
-                        flash(f'เพิ่มจำนวนสินค้า {products_name} ในรายการสั่งซื้อ {order_id_to_use} สำเร็จ และอัปเดตสต็อกแล้ว!', 'success')
-                else:
-                    cursor.execute("""
-                        INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    """, (order_id_to_use, products_id_to_use, products_name, quantity, disquantity, email, barcode_to_use_for_add, get_current_store()))
-                    cursor.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (quantity, products_id_to_use))
+                # Same path as the /cart/scan API (cart_ops.py): one line per product, stock taken atomically
+                try:
+                    add_scanned_item(cursor, get_current_store(), order_id_to_use, barcode_to_use_for_add, email, products_id_input)
                     conn.commit()
-                    flash('เพิ่มคำสั่งซื้อสำเร็จและอัปเดตสต็อกสินค้าแล้ว!', 'success')
+                    flash(f'เพิ่มสินค้า {products_id_input} ในรายการสั่งซื้อ {order_id_to_use} สำเร็จ และอัปเดตสต็อกแล้ว!', 'success')
+                except ScanError as err:
+                    conn.rollback()
+                    flash(str(err), 'danger')
                 return redirect(url_for('cart'))
         
         # --- For GET Request and final display ---
@@ -1900,6 +2094,7 @@ def cart():
         for o_raw in orders_data_raw:
             o = o_raw.copy()
             o['price'] = float(o['price'] or 0.0) # Convert price to float, default 0.0
+            o['line_total'] = o['price'] * o['quantity']
             orders_data.append(o)
 
     except mysql.connector.Error as err:
@@ -1908,16 +2103,14 @@ def cart():
     finally:
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
 
     # If the user submitted a form and the page is being re-rendered, update the product display.
     if request.method == 'POST' and pre_filled_products_id_input:
-        conn_display_update = get_db_connection() # Re-open connection for this
+        # Reuses the request's connection instead of opening a second one
         cursor_display_update = None
-        if conn_display_update:
+        if conn:
             try:
-                cursor_display_update = conn_display_update.cursor(dictionary=True)
+                cursor_display_update = conn.cursor(dictionary=True)
                 cursor_display_update.execute("SELECT products_id, products_name, stock, price, barcode_id FROM tbl_products WHERE products_id = %s AND store_id = %s", (pre_filled_products_id_input, get_current_store()))
                 found_product_raw = cursor_display_update.fetchone()
                 if found_product_raw:
@@ -1932,14 +2125,11 @@ def cart():
             finally:
                 if cursor_display_update:
                     cursor_display_update.close()
-                if conn_display_update:
-                    conn_display_update.close()
         else:
             selected_product_details_display = 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล'
 
     return render_template("cart.html",
                            orders=orders_data,
-                           products_data_string=products_data_string,
                            users=users_data,
                            search='',
                            msg=msg,
@@ -1951,23 +2141,329 @@ def cart():
                            stores=stores)
 
 
-# --- New route to display the PNG receipt ---
-@app.route("/receipt_display")
+# --- Cart Scan API ---
+def cart_scan_email(cursor, email):
+    """
+    Resolves the customer email for a cart scan from the submitted one and the user's role.
+    Returns (email, None), or (None, error message) if the user may not add for that email.
+    """
+    if session.get('role') == 'member':
+        return session['email'], None
+    if session.get('role') in ['moderator', 'viewer']:
+        # Validate that the selected email belongs to a member/viewer of the current store
+        cursor.execute("SELECT id FROM tbl_users WHERE email = %s AND store_id = %s", (email, session['store_id']))
+        if not cursor.fetchone():
+            return None, "ไม่สามารถเพิ่มคำสั่งซื้อ: อีเมลลูกค้าไม่อยู่ในร้านค้าของคุณ/จำลอง"
+        return email, None
+    if not email:
+        return None, "กรุณาระบุอีเมลลูกค้า."
+    return email, None
+
+@app.route("/cart/scan", methods=["POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
-def receipt_display():
+def cart_scan():
+    """
+    Adds one scanned product to the open order without reloading the cart page.
+    Takes JSON or form fields products_id (and email for staff) and returns only the updated order
+    line and the order's running totals, which cart.html patches into the table.
+    """
+    data = request.get_json(silent=True) or request.form
+    products_id = str(data.get('products_id') or data.get('products_id_input') or '').strip()
+    store_id = session.get('store_id')
+    order_id = session.get(f'current_order_id_{store_id}')
+    order_barcode = session.get(f'current_order_barcode_{store_id}')
+
+    if not store_id:
+        return jsonify({'status': 'error', 'message': "คุณยังไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ."}), 400
+    if not order_id or not order_barcode:
+        # The open order is created by the cart page; ask the browser to reload it
+        return jsonify({'status': 'error', 'message': "ไม่สามารถดำเนินการได้: รหัสคำสั่งซื้อหรือบาร์โค้ดคำสั่งซื้อปัจจุบันไม่พร้อมใช้งาน.", 'reload': True}), 409
+    if not products_id:
+        return jsonify({'status': 'error', 'message': "กรุณาระบุรหัสสินค้า"}), 400
+
+    conn = get_db()
+    if not conn:
+        return jsonify({'status': 'error', 'message': "เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล."}), 503
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        email, email_error = cart_scan_email(cursor, data.get('email'))
+        if email_error:
+            return jsonify({'status': 'error', 'message': email_error}), 403
+
+        line_id = add_scanned_item(cursor, store_id, order_id, order_barcode, email, products_id)
+        conn.commit()
+        line, totals = order_line_with_totals(cursor, line_id, order_id, store_id,
+                                              email=session['email'] if session.get('role') == 'member' else None)
+    except ScanError as err:
+        conn.rollback()
+        return jsonify({'status': 'error', 'message': str(err)}), err.status
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'status': 'error', 'message': f"เกิดข้อผิดพลาดในการเพิ่มสินค้า: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+
+    return jsonify({
+        'status': 'success',
+        'message': f"เพิ่มสินค้า {line['products_name']} แล้ว (จำนวน {line['quantity']})",
+        'line': line,
+        'totals': totals,
+    })
+
+@app.route("/cart/scan/batch", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def cart_scan_batch():
+    """
+    Adds many scans to the open order in one request and one transaction.
+    Takes JSON {"scans": [code, ... or {"code", "quantity"}], "email": ...}; codes are products_id
+    or barcode_id. Returns a result per distinct code and the order's running totals.
+    """
+    data = request.get_json(silent=True) or {}
+    scans = data.get('scans')
+    store_id = session.get('store_id')
+    order_id = session.get(f'current_order_id_{store_id}')
+    order_barcode = session.get(f'current_order_barcode_{store_id}')
+
+    if not store_id:
+        return jsonify({'status': 'error', 'message': "คุณยังไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ."}), 400
+    if not order_id or not order_barcode:
+        return jsonify({'status': 'error', 'message': "ไม่สามารถดำเนินการได้: รหัสคำสั่งซื้อหรือบาร์โค้ดคำสั่งซื้อปัจจุบันไม่พร้อมใช้งาน.", 'reload': True}), 409
+    if not isinstance(scans, list) or not scans:
+        return jsonify({'status': 'error', 'message': "กรุณาระบุรายการสินค้าที่สแกน"}), 400
+    if len(scans) > MAX_BATCH_SCANS:
+        return jsonify({'status': 'error', 'message': f"สแกนได้ไม่เกิน {MAX_BATCH_SCANS} รายการต่อครั้ง"}), 413
+
+    conn = get_db()
+    if not conn:
+        return jsonify({'status': 'error', 'message': "เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล."}), 503
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        email, email_error = cart_scan_email(cursor, data.get('email'))
+        if email_error:
+            return jsonify({'status': 'error', 'message': email_error}), 403
+
+        results = add_scanned_items(cursor, store_id, order_id, order_barcode, email, scans)
+        conn.commit()
+        totals = order_totals(cursor, order_id, store_id,
+                              email=session['email'] if session.get('role') == 'member' else None)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'status': 'error', 'message': f"เกิดข้อผิดพลาดในการเพิ่มสินค้า: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+
+    added = sum(1 for result in results if result['status'] == 'ok')
+    return jsonify({
+        'status': 'success' if added == len(results) else ('partial' if added else 'error'),
+        'message': f"เพิ่มสินค้าสำเร็จ {added} จาก {len(results)} รายการ",
+        'results': results,
+        'totals': totals,
+    })
+
+# --- Product Lookup API ---
+# The cart loads its store's catalog as JSON once and the browser keeps it, revalidating with If-None-Match.
+# The ETag is the store's 'products' data version, so an unchanged catalog costs one small query and a 304.
+
+def _product_lookup_store():
+    """Store whose catalog the current user may read: their own, or ?store_id= for root_admin/administrator."""
+    store_id = session.get('store_id')
+    if session.get('role') in ['root_admin', 'administrator']:
+        store_id = request.args.get('store_id', type=int) or store_id
+    return int(store_id) if store_id else None
+
+def _product_json(product):
+    return {
+        'products_id': product['products_id'],
+        'products_name': product['products_name'],
+        'stock': int(product['stock'] or 0),
+        'price': float(product['price'] or 0.0),
+        'barcode_id': product['barcode_id'] or '',
+    }
+
+def _versioned_catalog(etag_prefix):
     """
-    Displays the receipt data from the session and then clears it.
+    Common part of the lookup routes. Returns (response, None) when the request can be answered
+    without the catalog (error or 304), otherwise (None, (etag, products)).
     """
+    store_id = _product_lookup_store()
+    if not store_id:
+        return (jsonify({'error': 'คุณยังไม่มีร้านค้าที่ผูกไว้'}), 400), None
+    conn = get_db()
+    if not conn:
+        return (jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล'}), 503), None
+    try:
+        version = data_versions.current(conn, 'products', store_id)
+        etag = f"{etag_prefix}-{store_id}-{version}"
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response, None
+        products, = ref_data.get(conn, ('products', store_id, 'id'), versions={('products', store_id): version})
+    except mysql.connector.Error as err:
+        return (jsonify({'error': f"เกิดข้อผิดพลาดในการดึงข้อมูลสินค้า: {err}"}), 500), None
+    return None, (etag, products)
+
+def _cacheable_json(payload, etag):
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' # Keep it, but revalidate on every use
+    return response
+
+@app.route("/api/products")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def api_products():
+    """Returns the current store's product catalog as JSON, with an ETag that changes whenever a product or its stock does."""
+    early_response, catalog = _versioned_catalog('products')
+    if early_response:
+        return early_response
+    etag, products = catalog
+    return _cacheable_json({'products': [_product_json(product) for product in products]}, etag)
+
+@app.route("/api/products/<code>")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def api_product_lookup(code):
+    """Looks up one product of the current store by products_id (what the scanner reads) or barcode_id."""
+    early_response, catalog = _versioned_catalog('product') # ETags only need to be unique per URL
+    if early_response:
+        return early_response
+    etag, products = catalog
+    code = code.strip()
+    product = next((p for p in products if p['products_id'] == code), None) or \
+        next((p for p in products if p['barcode_id'] and p['barcode_id'] == code), None)
+    if not product:
+        return jsonify({'error': 'ไม่พบสินค้า', 'products_id': code}), 404
+    return _cacheable_json({'product': _product_json(product)}, etag)
+
+@app.route("/api/online")
+@role_required(['root_admin', 'administrator', 'moderator', 'viewer'])
+def api_online():
+    """
+    Users online in the current store (admins: ?store_id=..., or every store without it),
+    from the in-memory presence tracker; no query.
+    """
+    store_id = session.get('store_id')
+    if session.get('role') in ['root_admin', 'administrator']:
+        store_id = request.args.get('store_id', type=int)
+        if store_id is None:
+            return jsonify({'count': presence_tracker.count()})
+    return jsonify({'store_id': store_id, 'count': presence_tracker.count(store_id), 'users': presence_tracker.users(store_id)})
+
+# --- Receipts (PNG receipt page) ---
+@app.route("/receipt/<int:store_id>/<order_id>")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def receipt(store_id, order_id):
+    """
+    Displays the receipt of an order; it can be opened again at any time (reprint, customer lookup).
+    The rendered page is cached per data version (see receipts.py) and revalidated with an ETag.
+    Members only see their own lines of the order.
+    """
+    if session.get('role') not in ['root_admin', 'administrator'] and session.get('store_id') != store_id:
+        flash("คุณไม่มีสิทธิ์ดูใบเสร็จนี้", 'danger')
+        return redirect(url_for('cart'))
+    conn = get_db()
+    if not conn:
+        flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
+        return redirect(url_for('cart'))
+
+    def render_page(receipt_data):
+        png_url = url_for('receipt_png', store_id=store_id, order_id=order_id, digest=receipt_images.digest(receipt_data))
+        return render_template("receipt_png_template.html", png_url=png_url, **receipt_data)
+
+    email = session['email'] if session.get('role') == 'member' else None
+    try:
+        found = receipts.rendered_receipt(conn, store_id, order_id, render_page, email=email)
+    except mysql.connector.Error as err:
+        flash(f"เกิดข้อผิดพลาดในการดึงข้อมูลใบเสร็จ: {err}", 'danger')
+        return redirect(url_for('cart'))
+    if not found:
+        flash("ไม่พบข้อมูลใบเสร็จ. โปรดดำเนินการคำสั่งซื้อใหม่.", 'danger')
+        return redirect(url_for('cart'))
+
+    etag, html = found
+    response = make_response(html)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' # Orders can still be edited: revalidate on every use
+    return response.make_conditional(request)
+
+# Receipt PNGs are drawn with PIL (receipt_image.py) and kept on disk under their content hash
+receipt_images = ReceiptImageCache(
+    os.environ.get('RECEIPT_CACHE_DIR', os.path.join(app.root_path, 'receipt_cache')),
+    font_path=find_font(app.root_path, os.environ.get('RECEIPT_FONT')),
+)
+
+@app.route("/receipt/<int:store_id>/<order_id>/<digest>.png")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def receipt_png(store_id, order_id, digest):
+    """
+    The receipt as a PNG image. The URL contains the content hash, so the image behind it never
+    changes and may be cached for a year; a changed receipt gets a new URL (old ones redirect to it).
+    """
+    if session.get('role') not in ['root_admin', 'administrator'] and session.get('store_id') != store_id:
+        return "Forbidden", 403
+
+    path = receipt_images.cached(digest) if len(digest) == 64 and all(c in '0123456789abcdef' for c in digest) else None
+    if path is None:
+        conn = get_db()
+        if not conn:
+            return "เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล", 503
+        cursor = conn.cursor(dictionary=True)
+        try:
+            receipt_data = receipts.load_receipt(cursor, store_id, order_id,
+                                                 email=session['email'] if session.get('role') == 'member' else None)
+        finally:
+            cursor.close()
+        if receipt_data is None:
+            return "ไม่พบข้อมูลใบเสร็จ", 404
+        current_digest, path = receipt_images.render(receipt_data)
+        if current_digest != digest:
+            return redirect(url_for('receipt_png', store_id=store_id, order_id=order_id, digest=current_digest))
+
+    response = send_file(path, mimetype='image/png', max_age=31536000, etag=False)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+# Barcode images (PNG/SVG) are drawn on the server and cached in memory and on disk (barcode_images.py)
+barcode_image_cache = barcode_images.BarcodeImageCache(
+    os.environ.get('BARCODE_CACHE_DIR', os.path.join(app.root_path, 'barcode_cache')),
+    max_entries=int(os.environ.get('BARCODE_CACHE_ENTRIES', '512')),
+)
+
+@app.route("/barcode/<code>.<fmt>")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def barcode_image(code, fmt):
+    """
+    Image of a product or order barcode, as PNG or SVG. Codes are checked with is_drawable()
+    (printable ASCII, length cap) before anything is drawn or cached; an image never changes,
+    so browsers may keep it for a year.
+    """
+    if fmt not in barcode_images.FORMATS:
+        return "Not Found", 404
+    if not barcode_images.is_drawable(code):
+        return "รหัสบาร์โค้ดไม่ถูกต้อง", 400
+
+    etag = f"{barcode_images.cache_name(code)}-{fmt}-v{barcode_images.RENDERER_VERSION}"
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(barcode_image_cache.get(code, fmt))
+        response.mimetype = barcode_images.FORMATS[fmt]
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+@app.route("/receipt_display")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def receipt_display():
+    """Old receipt URL (the receipt used to live in the session); forwards to receipt()."""
     receipt_data = session.pop('receipt_data', None)
     if not receipt_data:
         flash("ไม่พบข้อมูลใบเสร็จ. โปรดดำเนินการคำสั่งซื้อใหม่.", 'danger')
         return redirect(url_for('cart'))
-    return render_template("receipt_png_template.html",
-                           orders=receipt_data['orders'],
-                           barcode_id=receipt_data['barcode_id'],
-                           total_quantity=receipt_data['total_quantity'],
-                           total_price=receipt_data['total_price'],
-                           current_order_id=receipt_data['current_order_id'])
+    return redirect(url_for('receipt', store_id=receipt_data['store_id'], order_id=receipt_data['current_order_id']))
 
 # --- Routes สำหรับแก้ไขและลบรายการในตะกร้า (ย้ายมาอยู่นอกฟังก์ชัน cart()) ---
 # แก้ไขรายการในตะกร้า
@@ -1976,7 +2472,7 @@ def receipt_display():
 @app.route("/cart/edit/<int:item_id>", methods=["POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member'])
 def edit_cart_item(item_id):
-    conn_edit = get_db_connection()
+    conn_edit = get_db()
     if not conn_edit:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
         return redirect(url_for('cart'))
@@ -1988,35 +2484,38 @@ def edit_cart_item(item_id):
         original_product_id = request.form['products_id'] # ต้องส่ง products_id มาด้วย
         original_order_id = request.form['order_id'] # ต้องส่ง order_id มาด้วย
         
-        # ดึงข้อมูลสินค้านั้นๆ เพื่อตรวจสอบสต็อก
-        cursor_edit.execute("SELECT stock, products_name FROM tbl_products WHERE products_id = %s", (original_product_id,))
+        # ดึงข้อมูลสินค้านั้นๆ
+        cursor_edit.execute("SELECT products_name FROM tbl_products WHERE products_id = %s", (original_product_id,))
         product_info = cursor_edit.fetchone()
 
         if not product_info:
             flash(f"ไม่พบสินค้า ID {original_product_id} สำหรับแก้ไข.", 'danger')
-            conn_edit.close()
             return redirect(url_for('cart'))
 
-        current_stock = product_info['stock']
-
         # ดึงปริมาณเดิมของรายการในคำสั่งซื้อเพื่อคำนวณการเปลี่ยนแปลงสต็อก
-        cursor_edit.execute("SELECT quantity FROM tbl_order WHERE id = %s", (item_id,))
+        cursor_edit.execute("SELECT quantity, disquantity, store_id FROM tbl_order WHERE id = %s", (item_id,))
         current_order_qty_result = cursor_edit.fetchone()
         current_order_qty = current_order_qty_result['quantity'] if current_order_qty_result else 0
+        current_order_disqty = current_order_qty_result['disquantity'] if current_order_qty_result else 0
 
         # คำนวณความแตกต่างของจำนวนที่เปลี่ยนไป
         qty_change = new_quantity - current_order_qty
 
         if new_quantity <= 0:
             flash("จำนวนสินค้าต้องมากกว่า 0 หากต้องการลบ กรุณากดปุ่มลบ.", 'warning')
-            conn_edit.close()
             return redirect(url_for('cart'))
         
-        # ตรวจสอบสต็อกหลังจากปรับเปลี่ยน
-        # if current_stock - qty_change < 0: # <-- แก้ไข logic นี้เล็กน้อย
-        if current_stock < qty_change: # ถ้าสต็อกปัจจุบันน้อยกว่าจำนวนที่เพิ่มขึ้นจากเดิม
+        # ตัดสต็อกส่วนที่เพิ่มขึ้น (หรือคืนส่วนที่ลดลง) โดยตรวจและตัดใน UPDATE เดียว ไม่ให้ขายเกินสต็อกเมื่อแก้ไขพร้อมกัน
+        # ผู้ใช้ที่ไม่ใช่แอดมินแก้สต็อกได้เฉพาะสินค้าในร้านค้าของตัวเอง (เหมือน cart_ops)
+        stock_store_id = None if session.get('role') in ['root_admin', 'administrator'] else session.get('store_id')
+        if not inventory.take(cursor_edit, original_product_id, qty_change, stock_store_id):
+            conn_edit.rollback()
+            product = inventory.shortage(cursor_edit, original_product_id, stock_store_id)
+            if not product:
+                flash(f"ไม่พบสินค้า ID {original_product_id} ในร้านค้าของคุณ.", 'danger')
+                return redirect(url_for('cart'))
+            current_stock = product[1]
             flash(f"ไม่สามารถแก้ไขได้: สินค้า {product_info['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {current_stock} ต้องการเพิ่ม {qty_change} ชิ้น", 'danger')
-            conn_edit.close()
             return redirect(url_for('cart'))
 
         cursor_edit.execute("""
@@ -2024,9 +2523,11 @@ def edit_cart_item(item_id):
             SET quantity = %s, disquantity = %s
             WHERE id = %s AND order_id = %s
         """, (new_quantity, new_disquantity, item_id, original_order_id)) # เพิ่ม order_id ใน WHERE เพื่อความปลอดภัย
+        if cursor_edit.rowcount:
+            site_stats.bump(cursor_edit, total_quantity=qty_change, total_disquantity=new_disquantity - current_order_disqty)
+            data_versions.bump(cursor_edit, 'orders', current_order_qty_result['store_id'])
 
-        # อัปเดตสต็อกใน tbl_products
-        cursor_edit.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (qty_change, original_product_id))
+        bump_stock_version(cursor_edit, original_product_id)
 
         conn_edit.commit()
         flash(f'แก้ไขรายการ ID {item_id} ในคำสั่งซื้อ {original_order_id} สำเร็จแล้ว!', 'success')
@@ -2037,15 +2538,14 @@ def edit_cart_item(item_id):
         flash(f"เกิดข้อผิดพลาดในการแก้ไขรายการ: {err}", 'danger')
         conn_edit.rollback()
     finally:
-        if conn_edit:
-            conn_edit.close()
+        cursor_edit.close()
     return redirect(url_for('cart'))
 
 # ลบรายการในตะกร้า
 @app.route("/cart/delete/<int:item_id>", methods=["POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer']) # Viewer can delete their temp store data
 def delete_cart_item(item_id):
-    conn_del = get_db_connection()
+    conn_del = get_db()
     cursor_del = None # Initialize cursor to None
     if not conn_del:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
@@ -2053,7 +2553,7 @@ def delete_cart_item(item_id):
     try:
         cursor_del = conn_del.cursor(dictionary=True)
         # ดึงข้อมูลรายการที่จะลบ เพื่อคืนสต็อกและตรวจสอบ store_id
-        cursor_del.execute("SELECT products_id, quantity, order_id, store_id, email FROM tbl_order WHERE id = %s", (item_id,))
+        cursor_del.execute("SELECT products_id, quantity, disquantity, order_id, store_id, email FROM tbl_order WHERE id = %s", (item_id,))
         item_to_delete = cursor_del.fetchone()
         if not item_to_delete:
             flash("ไม่พบรายการที่จะลบ.", 'danger')
@@ -2076,10 +2576,14 @@ def delete_cart_item(item_id):
 
 
         # คืนสต็อกสินค้า
-        cursor_del.execute("UPDATE tbl_products SET stock = stock + %s WHERE products_id = %s",
-                           (item_to_delete['quantity'], item_to_delete['products_id']))
+        inventory.give_back(cursor_del, item_to_delete['products_id'], item_to_delete['quantity'])
+        bump_stock_version(cursor_del, item_to_delete['products_id'])
         # ลบรายการออกจาก tbl_order
         cursor_del.execute("DELETE FROM tbl_order WHERE id = %s AND store_id = %s", (item_id, item_store_id)) # Added store_id to WHERE
+        if cursor_del.rowcount:
+            site_stats.bump(cursor_del, total_quantity=-item_to_delete['quantity'], total_disquantity=-item_to_delete['disquantity'])
+            search_index.reindex(cursor_del, 'order', [item_id])
+            data_versions.bump(cursor_del, 'orders', item_store_id)
         
         conn_del.commit()
         flash(f'ลบรายการ ID {item_id} ออกจากคำสั่งซื้อ {item_to_delete["order_id"]} สำเร็จแล้ว! สต็อกสินค้าได้รับการคืนแล้ว.', 'success')
@@ -2089,15 +2593,13 @@ def delete_cart_item(item_id):
     finally:
         if cursor_del:
             cursor_del.close()
-        if conn_del:
-            conn_del.close()
     return redirect(url_for('cart'))
 
 # --- Route to manage package returns (bin) ---
 @app.route("/bin", methods=["GET", "POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def bin():
-    conn = get_db_connection()
+    conn = get_db()
     cursor = None # Initialize cursor to None
     orders_data = [] # Data for order items to display
     barcode_id_filter = request.args.get('barcode_id_filter', '') # For GET requests (search/reset)
@@ -2118,6 +2620,10 @@ def bin():
             # If performing a search, use the barcode_id from the search input
             barcode_id_filter = request.form.get('barcode_id_filter_input', barcode_id_filter)
 
+    # Every barcode is looked up: orders may carry legacy, typed-in or imported barcodes the
+    # codec never issued. The codec only picks the message when nothing is found.
+    barcode_id_filter = (barcode_id_filter or '').strip()
+
     # --- Logic for incrementing Disquantity (+1) ---
     if request.method == "POST" and request.form.get('action') == 'add_disquantity':
         # Viewers can modify data in their temp store
@@ -2160,6 +2666,8 @@ def bin():
                     # Update disquantity in tbl_order
                     cursor.execute("UPDATE tbl_order SET disquantity = %s WHERE id = %s",
                                    (proposed_disquantity, order_item_to_update['id']))
+                    site_stats.bump(cursor, total_disquantity=1)
+                    data_versions.bump(cursor, 'orders', current_user_store_id)
                     
                     # UPDATED: Set value in tbl_bin to 1 where category_id matches the product's category_id AND store_id
                     cursor.execute("UPDATE tbl_bin SET value = 1 WHERE category_id = %s", # Assuming tbl_bin is not store-specific for simplicity
@@ -2177,8 +2685,6 @@ def bin():
             # Always close the database connection
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
             # Redirect back to the bin page with the current barcode_id_filter to show filtered results
             return redirect(url_for('bin', barcode_id_filter=barcode_id_filter))
 
@@ -2210,6 +2716,8 @@ def bin():
                 o = o_raw.copy()
                 o['price'] = float(o['price'] or 0.0) # Convert price to float, default 0.0
                 orders_data.append(o)
+            if not orders_data and not is_order_barcode(barcode_id_filter):
+                flash(f"บาร์โค้ด '{barcode_id_filter}' ไม่ใช่บาร์โค้ดใบเสร็จของระบบ กรุณาสแกนใหม่", 'warning')
 
         else:
             # หากไม่มี barcode_id_filter จะไม่แสดงข้อมูลใดๆ
@@ -2220,8 +2728,6 @@ def bin():
     finally:
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
 
     current_auto_order_id = "N/A" # หรือจะเอามาจาก session เก่าก็ได้หากต้องการ แต่ตอนนี้เน้น barcode_id_filter
     return render_template("bin.html",
@@ -2236,7 +2742,7 @@ def bin():
 @app.route("/bin/edit/<int:item_id>", methods=["POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer']) # Viewer can edit their temp store data
 def edit_bin_item(item_id):
-    conn_edit = get_db_connection()
+    conn_edit = get_db()
     cursor_edit = None # Initialize cursor to None
     if not conn_edit:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
@@ -2280,16 +2786,14 @@ def edit_bin_item(item_id):
         old_quantity = old_order_item['quantity']
         old_disquantity = old_order_item['disquantity']
 
-        # ดึงสต็อกปัจจุบันของสินค้าจาก tbl_products (รวม store_id)
-        cursor_edit.execute("SELECT stock, products_name, store_id FROM tbl_products WHERE products_id = %s", (original_product_id,))
+        # ดึงข้อมูลสินค้าจาก tbl_products (รวม store_id)
+        cursor_edit.execute("SELECT products_name, store_id FROM tbl_products WHERE products_id = %s", (original_product_id,))
         product_info_raw = cursor_edit.fetchone()
         if not product_info_raw:
             flash(f"ไม่พบข้อมูลสินค้า ID {original_product_id}.", 'danger')
             return redirect(url_for('bin', barcode_id_filter=item_barcode_id))
         
         product_info = product_info_raw.copy()
-        # Ensure product_info['stock'] is treated as a number
-        current_stock = int(product_info['stock'] or 0)
 
         # Ensure product also belongs to the user's store context
         if product_info['store_id'] != current_user_store_id:
@@ -2314,7 +2818,10 @@ def edit_bin_item(item_id):
         stock_change_from_disquantity = new_disquantity - old_disquantity
         total_stock_adjustment = stock_change_from_quantity + stock_change_from_disquantity
 
-        if current_stock + total_stock_adjustment < 0:
+        # ปรับสต็อกแบบ atomic ก่อนแก้ไขรายการ (สต็อกที่อ่านไว้ด้านบนอาจเปลี่ยนไปแล้วถ้ามีการสแกนพร้อมกัน)
+        if not inventory.take(cursor_edit, original_product_id, -total_stock_adjustment, current_user_store_id):
+            conn_edit.rollback()
+            current_stock = inventory.shortage(cursor_edit, original_product_id, current_user_store_id)[1]
             flash(f"ไม่สามารถแก้ไขได้: สินค้า '{product_info['products_name']}' มีสต็อกไม่พอสำหรับการเปลี่ยนแปลงนี้ (สต็อกปัจจุบัน: {current_stock}, ต้องการปรับ: {total_stock_adjustment}).", 'danger')
             return redirect(url_for('bin', barcode_id_filter=item_barcode_id))
 
@@ -2324,10 +2831,11 @@ def edit_bin_item(item_id):
             SET quantity = %s, disquantity = %s
             WHERE id = %s AND order_id = %s AND store_id = %s
         """, (new_quantity, new_disquantity, item_id, original_order_id, current_user_store_id)) # Added store_id to WHERE
+        if cursor_edit.rowcount:
+            site_stats.bump(cursor_edit, total_quantity=new_quantity - old_quantity, total_disquantity=new_disquantity - old_disquantity)
+            data_versions.bump(cursor_edit, 'orders', current_user_store_id)
         
-        # อัปเดตสต็อกใน tbl_products
-        cursor_edit.execute("UPDATE tbl_products SET stock = stock + %s WHERE products_id = %s",
-                            (total_stock_adjustment, original_product_id))
+        bump_stock_version(cursor_edit, original_product_id)
         conn_edit.commit()
         flash(f'แก้ไขรายการ ID {item_id} (สินค้า: {product_info["products_name"]}) ในคำสั่งซื้อ {original_order_id} สำเร็จแล้ว!', 'success')
     except ValueError:
@@ -2338,8 +2846,6 @@ def edit_bin_item(item_id):
     finally:
         if cursor_edit:
             cursor_edit.close()
-        if conn_edit:
-            conn_edit.close()
     
     return redirect(url_for('bin', barcode_id_filter=item_barcode_id))
 
@@ -2347,7 +2853,7 @@ def edit_bin_item(item_id):
 @app.route("/bin/delete/<int:item_id>", methods=["POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer']) # Viewer can delete their temp store data
 def delete_bin_item(item_id):
-    conn_del = get_db_connection()
+    conn_del = get_db()
     cursor_del = None # Initialize cursor to None
     item_barcode_id = "" # ตัวแปรสำหรับเก็บ barcode_id เพื่อ redirect กลับไปหน้าเดิม
     if not conn_del:
@@ -2356,7 +2862,7 @@ def delete_bin_item(item_id):
     try:
         cursor_del = conn_del.cursor(dictionary=True)
         # ดึงข้อมูลรายการที่จะลบ เพื่อคืนสต็อกและเก็บ barcode_id (รวม store_id)
-        cursor_del.execute("SELECT products_id, quantity, order_id, barcode_id, store_id, email FROM tbl_order WHERE id = %s", (item_id,))
+        cursor_del.execute("SELECT products_id, quantity, disquantity, order_id, barcode_id, store_id, email FROM tbl_order WHERE id = %s", (item_id,))
         item_to_delete = cursor_del.fetchone()
         if not item_to_delete:
             flash("ไม่พบรายการที่จะลบ.", 'danger')
@@ -2380,10 +2886,14 @@ def delete_bin_item(item_id):
 
 
         # คืนสต็อกสินค้า (คืนตามจำนวน quantity ทั้งหมดของรายการนั้น)
-        cursor_del.execute("UPDATE tbl_products SET stock = stock + %s WHERE products_id = %s",
-                            (item_to_delete['quantity'], item_to_delete['products_id']))
+        inventory.give_back(cursor_del, item_to_delete['products_id'], item_to_delete['quantity'])
+        bump_stock_version(cursor_del, item_to_delete['products_id'])
         # ลบรายการออกจาก tbl_order
         cursor_del.execute("DELETE FROM tbl_order WHERE id = %s AND store_id = %s", (item_id, item_store_id)) # Added store_id to WHERE
+        if cursor_del.rowcount:
+            site_stats.bump(cursor_del, total_quantity=-item_to_delete['quantity'], total_disquantity=-item_to_delete['disquantity'])
+            search_index.reindex(cursor_del, 'order', [item_id])
+            data_versions.bump(cursor_del, 'orders', item_store_id)
         
         conn_del.commit()
         flash(f'ลบรายการ ID {item_id} ออกจากคำสั่งซื้อ {item_to_delete["order_id"]} สำเร็จแล้ว! สต็อกสินค้าได้รับการคืนแล้ว.', 'success')
@@ -2392,83 +2902,117 @@ def delete_bin_item(item_id):
     finally:
         if cursor_del:
             cursor_del.close()
-        if conn_del:
-            conn_del.close()
     
     return redirect(url_for('bin', barcode_id_filter=item_barcode_id))
 
+# --- Background PDF Reports ---
+# PDFs render in worker processes (report_jobs.py); finished files are cached on disk keyed by
+# (store, filters, order data version), so a repeat download is served without rendering.
+# Each report job renders its rows in batches of REPORT_BATCH_ROWS on REPORT_RENDER_WORKERS
+# processes of its own (pdf_batches.py), so up to REPORT_WORKERS x REPORT_RENDER_WORKERS renderers run.
+report_jobs = ReportJobQueue(
+    os.environ.get('REPORT_CACHE_DIR', os.path.join(app.root_path, 'report_cache')),
+    max_workers=int(os.environ.get('REPORT_WORKERS', 2)),
+)
+REPORT_BATCH_ROWS = int(os.environ.get('REPORT_BATCH_ROWS', BATCH_ROWS))
+REPORT_RENDER_WORKERS = int(os.environ.get('REPORT_RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+
+def _report_job_payload(job):
+    payload = report_jobs.public(job)
+    payload['status_url'] = url_for('report_job_status', job_id=job['id'])
+    payload['download_url'] = url_for('report_job_download', job_id=job['id'])
+    return payload
+
+def _get_own_report_job(job_id):
+    """Returns the job if it exists and belongs to the current user (admins may see any job)."""
+    job = report_jobs.get(job_id)
+    if not job:
+        return None
+    if job['owner'] != session.get('id') and session.get('role') not in ['root_admin', 'administrator']:
+        return None
+    return job
+
 @app.route("/export_orders_pdf")
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def export_orders_pdf():
-    """Exports order data to a PDF file."""
-    conn = get_db_connection()
-    cursor = None # Initialize cursor to None
+    """
+    Submits an order PDF report job and returns right away.
+    Accepts the same filters as export_orders_csv. Browsers get a page that polls the job and
+    starts the download when it is ready; `?format=json` returns the job status instead.
+    """
+    filters = order_report_filters(include_member_email=True)
+    if filters is None:
+        return redirect(url_for('tbl_order'))
+    if session.get('sandbox'):
+        # Report workers read the production database and cannot see a viewer's sandbox
+        flash("โหมดสาธิตไม่รองรับการส่งออก PDF กรุณาใช้การส่งออก CSV", 'warning')
+        return redirect(url_for('tbl_order'))
+
+    conn = get_db()
     if not conn:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
         return redirect(url_for('tbl_order'))
     try:
-        cursor = conn.cursor(dictionary=True)
-        base_query = """
-            SELECT 
-                o.id, 
-                o.order_id, 
-                o.products_id, 
-                o.products_name, 
-                o.quantity, 
-                o.disquantity, 
-                o.email, 
-                o.order_date,
-                o.barcode_id, 
-                p.category_id,
-                p.price,
-                s.store_name -- Include store_name
-            FROM tbl_order o
-            LEFT JOIN tbl_products p ON o.products_id = p.products_id
-            LEFT JOIN tbl_stores s ON o.store_id = s.store_id
-        """
-        query_params = []
-        if session.get('role') == 'member':
-            base_query += " WHERE o.email = %s AND o.store_id = %s"
-            query_params.extend([session['email'], session['store_id']])
-        elif session.get('role') in ['moderator', 'viewer']: # Filter for moderator/viewer
-            base_query += " WHERE o.store_id = %s"
-            query_params.append(session['store_id'])
-        
-        base_query += " ORDER BY o.order_date DESC"
-        
-        cursor.execute(base_query, tuple(query_params))
-        orders_raw = cursor.fetchall()
-
-        orders = []
-        for order_raw in orders_raw:
-            order = order_raw.copy()
-            order['price'] = float(order['price'] or 0.0) # Ensure price is float
-            orders.append(order)
-
-        # Render HTML template for PDF
-        html = render_template("pdf_template_orders.html", orders=orders)
-        
-        # Create a PDF from HTML
-        pdf_buffer = BytesIO()
-        pisa_status = pisa.CreatePDF(
-            html,                # the HTML to convert
-            dest=pdf_buffer)     # file handle to receive result
-        if pisa_status.err:
-            flash(f"เกิดข้อผิดพลาดในการสร้าง PDF: {pisa_status.err}", 'danger')
-            return redirect(url_for('tbl_order'))
-        pdf_buffer.seek(0)
-        
-        response = make_response(pdf_buffer.getvalue())
-        response.headers["Content-Disposition"] = "attachment; filename=orders_report.pdf"
-        response.headers["Content-type"] = "application/pdf"
-        return response
+        data_version = data_versions.current(conn, 'orders', filters['store_id'])
     except mysql.connector.Error as err:
         flash(f"เกิดข้อผิดพลาดในการส่งออกรายงานคำสั่งซื้อ: {err}", 'danger')
         return redirect(url_for('tbl_order'))
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+
+    job = report_jobs.submit(
+        ('orders_pdf', filters, data_version),
+        build_orders_pdf, DB_CONFIG, os.path.join(app.root_path, app.template_folder), filters,
+        REPORT_BATCH_ROWS, REPORT_RENDER_WORKERS,
+        owner=session.get('id'), filename='orders_report.pdf',
+    )
+    if request.args.get('format') == 'json':
+        return jsonify(_report_job_payload(job)), 202
+    if job['status'] == 'done':
+        return redirect(url_for('report_job_download', job_id=job['id']))
+    return render_template("report_job.html", job=_report_job_payload(job))
+
+@app.route("/report_jobs/<job_id>")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def report_job_status(job_id):
+    """Returns the status of a report job as JSON: queued, running, done or failed."""
+    job = _get_own_report_job(job_id)
+    if not job:
+        return jsonify({'error': 'ไม่พบงานสร้างรายงาน'}), 404
+    return jsonify(_report_job_payload(job))
+
+@app.route("/report_jobs/<job_id>/download")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def report_job_download(job_id):
+    """Sends the finished PDF of a report job."""
+    job = _get_own_report_job(job_id)
+    if not job:
+        flash("ไม่พบงานสร้างรายงาน", 'danger')
+        return redirect(url_for('tbl_order'))
+    path = report_jobs.artifact(job)
+    if not path:
+        if job['status'] == 'failed':
+            flash(f"เกิดข้อผิดพลาดในการสร้าง PDF: {job['error']}", 'danger')
+        else:
+            flash("รายงานยังไม่พร้อม กรุณาลองใหม่อีกครั้ง", 'warning')
+        return redirect(url_for('tbl_order'))
+    return send_file(path, mimetype="application/pdf", as_attachment=True, download_name=job['filename'])
+
+# --- System Monitoring ---
+@app.route("/pool_stats")
+@role_required(['root_admin', 'administrator'])
+def pool_stats():
+    """Returns live database pool statistics (in use, idle, wait time, checkouts/sec) as JSON."""
+    return jsonify(db_pool.stats())
+
 if __name__ == '__main__':
+    # Bring the schema up to date before serving (see migrations.py)
+    migration_conn = get_db_connection()
+    if migration_conn:
+        try:
+            run_migrations(migration_conn)
+        except mysql.connector.Error as err:
+            print(f"Error applying schema migrations: {err}")
+        finally:
+            migration_conn.close()
+    if BACKGROUND_JOBS:
+        start_background_jobs()
     app.run(port=5000)
\ No newline at end of file
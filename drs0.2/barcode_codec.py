@@ -0,0 +1,109 @@
+# Barcode Codec
+# Project Bin - การเข้ารหัส/ถอดรหัสบาร์โค้ดคำสั่งซื้อ (affine bijection mod m)
+#
+# An order barcode is encode(seed) as 13 digits. Seeds are only ever issued from two ranges
+# (legacy random seeds, then the tbl_sequence counter; see sequences.py), so decoding a scan and
+# checking its seed rejects mistyped or foreign barcodes in microseconds, before any SQL query.
+#
+# Usage: python barcode_codec.py bench [count]
+
+import sys
+import time
+
+A = 982451653
+B = 1234567891234
+M = 10000000000039  # ใกล้เคียง 10^13 (not prime: 7 * 691 * 2067397147, but gcd(A, M) == 1)
+A_INV = pow(A, -1, M)  # inverse ของ A mod M, computed once instead of on every decode()
+
+BARCODE_LENGTH = 13
+
+# Issued seed ranges: legacy carts drew random seeds from [10^11, 10^12); the counter starts at
+# 10^12. The upper bound leaves room for ten billion counter-issued orders.
+LEGACY_BARCODE_SEED_MIN = 10**11
+BARCODE_SEED_START = 10**12
+BARCODE_SEED_LIMIT = BARCODE_SEED_START + 10**10
+
+# Viewer sandboxes (sandbox.py) issue seeds from a range of their own, so a demo receipt never
+# matches a real order and is_valid_barcode() rejects it everywhere outside the sandbox.
+SANDBOX_BARCODE_SEED_START = BARCODE_SEED_LIMIT
+SANDBOX_BARCODE_SEED_LIMIT = SANDBOX_BARCODE_SEED_START + 10**10
+
+
+def encode(x: int) -> int:
+    return (A * x + B) % M
+
+
+def decode(y: int) -> int:
+    return (A_INV * (y - B)) % M
+
+
+def encode_many(seeds):
+    """encode() over a sequence of seeds; returns a list."""
+    a, b, m = A, B, M
+    return [(a * x + b) % m for x in seeds]
+
+
+def decode_many(values):
+    """decode() over a sequence of barcode values; returns a list."""
+    a_inv, b, m = A_INV, B, M
+    return [(a_inv * (y - b)) % m for y in values]
+
+
+def is_issued_seed(seed: int) -> bool:
+    return LEGACY_BARCODE_SEED_MIN <= seed < BARCODE_SEED_LIMIT
+
+
+def is_valid_barcode(code) -> bool:
+    """
+    True if `code` could be an order barcode issued by this system: 13 ASCII digits whose decoded
+    seed lies in an issued range. False means no order can have it, so there is nothing to look up.
+    """
+    code = str(code)
+    if len(code) != BARCODE_LENGTH or not (code.isascii() and code.isdigit()):
+        return False
+    return is_issued_seed(decode(int(code)))
+
+
+def is_sandbox_barcode(code) -> bool:
+    """Like is_valid_barcode(), for barcodes issued inside a viewer sandbox."""
+    code = str(code)
+    if len(code) != BARCODE_LENGTH or not (code.isascii() and code.isdigit()):
+        return False
+    return SANDBOX_BARCODE_SEED_START <= decode(int(code)) < SANDBOX_BARCODE_SEED_LIMIT
+
+
+def valid_barcodes(codes):
+    """is_valid_barcode() over a sequence of codes; returns a list of booleans in the same order."""
+    return [is_valid_barcode(code) for code in codes]
+
+
+def benchmark(count=100000):
+    """Times decode() with the inverse recomputed per call (the old code) against the precomputed and batch paths."""
+    seeds = list(range(BARCODE_SEED_START, BARCODE_SEED_START + count))
+    values = encode_many(seeds)
+    codes = [str(value).zfill(BARCODE_LENGTH) for value in values]
+
+    def timed(label, func):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        print(f"{label:<34} {elapsed * 1000:9.1f} ms  ({elapsed / count * 1e6:.3f} us/code)")
+        return result
+
+    old = timed("decode, inverse per call", lambda: [(pow(A, -1, M) * (y - B)) % M for y in values])
+    scalar = timed("decode, precomputed inverse", lambda: [decode(y) for y in values])
+    batch = timed("decode_many", lambda: decode_many(values))
+    valid = timed("valid_barcodes", lambda: valid_barcodes(codes))
+    assert old == scalar == batch == seeds and all(valid)
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != 'bench':
+        print("Usage: python barcode_codec.py bench [count]")
+        return 2
+    benchmark(int(argv[2]) if len(argv) > 2 else 100000)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
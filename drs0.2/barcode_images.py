@@ -0,0 +1,139 @@
+# Barcode Images
+# Project Bin - สร้างภาพบาร์โค้ด (PNG/SVG) ฝั่งเซิร์ฟเวอร์ พร้อมแคช LRU ในหน่วยความจำและแคชไฟล์บนดิสก์
+#
+# Served by /barcode/<code>.png and /barcode/<code>.svg, so label pages and receipts reference an
+# image URL instead of running JsBarcode for every code. A code's image never changes (until
+# RENDERER_VERSION is bumped), so images are looked up in memory first, then on disk, and only
+# drawn when neither has them.
+#
+# Any code Code 128 B can draw is served: order barcodes, merchant EAN/UPC codes from
+# tbl_products and legacy or typed-in order barcodes alike (is_drawable()).
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+import code128
+
+
+RENDERER_VERSION = 1  # bump when the drawing changes, so old cached images are not reused
+MODULE_WIDTH = 2      # pixels per module
+BAR_HEIGHT = 80
+TEXT_HEIGHT = 22
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+MAX_CODE_LENGTH = 64  # longer codes are refused, so they can't flood the caches
+_SAFE_NAME = re.compile(r'[0-9A-Za-z_-]+')
+
+
+def is_drawable(code):
+    """True if `code` is printable ASCII (what Code 128 B encodes) of at most MAX_CODE_LENGTH characters."""
+    return 0 < len(code) <= MAX_CODE_LENGTH and all(32 <= ord(char) <= 126 for char in code)
+
+
+def cache_name(code):
+    """File name (and ETag) part for a code: the code itself, or a hash if it has other characters."""
+    if _SAFE_NAME.fullmatch(code):
+        return code
+    return '~' + hashlib.sha1(code.encode('ascii')).hexdigest()  # '~' is never in a plain name
+
+
+def render(code, fmt):
+    """Draws `code` as PNG (bars + digits underneath) or SVG (bars only). Returns bytes."""
+    if fmt == 'svg':
+        return code128.svg(code, MODULE_WIDTH, BAR_HEIGHT).encode('utf-8')
+
+    _, total_modules = code128.bar_runs(code)
+    width = total_modules * MODULE_WIDTH
+    image = Image.new('L', (width, BAR_HEIGHT + TEXT_HEIGHT), 255)
+    draw = ImageDraw.Draw(image)
+    code128.draw(draw, code, 0, 0, width, BAR_HEIGHT)
+    font = ImageFont.load_default(18)
+    draw.text(((width - draw.textlength(code, font=font)) / 2, BAR_HEIGHT + 2), code, font=font, fill=0)
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class BarcodeImageCache:
+    """
+    Rendered barcode images: an in-memory LRU of at most `max_entries` images in front of a
+    directory of files (`cache_dir`, None to keep images in memory only).
+    """
+
+    def __init__(self, cache_dir=None, max_entries=512):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, code, fmt):
+        return os.path.join(self.cache_dir, f"{cache_name(code)}.v{RENDERER_VERSION}.{fmt}")
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read_file(self, code, fmt):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(code, fmt), 'rb') as image_file:
+                return image_file.read()
+        except OSError:
+            return None
+
+    def _write_file(self, code, fmt, data):
+        if not self.cache_dir:
+            return
+        path = self._path(code, fmt)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as image_file:
+                image_file.write(data)
+            os.replace(tmp_path, path)
+        except OSError as err:
+            print(f"[Barcode] Could not cache image: {err}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, code, fmt):
+        """
+        Image bytes for a code in 'png' or 'svg'. The caller validates the code (is_drawable)
+        first, so garbage never reaches the caches.
+        """
+        key = (code, fmt)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+
+        data = self._read_file(code, fmt)
+        if data is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            data = render(code, fmt)
+            self._write_file(code, fmt, data)
+            with self._lock:
+                self.misses += 1
+        self._remember(key, data)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
@@ -0,0 +1,345 @@
+# Cart Operations
+# Project Bin - เพิ่มสินค้าที่สแกนเข้าคำสั่งซื้อ (ใช้ร่วมกันทั้งฟอร์มและ API สแกน) ด้วยจำนวน query น้อยที่สุด
+#
+# Usage:
+#   python cart_ops.py bench <store_id> <email> [scans] [products]   # one commit per scan vs one batch
+#
+# The benchmark scans into throwaway BENCH- orders and puts the stock back afterwards.
+
+import sys
+import time
+import uuid
+
+import mysql.connector
+
+from db_config import DB_CONFIG
+import data_versions
+import search_index
+import site_stats
+import inventory
+
+
+MAX_BATCH_SCANS = 500
+
+
+class ScanError(Exception):
+    """A scan that cannot be added (unknown product, not enough stock). The message is shown to the user."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def add_scanned_item(cursor, store_id, order_id, order_barcode, email, products_id, quantity=1):
+    """
+    Adds `quantity` of a scanned product to the open order: increments the customer's existing
+    line for the product or inserts a new one, and takes the quantity from the store's stock.
+    Does not commit. Returns the id of the order line; raises ScanError if it cannot be added.
+    """
+    # Stock is checked and taken in one statement, so two tills scanning the last item cannot both get it
+    if not inventory.take(cursor, products_id, quantity, store_id):
+        product = inventory.shortage(cursor, products_id, store_id)
+        if not product:
+            raise ScanError("ไม่พบสินค้าตามบาร์โค้ดที่ระบุในร้านค้าของคุณ!", status=404)
+        raise ScanError(f"สินค้า {product[0]} มีสต็อกไม่พอ. มีในสต็อก: {product[1]}", status=409)
+
+    # LAST_INSERT_ID(id) hands back the updated line's id without another SELECT
+    cursor.execute("""
+        UPDATE tbl_order SET quantity = quantity + %s, id = LAST_INSERT_ID(id)
+        WHERE order_id = %s AND products_id = %s AND email = %s AND store_id = %s
+        ORDER BY id LIMIT 1
+    """, (quantity, order_id, products_id, email, store_id))
+    if cursor.rowcount:
+        line_id = cursor.lastrowid
+    else:
+        cursor.execute("""
+            INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id)
+            SELECT %s, products_id, products_name, %s, 0, %s, %s, store_id
+            FROM tbl_products WHERE products_id = %s AND store_id = %s
+        """, (order_id, quantity, email, order_barcode, products_id, store_id))
+        line_id = cursor.lastrowid
+        search_index.reindex(cursor, 'order', [line_id])
+
+    site_stats.bump(cursor, total_quantity=quantity)
+    data_versions.bump(cursor, ('orders', 'products'), store_id)
+    return line_id
+
+
+def _totals_sql(order_id, store_id, email=None):
+    """The order's running totals as one row (line_count, total_quantity, total_price). Returns (sql, params)."""
+    totals_filter, params = "", [order_id, store_id]
+    if email:
+        totals_filter = " AND t.email = %s"
+        params.append(email)
+    return f"""
+        SELECT COUNT(*) AS line_count, COALESCE(SUM(t.quantity), 0) AS total_quantity,
+               COALESCE(SUM(t.quantity * COALESCE(tp.price, 0)), 0) AS total_price
+        FROM tbl_order t
+        LEFT JOIN tbl_products tp ON tp.products_id = t.products_id AND tp.store_id = t.store_id
+        WHERE t.order_id = %s AND t.store_id = %s{totals_filter}
+    """, params
+
+
+def _totals(row):
+    return {
+        'line_count': int(row['line_count']),
+        'total_quantity': int(row['total_quantity']),
+        'total_price': float(row['total_price']),
+    }
+
+
+def order_line_with_totals(cursor, line_id, order_id, store_id, email=None):
+    """
+    Returns one order line (with its product's price and remaining stock) and the running totals
+    of the order in a single query. `email` limits the totals to one customer (members see only their lines).
+    Needs a dictionary cursor.
+    """
+    totals_sql, params = _totals_sql(order_id, store_id, email)
+    cursor.execute(f"""
+        SELECT o.id, o.order_id, o.products_id, o.products_name, o.quantity, o.disquantity, o.email,
+               o.barcode_id, o.order_date, p.price, p.stock,
+               totals.line_count, totals.total_quantity, totals.total_price
+        FROM tbl_order o
+        LEFT JOIN tbl_products p ON p.products_id = o.products_id AND p.store_id = o.store_id
+        JOIN ({totals_sql}) AS totals
+        WHERE o.id = %s
+    """, tuple(params + [line_id]))
+    row = cursor.fetchone()
+    if not row:
+        return None, None
+
+    price = float(row['price'] or 0.0)
+    line = {
+        'id': row['id'],
+        'order_id': row['order_id'],
+        'products_id': row['products_id'],
+        'products_name': row['products_name'],
+        'price': price,
+        'line_total': price * row['quantity'],
+        'barcode_id': row['barcode_id'] or '',
+        'quantity': row['quantity'],
+        'disquantity': row['disquantity'],
+        'email': row['email'],
+        'order_date': row['order_date'].strftime('%Y-%m-%d %H:%M') if row['order_date'] else '',
+        'stock': int(row['stock'] or 0),
+    }
+    return line, _totals(row)
+
+
+def order_totals(cursor, order_id, store_id, email=None):
+    """Returns the running totals of an order (see order_line_with_totals). Needs a dictionary cursor."""
+    totals_sql, params = _totals_sql(order_id, store_id, email)
+    cursor.execute(totals_sql, tuple(params))
+    return _totals(cursor.fetchone())
+
+
+# --- Batch scans ---
+
+def _aggregate_scans(scans):
+    """
+    Sums repeated codes: `scans` holds codes (products_id or barcode_id) or {'code', 'quantity'} dicts.
+    Returns {code: quantity} in the order the codes were first scanned; invalid quantities count as 0.
+    """
+    quantities = {}
+    for scan in scans:
+        if isinstance(scan, dict):
+            code, quantity = scan.get('code') or scan.get('products_id'), scan.get('quantity', 1)
+        else:
+            code, quantity = scan, 1
+        code = str(code or '').strip()
+        if not code:
+            continue
+        try:
+            quantity = max(int(quantity), 0)  # a negative entry must not cancel other scans
+        except (TypeError, ValueError):
+            quantity = 0
+        quantities[code] = quantities.get(code, 0) + quantity
+    return quantities
+
+
+def _in_list(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _order_lines(cursor, order_id, email, store_id, products_ids):
+    """{products_id: id of the customer's first line for it} within the order."""
+    cursor.execute(f"""
+        SELECT id, products_id FROM tbl_order
+        WHERE order_id = %s AND email = %s AND store_id = %s AND products_id IN ({_in_list(products_ids)})
+        ORDER BY id
+    """, [order_id, email, store_id] + list(products_ids))
+    lines = {}
+    for row in cursor.fetchall():
+        lines.setdefault(row['products_id'], row['id'])
+    return lines
+
+
+def add_scanned_items(cursor, store_id, order_id, order_barcode, email, scans):
+    """
+    Adds a batch of scans to the open order, like add_scanned_item() for each scan but with a
+    fixed number of statements: repeated codes are summed first, each product gets one conditional
+    stock update, and the order lines are written with executemany.
+    Products that cannot be added (unknown code, bad quantity, not enough stock) are skipped and
+    reported; the rest are added. Does not commit. Needs a dictionary cursor.
+    Returns one result per distinct code, in scan order:
+    {'code', 'quantity', 'status': 'ok' | 'error', 'message', 'products_id', 'line_id'}.
+    """
+    quantities = _aggregate_scans(scans)
+    if not quantities:
+        return []
+    results = {code: {'code': code, 'quantity': quantity, 'status': 'error', 'message': None,
+                      'products_id': None, 'line_id': None}
+               for code, quantity in quantities.items()}
+
+    # One lookup for every code; a products_id match wins over a barcode_id match
+    codes = list(quantities)
+    cursor.execute(f"""
+        SELECT products_id, barcode_id, products_name FROM tbl_products
+        WHERE store_id = %s AND (products_id IN ({_in_list(codes)}) OR barcode_id IN ({_in_list(codes)}))
+    """, [store_id] + codes + codes)
+    products = cursor.fetchall()
+    products_by_code = {product['barcode_id']: product for product in products if product['barcode_id']}
+    products_by_code.update({product['products_id']: product for product in products})
+
+    wanted = {}  # products_id -> total quantity over every code that resolved to it
+    for code, quantity in quantities.items():
+        product = products_by_code.get(code)
+        if not product:
+            results[code]['message'] = "ไม่พบสินค้าตามบาร์โค้ดที่ระบุในร้านค้าของคุณ!"
+        elif quantity <= 0:
+            results[code]['message'] = "จำนวนสินค้าไม่ถูกต้อง"
+        else:
+            results[code]['products_id'] = product['products_id']
+            wanted[product['products_id']] = wanted.get(product['products_id'], 0) + quantity
+
+    # Conditional decrement per product, in key order so two batches lock rows in the same order
+    taken, short = {}, []
+    for products_id in sorted(wanted):
+        if inventory.take(cursor, products_id, wanted[products_id], store_id):
+            taken[products_id] = wanted[products_id]
+        else:
+            short.append(products_id)
+    if short:
+        cursor.execute(f"SELECT products_id, products_name, stock FROM tbl_products WHERE store_id = %s AND products_id IN ({_in_list(short)})",
+                       [store_id] + short)
+        for product in cursor.fetchall():
+            for result in results.values():
+                if result['products_id'] == product['products_id']:
+                    result['message'] = f"สินค้า {product['products_name']} มีสต็อกไม่พอ. มีในสต็อก: {int(product['stock'] or 0)}"
+
+    if taken:
+        lines = _order_lines(cursor, order_id, email, store_id, list(taken))
+        names = {product['products_id']: product['products_name'] for product in products}
+        if lines:
+            cursor.executemany("UPDATE tbl_order SET quantity = quantity + %s WHERE id = %s",
+                               [(taken[products_id], line_id) for products_id, line_id in lines.items()])
+        new_products = [products_id for products_id in taken if products_id not in lines]
+        if new_products:
+            # mysql.connector sends an executemany INSERT as one multi-row statement
+            cursor.executemany("""
+                INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id)
+                VALUES (%s, %s, %s, %s, 0, %s, %s, %s)
+            """, [(order_id, products_id, names[products_id], taken[products_id], email, order_barcode, store_id)
+                  for products_id in new_products])
+            new_lines = _order_lines(cursor, order_id, email, store_id, new_products)
+            search_index.reindex(cursor, 'order', new_lines.values())
+            lines.update(new_lines)
+
+        for result in results.values():
+            if result['products_id'] in taken:
+                result.update(status='ok', line_id=lines.get(result['products_id']),
+                              message=f"เพิ่มสินค้า {names[result['products_id']]} จำนวน {result['quantity']}")
+
+        site_stats.bump(cursor, total_quantity=sum(taken.values()))
+        data_versions.bump(cursor, ('orders', 'products'), store_id)
+
+    return [results[code] for code in quantities]
+
+
+# --- Benchmark ---
+
+def _bench_cleanup(conn, store_id, order_ids):
+    """Deletes the benchmark orders and gives the stock they took back."""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"SELECT id, products_id, quantity FROM tbl_order WHERE order_id IN ({_in_list(order_ids)})", list(order_ids))
+        line_ids, taken = [], {}
+        for row in cursor.fetchall():
+            line_ids.append(row['id'])
+            taken[row['products_id']] = taken.get(row['products_id'], 0) + row['quantity']
+        cursor.execute(f"DELETE FROM tbl_order WHERE order_id IN ({_in_list(order_ids)})", list(order_ids))
+        search_index.reindex(cursor, 'order', line_ids)  # removes the deleted lines from the index
+        cursor.executemany("UPDATE tbl_products SET stock = stock + %s WHERE products_id = %s AND store_id = %s",
+                           [(quantity, products_id, store_id) for products_id, quantity in taken.items()])
+        site_stats.bump(cursor, total_quantity=-sum(taken.values()))
+        data_versions.bump(cursor, ('orders', 'products'), store_id)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def benchmark(conn, store_id, email, scans=50, distinct=10):
+    """
+    Scans the same `scans` codes (spread over `distinct` in-stock products of the store) twice:
+    once with add_scanned_item() and a commit per scan, as the cart page does per request, and
+    once with add_scanned_items() and a single commit. Returns a dict of timings in ms.
+    """
+    per_product = -(-scans // distinct)  # ceil
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT products_id FROM tbl_products WHERE store_id = %s AND stock >= %s ORDER BY products_id LIMIT %s",
+                       (store_id, 2 * per_product, distinct))
+        products_ids = [row['products_id'] for row in cursor.fetchall()]
+        conn.commit()
+        if not products_ids:
+            raise ValueError(f"store {store_id} has no product with at least {2 * per_product} in stock")
+        codes = [products_ids[i % len(products_ids)] for i in range(scans)]
+
+        run = uuid.uuid4().hex[:8]
+        single_order, batch_order = f"BENCH-{run}-1", f"BENCH-{run}-N"
+        try:
+            started = time.perf_counter()
+            for code in codes:
+                add_scanned_item(cursor, store_id, single_order, 'BENCH', email, code)
+                conn.commit()
+            single_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            results = add_scanned_items(cursor, store_id, batch_order, 'BENCH', email, codes)
+            conn.commit()
+            batch_ms = (time.perf_counter() - started) * 1000
+        finally:
+            conn.rollback()
+            _bench_cleanup(conn, store_id, [single_order, batch_order])
+    finally:
+        cursor.close()
+
+    return {
+        'scans': scans, 'products': len(products_ids),
+        'single_ms': single_ms, 'batch_ms': batch_ms,
+        'failed': [result for result in results if result['status'] != 'ok'],
+    }
+
+
+def main(argv):
+    if len(argv) < 4 or argv[1] != 'bench':
+        print("Usage: python cart_ops.py bench <store_id> <email> [scans] [products]")
+        return 2
+    scans = int(argv[4]) if len(argv) > 4 else 50
+    distinct = int(argv[5]) if len(argv) > 5 else 10
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        r = benchmark(conn, int(argv[2]), argv[3], scans, distinct)
+    finally:
+        conn.close()
+    print(f"{r['scans']} scans over {r['products']} products")
+    print(f"  one commit per scan : {r['single_ms']:.1f} ms ({r['single_ms'] / r['scans']:.2f} ms/scan)")
+    print(f"  one batch, 1 commit : {r['batch_ms']:.1f} ms ({r['batch_ms'] / r['scans']:.2f} ms/scan)")
+    print(f"  speed-up            : {r['single_ms'] / r['batch_ms']:.1f}x")
+    if r['failed']:
+        print(f"  batch items not added: {r['failed']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
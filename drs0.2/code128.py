@@ -0,0 +1,96 @@
+# Code 128
+# Project Bin - สร้างบาร์โค้ด Code 128 (ชุด B และ C) และวาดลงภาพด้วย PIL ฝั่งเซิร์ฟเวอร์ ไม่ต้องพึ่ง JsBarcode จาก CDN
+#
+# Order barcodes are 13 digits, so digit strings use code set C (two digits per symbol, shorter
+# and easier to scan) and switch to code set B for a trailing odd digit; anything else is code set B.
+
+# Bar/space widths (in modules) of symbols 0-106; 103-105 are the start codes A/B/C, 106 is stop
+PATTERNS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+)
+START_B, START_C, CODE_B, STOP = 104, 105, 100, 106
+QUIET_ZONE = 10  # modules of white space required on each side
+
+
+def symbols(data):
+    """
+    Returns the symbol values for `data`: start code, data symbols and checksum (stop not included).
+    Raises ValueError for characters outside printable ASCII.
+    """
+    data = str(data)
+    if not data:
+        raise ValueError("empty barcode")
+    if any(not 32 <= ord(char) <= 126 for char in data):
+        raise ValueError("Code 128 B supports printable ASCII only")
+
+    if data.isdigit() and len(data) >= 4:
+        even = len(data) - len(data) % 2
+        values = [START_C] + [int(data[i:i + 2]) for i in range(0, even, 2)]
+        if even < len(data):
+            values += [CODE_B, ord(data[-1]) - 32]
+    else:
+        values = [START_B] + [ord(char) - 32 for char in data]
+    checksum = (values[0] + sum(position * value for position, value in enumerate(values[1:], start=1))) % 103
+    return values + [checksum]
+
+
+def modules(data):
+    """
+    The barcode as a string of '1' (bar) and '0' (space) modules, quiet zones included.
+    """
+    bits = []
+    for value in symbols(data) + [STOP]:
+        for index, width in enumerate(PATTERNS[value]):
+            bits.append(('1' if index % 2 == 0 else '0') * int(width))
+    quiet = '0' * QUIET_ZONE
+    return quiet + ''.join(bits) + quiet
+
+
+def bar_runs(data):
+    """(start module, width) of every bar, for drawing."""
+    runs = []
+    pattern = modules(data)
+    start = None
+    for position, bit in enumerate(pattern + '0'):
+        if bit == '1' and start is None:
+            start = position
+        elif bit == '0' and start is not None:
+            runs.append((start, position - start))
+            start = None
+    return runs, len(pattern)
+
+
+def draw(image_draw, data, x, y, width, height, fill=0):
+    """
+    Draws the barcode into a box on a PIL ImageDraw, using the widest whole-pixel module that fits
+    (whole pixels keep bar edges sharp for scanners). Returns the drawn width in pixels.
+    """
+    runs, total_modules = bar_runs(data)
+    module = max(1, width // total_modules)
+    offset = x + (width - module * total_modules) // 2
+    for start, run in runs:
+        image_draw.rectangle([offset + start * module, y, offset + (start + run) * module - 1, y + height - 1], fill=fill)
+    return module * total_modules
+
+
+def svg(data, module_width=2, height=80):
+    """
+    The barcode as a standalone SVG document (bars only). Adjacent bars are merged into one
+    path, so the file stays small and scales without blurring.
+    """
+    runs, total_modules = bar_runs(data)
+    path = ''.join(f"M{start * module_width} 0h{run * module_width}v{height}h-{run * module_width}z" for start, run in runs)
+    width = total_modules * module_width
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {width} {height}" shape-rendering="crispEdges">'
+            f'<rect width="100%" height="100%" fill="#fff"/><path d="{path}" fill="#000"/></svg>')
@@ -0,0 +1,54 @@
+# Streaming CSV Export
+# Project Bin - ส่งออก CSV แบบสตรีม (อ่านทีละชุดด้วย fetchmany ใช้หน่วยความจำคงที่)
+
+import csv
+from io import StringIO
+
+import mysql.connector
+
+
+FETCH_BATCH_SIZE = 500
+
+
+def open_export_cursor(conn, sql, params=()):
+    """
+    Runs the export query on an unbuffered cursor, so rows stay on the server until fetched.
+    Executing up front lets the route report SQL errors before the download starts.
+    """
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    try:
+        cursor.execute(sql, params)
+    except mysql.connector.Error:
+        cursor.close()
+        raise
+    return cursor
+
+
+def stream_csv(conn, cursor, header, row_values, batch_size=FETCH_BATCH_SIZE):
+    """
+    Generator yielding the CSV one fetchmany() batch at a time: the header first, then rows
+    as they arrive from the server. `row_values(row)` maps a result row to the CSV columns.
+    Closes the cursor and returns the connection when the download finishes or is aborted.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    try:
+        writer.writerow(header)
+        yield buffer.getvalue()
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            buffer.seek(0)
+            buffer.truncate(0)
+            writer.writerows(row_values(row) for row in rows)
+            yield buffer.getvalue()
+    except mysql.connector.Error as err:
+        # Headers are already sent, so the client just gets a truncated file
+        print(f"Error streaming CSV export: {err}")
+    finally:
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass
+        conn.close()
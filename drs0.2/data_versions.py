@@ -0,0 +1,88 @@
+# Data Versions
+# Project Bin - เลขเวอร์ชันข้อมูลต่อร้านค้า (ใช้เป็นคีย์แคช: เปลี่ยนข้อมูลเมื่อไหร่ เวอร์ชันขยับ แคชเก่าก็ใช้ไม่ได้ทันที)
+#
+# Each area (e.g. 'orders') has one counter per store plus an 'all stores' counter for
+# changes whose store is unknown or that touch many stores. Counters only ever go up.
+
+ALL_STORES = '*'
+
+
+def _scope(area, store_id):
+    # Rows without a store only show up in all-stores results, but bumping every store is the safe choice
+    if not store_id:
+        return f"{area}:{ALL_STORES}"
+    return f"{area}:{int(store_id)}"
+
+
+def bump(cursor, area, *store_ids):
+    """
+    Advances the version of `area` (or of each area in a tuple) for the given stores
+    (no store ids: for all stores).
+    Does not commit: call it before the caller's own commit so the version moves with the data.
+    """
+    areas = (area,) if isinstance(area, str) else area
+    scopes = sorted({_scope(name, store_id) for name in areas for store_id in (store_ids or (None,))})
+    placeholders = ', '.join(['(%s, 1)'] * len(scopes))
+    cursor.execute(f"""
+        INSERT INTO tbl_data_version (scope, version) VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, scopes)
+
+
+def bump_stores_of(cursor, area, store_id_sql, params=()):
+    """
+    Like bump(), for the stores returned by `store_id_sql` (a SELECT of a single store_id column),
+    done in one statement without fetching the store ids first.
+    """
+    cursor.execute(f"""
+        INSERT INTO tbl_data_version (scope, version)
+        SELECT DISTINCT CONCAT(%s, COALESCE(affected.store_id, %s)), 1 FROM ({store_id_sql}) AS affected
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, (f"{area}:", ALL_STORES, *params))
+
+
+def current(conn, area, store_id=None):
+    """
+    Returns the data version of `area` for one store (its own counter plus the all-stores
+    counter) or, with store_id=None, across every store. Either value rises on any change
+    that can affect it, so it is safe to use in a cache key.
+    """
+    cursor = conn.cursor()
+    try:
+        if store_id is None:
+            cursor.execute("SELECT COALESCE(SUM(version), 0) FROM tbl_data_version WHERE scope LIKE %s", (f"{area}:%",))
+        else:
+            cursor.execute("SELECT COALESCE(SUM(version), 0) FROM tbl_data_version WHERE scope IN (%s, %s)",
+                           (_scope(area, store_id), _scope(area, None)))
+        return int(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+def current_many(conn, keys):
+    """
+    Like current(), for several (area, store_id) pairs in one query.
+    Returns {(area, store_id): version}.
+    """
+    conditions, params = [], []
+    for area, store_id in keys:
+        if store_id is None:
+            conditions.append("scope LIKE %s")
+            params.append(f"{area}:%")
+        else:
+            conditions.append("scope IN (%s, %s)")
+            params.extend([_scope(area, store_id), _scope(area, None)])
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT scope, version FROM tbl_data_version WHERE {' OR '.join(conditions)}", tuple(params))
+        found = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+    versions = {}
+    for area, store_id in keys:
+        if store_id is None:
+            versions[(area, store_id)] = sum(int(version) for scope, version in found.items() if scope.startswith(f"{area}:"))
+        else:
+            versions[(area, store_id)] = int(found.get(_scope(area, store_id), 0)) + int(found.get(_scope(area, None), 0))
+    return versions
@@ -0,0 +1,13 @@
+# Database Configuration
+# Project Bin - ค่าการเชื่อมต่อฐานข้อมูล (ใช้ร่วมกันระหว่าง app.py และสคริปต์ command line)
+#
+# Kept apart from app.py so the command line tools (migrations.py, janitor.py, ...) can connect
+# without importing the Flask app, its connection pool and session store.
+
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': '',
+    'database': 'project_bin', # Make sure this matches your database name
+    'consume_results': True # Routes and helpers share one connection per request; discard unread rows
+}
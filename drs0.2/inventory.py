@@ -0,0 +1,155 @@
+# Inventory
+# Project Bin - ตัดและคืนสต็อกสินค้าแบบ atomic (ตรวจและตัดใน UPDATE เดียว) ภายใน transaction เดียวกับคำสั่งซื้อ
+#
+# Usage:
+#   python inventory.py stress <store_id> [workers] [stock] [naive]   # parallel scans must never oversell
+#
+# take() checks and decrements stock in one statement (UPDATE ... WHERE stock >= qty) and reports
+# through rowcount whether it succeeded. The row stays locked until the caller commits or rolls
+# back, so the order write that follows belongs to the same all-or-nothing change. Reading the stock
+# first and comparing it in Python lets two cashiers both see the last item and both sell it.
+
+import sys
+import threading
+import time
+import uuid
+
+import mysql.connector
+
+from db_config import DB_CONFIG
+
+
+def _where(products_id, store_id):
+    if store_id is None:
+        return "products_id = %s", [products_id]
+    return "products_id = %s AND store_id = %s", [products_id, store_id]
+
+
+def take(cursor, products_id, quantity, store_id=None):
+    """
+    Takes `quantity` from the product's stock if at least that much is left. A negative quantity
+    gives stock back. Returns True if the stock changed (or quantity is 0), False if there was not
+    enough stock or no such product (in `store_id`, when given). Does not commit.
+    """
+    if not quantity:
+        return True
+    where, params = _where(products_id, store_id)
+    if quantity > 0:
+        cursor.execute(f"UPDATE tbl_products SET stock = stock - %s WHERE {where} AND stock >= %s",
+                       [quantity] + params + [quantity])
+    else:
+        cursor.execute(f"UPDATE tbl_products SET stock = stock - %s WHERE {where}", [quantity] + params)
+    return cursor.rowcount > 0
+
+
+def give_back(cursor, products_id, quantity, store_id=None):
+    """Returns `quantity` to the product's stock (e.g. an order line was deleted). Does not commit."""
+    return take(cursor, products_id, -quantity, store_id)
+
+
+def shortage(cursor, products_id, store_id=None):
+    """
+    After a failed take(): the product's (name, stock) for the error message, or None if the
+    product does not exist (in `store_id`, when given).
+    """
+    where, params = _where(products_id, store_id)
+    cursor.execute(f"SELECT products_name, stock FROM tbl_products WHERE {where}", params)
+    row = cursor.fetchone()
+    if not row:
+        return None
+    if isinstance(row, dict):
+        return row['products_name'], int(row['stock'] or 0)
+    return row[0], int(row[1] or 0)
+
+
+# --- Stress test ---
+
+def _naive_take(cursor, products_id, quantity):
+    """The old read-check-write sequence, kept only to show what the stress test guards against."""
+    cursor.execute("SELECT stock FROM tbl_products WHERE products_id = %s", (products_id,))
+    (current,) = cursor.fetchone()
+    if current < quantity:
+        return False
+    cursor.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (quantity, products_id))
+    return True
+
+
+def stress(db_config, store_id, workers=16, initial_stock=200, naive=False):
+    """
+    Creates a throwaway product with `initial_stock`, lets `workers` connections scan it one item
+    per transaction until it runs out, then checks that exactly `initial_stock` scans succeeded and
+    the stock ended at 0 (never below). The product is deleted afterwards. Returns a result dict.
+    """
+    products_id = f"STRESS-{uuid.uuid4().hex[:12]}"
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO tbl_products (products_id, products_name, price, stock, store_id) VALUES (%s, %s, 0, %s, %s)",
+                   (products_id, 'stock stress test', initial_stock, store_id))
+    conn.commit()
+
+    sold = [0] * workers
+    errors = []
+    start = threading.Barrier(workers)
+
+    def scanner(index):
+        worker_conn = mysql.connector.connect(**db_config)
+        worker_cursor = worker_conn.cursor()
+        try:
+            start.wait()
+            # Keep scanning until a scan is refused, plus a few more so late racers are exercised too
+            refused = 0
+            while refused < 3:
+                ok = _naive_take(worker_cursor, products_id, 1) if naive else take(worker_cursor, products_id, 1, store_id)
+                worker_conn.commit()
+                if ok:
+                    sold[index] += 1
+                else:
+                    refused += 1
+        except Exception as err:
+            errors.append(err)
+        finally:
+            worker_cursor.close()
+            worker_conn.close()
+
+    threads = [threading.Thread(target=scanner, args=(i,)) for i in range(workers)]
+    started = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        cursor.execute("SELECT stock FROM tbl_products WHERE products_id = %s", (products_id,))
+        (final_stock,) = cursor.fetchone()
+    finally:
+        cursor.execute("DELETE FROM tbl_products WHERE products_id = %s", (products_id,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    total_sold = sum(sold)
+    return {
+        'workers': workers, 'initial_stock': initial_stock, 'sold': total_sold, 'final_stock': final_stock,
+        'scans_per_second': total_sold / elapsed if elapsed else 0.0, 'errors': [str(err) for err in errors],
+        'ok': not errors and total_sold == initial_stock and final_stock == 0,
+    }
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] != 'stress':
+        print("Usage: python inventory.py stress <store_id> [workers] [stock] [naive]")
+        return 2
+    workers = int(argv[3]) if len(argv) > 3 else 16
+    initial_stock = int(argv[4]) if len(argv) > 4 else 200
+    naive = len(argv) > 5 and argv[5] == 'naive'
+    r = stress(DB_CONFIG, int(argv[2]), workers, initial_stock, naive)
+    print(f"{'naive read-check-write' if naive else 'atomic take()'}: {r['workers']} workers, stock {r['initial_stock']}")
+    print(f"  sold {r['sold']}, final stock {r['final_stock']}, {r['scans_per_second']:.0f} scans/s")
+    if r['errors']:
+        print(f"  errors: {r['errors']}")
+    print("  OK: no oversell" if r['ok'] else "  FAILED: stock was oversold or the run had errors")
+    return 0 if r['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
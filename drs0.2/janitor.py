@@ -0,0 +1,208 @@
+# Janitor
+# Project Bin - เก็บกวาดร้านค้าจำลองของ viewer ที่หมดอายุ และแถวที่ค้างอยู่โดยไม่มีร้านค้า (ลบทีละชุด)
+#
+# A viewer's temporary store (VIEWER_SANDBOX=0, or left over from before viewer sandboxes) is only
+# removed when the viewer logs out; a session that simply expires leaves the store and its rows
+# behind. The janitor finds viewer stores older than `max_age` without recent orders or online
+# users and deletes their orders, products and categories in batches of `batch_size` rows: each
+# batch selects ids through the store_id index, deletes them by primary key and commits, so no
+# statement locks many rows or runs long on the hot tables.
+#
+# Rows whose store_id was set to NULL by the old logout cleanup can also be purged (null_store=True).
+# Administrators may create rows without a store on purpose, so this is never done by default.
+#
+# Usage:
+#   python janitor.py run [max_age_hours] [--null-store]   # clean up now and print what was reclaimed
+
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+from db_config import DB_CONFIG
+import data_versions
+import search_index
+import site_stats
+
+
+VIEWER_STORE_NAME_PREFIX = 'ร้านค้าสาธิต Viewer '
+VIEWER_STORE_ID_MIN, VIEWER_STORE_ID_MAX = 100000, 999999  # generate_unique_store_id() picks from this range
+BATCH_SIZE = 500
+MAX_STORES_PER_RUN = 100
+
+
+def _purge_batches(conn, select_sql, params, doc_type, table, batch_size, on_batch=None):
+    """
+    Deletes the rows `select_sql` (selecting `id` first) finds, `batch_size` ids at a time, by
+    primary key. Each batch removes its search postings, runs `on_batch(cursor, rows)` and
+    commits. Returns the number of rows deleted.
+    """
+    deleted = 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute(f"{select_sql} LIMIT %s", (*params, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return deleted
+            ids = [row[0] for row in rows]
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+            if doc_type:
+                search_index.reindex(cursor, doc_type, ids)  # the documents are gone: only drops their postings
+            if on_batch:
+                on_batch(cursor, rows)
+            conn.commit()
+            deleted += len(ids)
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _order_stats(cursor, rows):
+    # rows: (id, quantity, disquantity); the homepage counters drop with the orders
+    site_stats.bump(cursor, total_quantity=-sum(row[1] for row in rows), total_disquantity=-sum(row[2] for row in rows))
+
+
+def purge_store_rows(conn, store_id, batch_size=BATCH_SIZE):
+    """
+    Deletes the orders, products and categories of one store in batches (`store_id` None: the
+    rows without a store). Commits per batch. Returns {'orders': n, 'products': n, 'categories': n}.
+    """
+    if store_id is None:
+        condition, params = "store_id IS NULL", ()
+    else:
+        condition, params = "store_id = %s", (store_id,)
+
+    def bump(area):
+        return lambda cursor, rows: data_versions.bump(cursor, area, *params)  # no store: all-stores version
+
+    def order_batch(cursor, rows):
+        _order_stats(cursor, rows)
+        bump('orders')(cursor, rows)
+
+    return {
+        'orders': _purge_batches(conn, f"SELECT id, quantity, disquantity FROM tbl_order WHERE {condition}", params,
+                                 'order', 'tbl_order', batch_size, order_batch),
+        'products': _purge_batches(conn, f"SELECT id FROM tbl_products WHERE {condition}", params,
+                                   'product', 'tbl_products', batch_size, bump('products')),
+        'categories': _purge_batches(conn, f"SELECT id FROM tbl_category WHERE {condition}", params,
+                                     None, 'tbl_category', batch_size, bump('categories')),
+    }
+
+
+def delete_store(conn, store_id, batch_size=BATCH_SIZE):
+    """
+    Removes a store: its rows (purge_store_rows), its order number sequence and the store itself.
+    Its users are kept and detached from it. Returns the reclaimed row counts.
+    """
+    reclaimed = purge_store_rows(conn, store_id, batch_size)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE tbl_users SET store_id = NULL WHERE store_id = %s", (store_id,))
+        reclaimed['users_detached'] = cursor.rowcount
+        cursor.execute("DELETE FROM tbl_order_sequence WHERE store_id = %s", (store_id,))
+        cursor.execute("DELETE FROM tbl_stores WHERE store_id = %s", (store_id,))
+        reclaimed['stores'] = cursor.rowcount
+        data_versions.bump(cursor, ('stores', 'users'), store_id)
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return reclaimed
+
+
+def expired_viewer_stores(conn, max_age, limit=MAX_STORES_PER_RUN, is_active=None):
+    """
+    Ids of viewer stores created more than `max_age` seconds ago with no order placed since then.
+    `is_active(store_id)`, if given, can keep a store that is still in use (e.g. a user online in it).
+    """
+    cutoff = datetime.now() - timedelta(seconds=max_age)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT store_id FROM tbl_stores
+            WHERE store_id BETWEEN %s AND %s AND store_name LIKE %s AND created_at < %s
+            ORDER BY store_id LIMIT %s
+        """, (VIEWER_STORE_ID_MIN, VIEWER_STORE_ID_MAX, VIEWER_STORE_NAME_PREFIX + '%', cutoff, limit))
+        candidates = [row[0] for row in cursor.fetchall()]
+        expired = []
+        for store_id in candidates:
+            if is_active and is_active(store_id):
+                continue
+            # idx_order_store_date: one index probe per store
+            cursor.execute("SELECT 1 FROM tbl_order WHERE store_id = %s AND order_date >= %s LIMIT 1", (store_id, cutoff))
+            if cursor.fetchone() is None:
+                expired.append(store_id)
+        return expired
+    finally:
+        cursor.close()
+
+
+def run(conn, max_age, batch_size=BATCH_SIZE, max_stores=MAX_STORES_PER_RUN, is_active=None, null_store=False):
+    """
+    One janitor pass: deletes expired viewer stores (and, with null_store=True, the rows without
+    a store). Returns the reclaimed row counts, e.g. {'stores': 3, 'orders': 120, ...}.
+    """
+    totals = {'stores': 0, 'orders': 0, 'products': 0, 'categories': 0, 'users_detached': 0}
+    for store_id in expired_viewer_stores(conn, max_age, max_stores, is_active):
+        for name, count in delete_store(conn, store_id, batch_size).items():
+            totals[name] += count
+    if null_store:
+        for name, count in purge_store_rows(conn, None, batch_size).items():
+            totals[f"null_store_{name}"] = count
+    if totals['orders'] or totals.get('null_store_orders'):
+        site_stats.invalidate_cache()
+    return totals
+
+
+def start_janitor_thread(get_connection, max_age, interval=3600, is_active=None, null_store=False):
+    """Starts a daemon thread that runs run() every `interval` seconds."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            conn = get_connection()
+            if not conn:
+                print("[Janitor] Skipped: no database connection")
+                continue
+            try:
+                reclaimed = run(conn, max_age, is_active=is_active, null_store=null_store)
+                if any(reclaimed.values()):
+                    print(f"[Janitor] Reclaimed rows: {reclaimed}")
+            except mysql.connector.Error as err:
+                print(f"[Janitor] Cleanup failed: {err}")
+            finally:
+                conn.close()
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != 'run':
+        print("Usage: python janitor.py run [max_age_hours] [--null-store]")
+        return 2
+    args = [arg for arg in argv[2:] if not arg.startswith('--')]
+    max_age = float(args[0]) * 3600 if args else 24 * 3600
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        started = time.perf_counter()
+        reclaimed = run(conn, max_age, null_store='--null-store' in argv)
+        elapsed = time.perf_counter() - started
+    finally:
+        conn.close()
+    for name, count in reclaimed.items():
+        print(f"  {name:<28} {count}")
+    print(f"Done in {elapsed:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,350 @@
+# Schema Migrations
+# Project Bin - ระบบอัปเกรดโครงสร้างฐานข้อมูลตามลำดับเวอร์ชัน
+#
+# Usage:
+#   python migrations.py            # apply pending migrations
+#   python migrations.py status     # show current schema version
+#   python migrations.py explain    # check that hot queries use an index
+
+import sys
+
+import mysql.connector
+
+from db_config import DB_CONFIG
+
+
+SCHEMA_VERSION_TABLE = 'tbl_schema_version'
+
+
+def _index_exists(cursor, table, index_name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, index_name))
+    return cursor.fetchone() is not None
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def _add_index(cursor, table, index_name, columns):
+    """Creates an index unless it already exists (CREATE INDEX has no IF NOT EXISTS in MySQL)."""
+    if not _index_exists(cursor, table, index_name):
+        cursor.execute(f"CREATE INDEX `{index_name}` ON `{table}` ({columns})")
+
+
+# --- Migrations ---
+# Each migration receives a cursor and must be safe to re-run.
+
+def _0001_order_hot_path_indexes(cursor):
+    # Bin scan / sensor refund path: WHERE barcode_id = %s [AND products_id = %s]
+    _add_index(cursor, 'tbl_order', 'idx_order_barcode', '`barcode_id`, `products_id`')
+    # Order listing: WHERE store_id = %s ORDER BY id DESC
+    _add_index(cursor, 'tbl_order', 'idx_order_store_id', '`store_id`, `id`')
+    # Profile stats: COUNT(*) / SUM(quantity), SUM(disquantity) WHERE email = %s (covering)
+    _add_index(cursor, 'tbl_order', 'idx_order_email', '`email`, `quantity`, `disquantity`')
+    # Cart: WHERE order_id = %s AND store_id = %s
+    _add_index(cursor, 'tbl_order', 'idx_order_order_store', '`order_id`, `store_id`')
+
+
+def _0002_store_scoped_lookup_indexes(cursor):
+    # Dropdowns and listings filtered by the user's store
+    _add_index(cursor, 'tbl_products', 'idx_products_store', '`store_id`, `products_name`')
+    _add_index(cursor, 'tbl_category', 'idx_category_store', '`store_id`')
+    _add_index(cursor, 'tbl_users', 'idx_users_store', '`store_id`')
+
+
+def _0003_order_number_sequence(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_order_sequence` (
+          `store_id` int(11) NOT NULL PRIMARY KEY,
+          `last_value` bigint(20) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+    # One-time backfill from existing numeric order ids (bucket 0 holds orders without a store)
+    cursor.execute("""
+        INSERT INTO tbl_order_sequence (store_id, last_value)
+        SELECT COALESCE(store_id, 0), MAX(CAST(order_id AS UNSIGNED))
+        FROM tbl_order
+        WHERE order_id REGEXP '^[0-9]+$'
+        GROUP BY COALESCE(store_id, 0)
+        ON DUPLICATE KEY UPDATE last_value = GREATEST(last_value, VALUES(last_value))
+    """)
+
+
+def _0004_order_barcode_counter(cursor):
+    from barcode_codec import decode
+    from sequences import BARCODE_SEED_START, BARCODE_SEQUENCE
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_sequence` (
+          `name` varchar(64) NOT NULL PRIMARY KEY,
+          `last_value` bigint(20) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+    # Legacy random barcodes decode to seeds below BARCODE_SEED_START and stay valid.
+    # Anything issued in the counter range (e.g. typed in by hand) pushes the counter past it.
+    cursor.execute("SELECT DISTINCT barcode_id FROM tbl_order WHERE barcode_id IS NOT NULL AND barcode_id != ''")
+    max_seed = None
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        for (barcode_id,) in rows:
+            if not str(barcode_id).isdigit():
+                continue
+            seed = decode(int(barcode_id))
+            if seed >= BARCODE_SEED_START and (max_seed is None or seed > max_seed):
+                max_seed = seed
+    if max_seed is not None:
+        cursor.execute("""
+            INSERT INTO tbl_sequence (name, last_value) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE last_value = GREATEST(last_value, VALUES(last_value))
+        """, (BARCODE_SEQUENCE, max_seed))
+
+
+def _0005_homepage_stats(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_stats` (
+          `name` varchar(64) NOT NULL PRIMARY KEY,
+          `value` bigint(20) NOT NULL DEFAULT 0
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+    # Seed from the base tables; from here on the write paths keep the counters current
+    cursor.execute("""
+        INSERT INTO tbl_stats (name, value)
+        SELECT 'total_users', COUNT(*) FROM tbl_users
+        UNION ALL SELECT 'total_quantity', COALESCE(SUM(quantity), 0) FROM tbl_order
+        UNION ALL SELECT 'total_disquantity', COALESCE(SUM(disquantity), 0) FROM tbl_order
+        ON DUPLICATE KEY UPDATE value = VALUES(value)
+    """)
+
+
+def _0006_search_index(cursor):
+    import search_index
+
+    # utf8mb4_bin: grams are already normalized, compare them byte for byte
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS `{search_index.INDEX_TABLE}` (
+          `doc_type` varchar(16) NOT NULL,
+          `gram` varchar(32) NOT NULL,
+          `doc_id` int(11) NOT NULL,
+          `field` varchar(32) NOT NULL,
+          `weight` smallint(6) NOT NULL DEFAULT 1,
+          PRIMARY KEY (`doc_type`, `gram`, `doc_id`, `field`),
+          KEY `idx_search_doc` (`doc_type`, `doc_id`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin
+    """)
+    for doc_type in search_index.DOC_TYPES:
+        search_index.rebuild(cursor, doc_type)
+
+
+def _0007_order_date_indexes(cursor):
+    # Order CSV export: WHERE order_date >= %s AND order_date < %s [AND store_id = %s]
+    _add_index(cursor, 'tbl_order', 'idx_order_date', '`order_date`')
+    _add_index(cursor, 'tbl_order', 'idx_order_store_date', '`store_id`, `order_date`')
+
+
+def _0008_data_versions(cursor):
+    # Per-store data version counters used as cache keys (see data_versions.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_data_version` (
+          `scope` varchar(64) NOT NULL PRIMARY KEY,
+          `version` bigint(20) NOT NULL DEFAULT 0
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+
+
+def _0009_server_sessions(cursor):
+    # Session data for SESSION_BACKEND=sql (see server_session.py); the cookie keeps only `sid`
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `tbl_session` (
+          `sid` varchar(64) NOT NULL PRIMARY KEY,
+          `data` mediumtext NOT NULL,
+          `expires_at` datetime NOT NULL,
+          KEY `idx_session_expires` (`expires_at`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin
+    """)
+
+
+def _0010_store_created_at(cursor):
+    # The janitor (janitor.py) removes viewer stores by age; existing stores count from now
+    if not _column_exists(cursor, 'tbl_stores', 'created_at'):
+        cursor.execute("ALTER TABLE `tbl_stores` ADD COLUMN `created_at` timestamp NOT NULL DEFAULT current_timestamp()")
+
+
+MIGRATIONS = [
+    (1, 'Hot-path secondary indexes on tbl_order', _0001_order_hot_path_indexes),
+    (2, 'Store-scoped lookup indexes on tbl_products, tbl_category, tbl_users', _0002_store_scoped_lookup_indexes),
+    (3, 'Per-store order number sequence (tbl_order_sequence) with backfill', _0003_order_number_sequence),
+    (4, 'Counter-based order barcodes (tbl_sequence)', _0004_order_barcode_counter),
+    (5, 'Incrementally maintained homepage counters (tbl_stats)', _0005_homepage_stats),
+    (6, 'Thai-aware n-gram search index (tbl_search_index) with backfill', _0006_search_index),
+    (7, 'Date-range indexes on tbl_order for CSV export', _0007_order_date_indexes),
+    (8, 'Per-store data version counters (tbl_data_version)', _0008_data_versions),
+    (9, 'Server-side session store (tbl_session)', _0009_server_sessions),
+    (10, 'Store creation time (tbl_stores.created_at) for the janitor', _0010_store_created_at),
+]
+
+
+def ensure_version_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS `{SCHEMA_VERSION_TABLE}` (
+          `version` int(11) NOT NULL PRIMARY KEY,
+          `description` varchar(255) NOT NULL,
+          `applied_at` timestamp NOT NULL DEFAULT current_timestamp()
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+
+
+def get_schema_version(conn):
+    """Returns the highest applied migration version (0 for a fresh database)."""
+    cursor = conn.cursor()
+    try:
+        ensure_version_table(cursor)
+        cursor.execute(f"SELECT MAX(version) FROM `{SCHEMA_VERSION_TABLE}`")
+        row = cursor.fetchone()
+        return row[0] or 0
+    finally:
+        cursor.close()
+
+
+def run_migrations(conn):
+    """
+    Applies every migration newer than the recorded schema version, in order.
+    Returns the list of versions applied. Stops at the first failure.
+    """
+    current = get_schema_version(conn)
+    applied = []
+    cursor = conn.cursor()
+    try:
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            print(f"[Migration] Applying {version:04d}: {description}")
+            migrate(cursor)
+            cursor.execute(f"INSERT INTO `{SCHEMA_VERSION_TABLE}` (version, description) VALUES (%s, %s)",
+                           (version, description))
+            conn.commit()
+            applied.append(version)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        print(f"[Migration] Failed: {err}")
+        raise
+    finally:
+        cursor.close()
+    return applied
+
+
+# --- Index usage check ---
+# Hot queries from app.py and esp32_python/python/app18.py, with sample parameters.
+# `table` is the name/alias of tbl_order as it appears in EXPLAIN output.
+HOT_QUERIES = [
+    ('app.py bin(): scan by barcode', 'o', """
+        SELECT o.*, p.price, p.products_name, p.category_id, s.store_name
+        FROM tbl_order o
+        JOIN tbl_products p ON o.products_id = p.products_id
+        LEFT JOIN tbl_stores s ON o.store_id = s.store_id
+        WHERE o.barcode_id = %s AND o.store_id = %s ORDER BY o.id DESC
+    """, ('0000000000000', 1)),
+    ('app.py bin(): add_disquantity', 'o', """
+        SELECT o.id, o.quantity, o.disquantity, o.products_name, o.products_id, p.stock, p.category_id, o.store_id
+        FROM tbl_order o
+        JOIN tbl_products p ON o.products_id = p.products_id
+        WHERE o.barcode_id = %s AND o.products_id = %s AND o.store_id = %s
+    """, ('0000000000000', 'P001', 1)),
+    ('app.py tbl_order(): store listing (keyset page)', 'o', """
+        SELECT o.*, p.category_id, p.price, s.store_name
+        FROM tbl_order o
+        LEFT JOIN tbl_products p ON o.products_id = p.products_id
+        LEFT JOIN tbl_stores s ON o.store_id = s.store_id
+        WHERE (o.store_id = %s) AND (o.id < %s) ORDER BY o.id DESC LIMIT %s
+    """, (1, 1000000, 51)),
+    ('app.py profile(): order stats', 'tbl_order', """
+        SELECT COUNT(*), SUM(quantity), SUM(disquantity) FROM tbl_order WHERE email = %s
+    """, ('someone@example.com',)),
+    ('app.py cart(): current order', 'o', """
+        SELECT o.*, p.price, p.products_name AS product_name_from_db, s.store_name
+        FROM tbl_order o
+        LEFT JOIN tbl_products p ON o.products_id = p.products_id
+        LEFT JOIN tbl_stores s ON o.store_id = s.store_id
+        WHERE o.order_id = %s AND o.store_id = %s ORDER BY o.id DESC
+    """, ('100001', 1)),
+    ('app18.py bin(): barcode store check', 'tbl_order', """
+        SELECT store_id FROM tbl_order WHERE barcode_id = %s LIMIT 1
+    """, ('0000000000000',)),
+    ('app18.py sensor refund: item lookup', 'tbl_order', """
+        SELECT id, quantity, disquantity, products_name, store_id FROM tbl_order
+        WHERE barcode_id = %s AND products_id = %s
+    """, ('0000000000000', 'P001')),
+    ('app18.py sensor refund: barcode totals', 'tbl_order', """
+        SELECT SUM(quantity) AS total_quantity, SUM(disquantity) AS total_disquantity
+        FROM tbl_order WHERE barcode_id = %s
+    """, ('0000000000000',)),
+    ('janitor.py: recent order probe', 'tbl_order', """
+        SELECT 1 FROM tbl_order WHERE store_id = %s AND order_date >= %s LIMIT 1
+    """, (1, '2000-01-01 00:00:00')),
+    ('janitor.py: delete batch of a store', 'tbl_order', """
+        SELECT id, quantity, disquantity FROM tbl_order WHERE store_id = %s LIMIT %s
+    """, (1, 500)),
+]
+
+
+def explain_hot_queries(conn):
+    """
+    Runs EXPLAIN for every hot query and reports which index tbl_order is read with.
+    Returns a list of dicts: name, key, type, rows, ok (False means a full table scan).
+    Note: on a near-empty table MySQL may still prefer a scan, so run this against real data.
+    """
+    report = []
+    cursor = conn.cursor(dictionary=True)
+    try:
+        for name, table, sql, params in HOT_QUERIES:
+            cursor.execute("EXPLAIN " + sql, params)
+            plan = [row for row in cursor.fetchall() if row.get('table') == table]
+            row = plan[0] if plan else {}
+            report.append({
+                'name': name,
+                'key': row.get('key'),
+                'type': row.get('type'),
+                'rows': row.get('rows'),
+                'ok': bool(row) and row.get('type') != 'ALL' and row.get('key') is not None,
+            })
+    finally:
+        cursor.close()
+    return report
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'migrate'
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        if command == 'migrate':
+            applied = run_migrations(conn)
+            print(f"Schema version: {get_schema_version(conn)} (applied: {applied or 'none'})")
+        elif command == 'status':
+            latest = MIGRATIONS[-1][0]
+            print(f"Schema version: {get_schema_version(conn)} (latest available: {latest})")
+        elif command == 'explain':
+            report = explain_hot_queries(conn)
+            for item in report:
+                status = 'OK  ' if item['ok'] else 'SCAN'
+                print(f"[{status}] {item['name']}: key={item['key']} type={item['type']} rows={item['rows']}")
+            return 0 if all(item['ok'] for item in report) else 1
+        else:
+            print(f"Unknown command: {command}")
+            return 2
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,89 @@
+# Keyset Pagination
+# Project Bin - แบ่งหน้าด้วย cursor (keyset บนคอลัมน์ id) ต้นทุนต่อหน้าคงที่ไม่ว่าตารางจะใหญ่แค่ไหน
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def parse_page_args(args, default_size=DEFAULT_PAGE_SIZE):
+    """
+    Reads `after`, `before`, `page` (1-based, for ranked results) and `per_page` from request args.
+    Invalid values fall back to the first page / default size; per_page is clamped to MAX_PAGE_SIZE.
+    """
+    def _int_arg(name):
+        try:
+            value = int(args.get(name, ''))
+        except ValueError:
+            return None
+        return value if value > 0 else None
+
+    per_page = _int_arg('per_page') or default_size
+    return {
+        'after': _int_arg('after'),
+        'before': _int_arg('before'),
+        'page': _int_arg('page') or 1,
+        'per_page': min(per_page, MAX_PAGE_SIZE),
+    }
+
+
+def keyset_page(cursor, select_sql, where_clauses, params, key, after=None, before=None, per_page=DEFAULT_PAGE_SIZE):
+    """
+    Fetches one page of rows ordered newest-first by `key` (a unique integer column).
+
+    select_sql    -- SELECT ... FROM ... JOIN ... without WHERE / ORDER BY / LIMIT
+    where_clauses -- list of SQL conditions ANDed together (may be empty)
+    params        -- parameters for where_clauses, in order
+    key           -- qualified key column, e.g. 'o.id'
+    after         -- return rows older than this key (the "next" cursor)
+    before        -- return rows newer than this key (the "prev" cursor)
+
+    One extra row is read to know whether another page exists, so no COUNT(*) is needed.
+    Returns (rows, page) where page holds next_cursor / prev_cursor (None at either end) and per_page.
+    """
+    clauses = list(where_clauses)
+    query_params = list(params)
+    if before is not None:
+        clauses.append(f"{key} > %s")
+        query_params.append(before)
+        order = 'ASC'
+    else:
+        if after is not None:
+            clauses.append(f"{key} < %s")
+            query_params.append(after)
+        order = 'DESC'
+
+    sql = select_sql
+    if clauses:
+        sql += " WHERE " + " AND ".join(f"({clause})" for clause in clauses)
+    sql += f" ORDER BY {key} {order} LIMIT %s"
+    query_params.append(per_page + 1)
+
+    cursor.execute(sql, tuple(query_params))
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    column = key.split('.')[-1]
+    if before is not None:
+        # Walked backwards: restore newest-first order. There is always a newer-to-older page after this one.
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = after is not None, has_more
+
+    page = {
+        'per_page': per_page,
+        'next_cursor': rows[-1][column] if rows and has_older else None,
+        'prev_cursor': rows[0][column] if rows and has_newer else None,
+    }
+    return rows, page
+
+
+def numbered_page(page, per_page, has_more):
+    """Page info for OFFSET-paginated results (ranked search), shaped for the next/prev links."""
+    return {
+        'per_page': per_page,
+        'page': page,
+        'prev_page': page - 1 if page > 1 else None,
+        'next_page': page + 1 if has_more else None,
+    }
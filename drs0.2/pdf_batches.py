@@ -0,0 +1,196 @@
+# Batched PDF Rendering
+# Project Bin - สร้าง PDF ทีละชุด (batch) แบบขนาน แล้วรวมเป็นไฟล์เดียวพร้อมเลขหน้าต่อเนื่อง
+#
+# pisa lays out a whole HTML document in memory, so one call per report grows with the report.
+# Here every batch of rows is its own small document rendered in a worker process; the parts are
+# written to disk, merged with pypdf and stamped with "page / total" numbers at the end.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+
+BATCH_ROWS = 500
+
+
+def _template(template_dir, template_name):
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    env = Environment(loader=FileSystemLoader(template_dir), autoescape=select_autoescape(['html']))
+    return env.get_template(template_name)
+
+
+def _write_pdf(html, dest):
+    from xhtml2pdf import pisa
+
+    pisa_status = pisa.CreatePDF(html, dest=dest)
+    if pisa_status.err:
+        raise RuntimeError(f"PDF rendering failed ({pisa_status.err} errors)")
+
+
+def render_html_pdf(template_dir, template_name, context, out_path):
+    """Renders a template to out_path in one go (for small documents)."""
+    html = _template(template_dir, template_name).render(**context)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as pdf_file:
+            _write_pdf(html, pdf_file)
+        os.replace(tmp_path, out_path)  # readers never see a half-written file
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _failing_rows(template, context, rows):
+    """Bisects `rows` down to the ones that cannot be rendered on their own."""
+    try:
+        _write_pdf(template.render(**context, rows=rows), BytesIO())
+        return []
+    except Exception:
+        if len(rows) == 1:
+            return rows
+        middle = len(rows) // 2
+        return _failing_rows(template, context, rows[:middle]) + _failing_rows(template, context, rows[middle:])
+
+
+def render_batch(template_dir, template_name, context, rows, out_path, row_key):
+    """
+    Worker: renders one batch of rows (template variable `rows`) to out_path.
+    A row that breaks the template or the renderer is left out instead of failing the report;
+    returns the `row_key` values of the skipped rows.
+    """
+    template = _template(template_dir, template_name)
+    try:
+        html = template.render(**context, rows=rows)
+        with open(out_path, 'wb') as pdf_file:
+            _write_pdf(html, pdf_file)
+        return []
+    except Exception as err:
+        print(f"[PDF] Batch {os.path.basename(out_path)} failed ({err}), looking for bad rows")
+    bad_rows = _failing_rows(template, context, rows)
+    bad_ids = {id(row) for row in bad_rows}
+    with open(out_path, 'wb') as pdf_file:
+        _write_pdf(template.render(**context, rows=[row for row in rows if id(row) not in bad_ids]), pdf_file)
+    return [row.get(row_key) for row in bad_rows]
+
+
+def _page_number_overlay(page_sizes, font_size=8):
+    """One overlay page per output page, carrying "n / total" in the bottom right corner."""
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    overlay = canvas.Canvas(buffer)
+    total = len(page_sizes)
+    for number, (width, height) in enumerate(page_sizes, start=1):
+        overlay.setPageSize((width, height))
+        overlay.setFont('Helvetica', font_size)
+        overlay.setFillGray(0.45)
+        overlay.drawRightString(width - 36, 20, f"{number} / {total}")
+        overlay.showPage()
+    overlay.save()
+    buffer.seek(0)
+    return buffer
+
+
+def merge_parts(part_paths, out_path):
+    """Concatenates the part PDFs into out_path and numbers the pages continuously."""
+    from pypdf import PdfReader, PdfWriter
+
+    writer = PdfWriter()
+    for path in part_paths:
+        writer.append(path)
+    page_sizes = [(float(page.mediabox.width), float(page.mediabox.height)) for page in writer.pages]
+    overlay = PdfReader(_page_number_overlay(page_sizes))
+    for page, number_page in zip(writer.pages, overlay.pages):
+        page.merge_page(number_page)
+
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as pdf_file:
+            writer.write(pdf_file)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class BatchRenderer:
+    """
+    Renders batches of rows in parallel and keeps the part files in order.
+
+    At most `workers + 1` batches are queued or rendering at a time: add() waits for the oldest
+    one when the window is full, so memory stays bounded by the batch size, not the report size.
+    With workers=1 batches are rendered in the calling process.
+
+        with BatchRenderer(template_dir, 'report.html', context, workers=4, work_dir=...) as renderer:
+            for rows in batches:
+                renderer.add(rows)
+            renderer.wait()
+            renderer.add_part('summary.html', {'skipped': renderer.skipped})
+            renderer.finish(out_path)
+    """
+
+    def __init__(self, template_dir, template_name, context, workers=1, work_dir=None, row_key='id'):
+        self.template_dir = template_dir
+        self.template_name = template_name
+        self.context = context
+        self.workers = max(1, workers)
+        self.row_key = row_key
+        self.work_dir = tempfile.mkdtemp(prefix='pdf-parts-', dir=work_dir)
+        self.parts = []
+        self.skipped = []
+        self._pending = deque()
+        self._pool = None
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next_part_path(self):
+        path = os.path.join(self.work_dir, f"part-{len(self.parts):05d}.pdf")
+        self.parts.append(path)
+        return path
+
+    def _collect(self, block_until=0):
+        while len(self._pending) > block_until:
+            self.skipped.extend(self._pending.popleft().result())
+
+    def wait(self):
+        """Blocks until every queued batch is rendered (after which `skipped` is complete)."""
+        self._collect()
+
+    def add(self, rows, context=None):
+        """Queues one batch; `context` is merged over the shared template context for this batch only."""
+        batch_context = dict(self.context, **(context or {}))
+        args = (self.template_dir, self.template_name, batch_context, rows, self._next_part_path(), self.row_key)
+        if self._pool is None:
+            self.skipped.extend(render_batch(*args))
+            return
+        self._collect(block_until=self.workers)
+        self._pending.append(self._pool.submit(render_batch, *args))
+
+    def add_part(self, template_name, context):
+        """Renders a standalone part (e.g. a summary page) after the batches queued so far."""
+        self.wait()
+        render_html_pdf(self.template_dir, template_name, dict(self.context, **context), self._next_part_path())
+
+    def finish(self, out_path):
+        """Waits for the remaining batches, merges every part into out_path and returns the skipped row keys."""
+        self.wait()
+        merge_parts(self.parts, out_path)
+        return self.skipped
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        shutil.rmtree(self.work_dir, ignore_errors=True)
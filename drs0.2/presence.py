@@ -0,0 +1,161 @@
+# Presence
+# Project Bin - ติดตามผู้ใช้ที่ออนไลน์ในหน่วยความจำ (heartbeat + หมดอายุอัตโนมัติ) และเขียน is_online ลงฐานข้อมูลเป็นชุด
+#
+# Every request of a logged-in user is a heartbeat: touch() records the time in memory (O(1), no
+# query). A user not seen for `ttl` seconds is swept out, so is_online no longer stays TRUE when a
+# session simply expires. tbl_users.is_online is brought up to date by flush(), which writes
+# every change since the last flush with at most two UPDATEs per chunk of users.
+#
+# The tracker lives in the process, like MemoryStore in server_session.py: with several worker
+# processes each one only knows its own users.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class PresenceTracker:
+    """
+    Who is online, per store.
+    ttl             -- seconds without a heartbeat before a user counts as offline
+    flush_interval  -- seconds between sweeps + flushes done by tick()
+    """
+
+    FLUSH_CHUNK = 500  # user ids per UPDATE ... WHERE id IN (...)
+
+    def __init__(self, ttl=300, flush_interval=30):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._seen = OrderedDict()  # user_id -> (last_seen, store_id, email); oldest heartbeat first
+        self._by_store = {}         # store_id -> {user_id: email}
+        self._dirty = {}            # user_id -> True (came online) / False (went offline), not yet flushed
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._reset_done = False    # the first flush clears flags left over from before a restart
+
+    def _drop(self, user_id):
+        _, store_id, _ = self._seen.pop(user_id)
+        members = self._by_store.get(store_id)
+        if members is not None:
+            members.pop(user_id, None)
+            if not members:
+                del self._by_store[store_id]
+
+    def touch(self, user_id, store_id=None, email=None):
+        """Heartbeat: `user_id` is active now (in `store_id`)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(user_id)
+            if entry is not None and entry[1] != store_id:
+                self._drop(user_id)  # moved to another store (e.g. a viewer's new temp store)
+                entry = None
+            if entry is None:
+                self._by_store.setdefault(store_id, {})[user_id] = email
+                self._dirty[user_id] = True
+            self._seen[user_id] = (now, store_id, email)
+            self._seen.move_to_end(user_id)
+
+    def leave(self, user_id):
+        """The user logged out."""
+        with self._lock:
+            if user_id in self._seen:
+                self._drop(user_id)
+            self._dirty[user_id] = False
+
+    def sweep(self):
+        """Marks users without a heartbeat for `ttl` seconds as offline. Returns how many."""
+        cutoff = time.monotonic() - self.ttl
+        expired = 0
+        with self._lock:
+            while self._seen:
+                user_id, (last_seen, _, _) = next(iter(self._seen.items()))
+                if last_seen > cutoff:
+                    break
+                self._drop(user_id)
+                self._dirty[user_id] = False
+                expired += 1
+        return expired
+
+    def is_online(self, user_id):
+        with self._lock:
+            return user_id in self._seen
+
+    def count(self, store_id=None):
+        """Online users in `store_id` (or everywhere if None)."""
+        with self._lock:
+            if store_id is None:
+                return len(self._seen)
+            return len(self._by_store.get(store_id, ()))
+
+    def users(self, store_id):
+        """[{'id', 'email'}] of the users online in `store_id`."""
+        with self._lock:
+            return [{'id': user_id, 'email': email} for user_id, email in self._by_store.get(store_id, {}).items()]
+
+    def flush(self, conn):
+        """
+        Writes pending online/offline changes to tbl_users.is_online and commits.
+        Changes are put back if the write fails, so the next flush retries them.
+        """
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+            reset = not self._reset_done
+            online_now = list(self._seen) if reset else None
+        if not pending and not reset:
+            return 0
+
+        came_online = [user_id for user_id, online in pending.items() if online]
+        went_offline = [user_id for user_id, online in pending.items() if not online]
+        cursor = conn.cursor()
+        try:
+            if reset:
+                cursor.execute("UPDATE tbl_users SET is_online = FALSE WHERE is_online = TRUE")
+                came_online = online_now
+                went_offline = []
+            for value, user_ids in ((True, came_online), (False, went_offline)):
+                for start in range(0, len(user_ids), self.FLUSH_CHUNK):
+                    chunk = user_ids[start:start + self.FLUSH_CHUNK]
+                    placeholders = ', '.join(['%s'] * len(chunk))
+                    cursor.execute(f"UPDATE tbl_users SET is_online = %s WHERE id IN ({placeholders})", (value, *chunk))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            with self._lock:
+                for user_id, online in pending.items():
+                    self._dirty.setdefault(user_id, online)  # newer changes win
+            raise
+        finally:
+            cursor.close()
+        if reset:
+            self._reset_done = True
+        return len(pending)
+
+    def tick(self, get_connection):
+        """
+        Sweeps and flushes if `flush_interval` has passed; cheap otherwise. Only one caller at a
+        time does the work, the others return straight away. `get_connection` returns a
+        connection whose close() releases it; the flush commits on its own connection.
+        """
+        if time.monotonic() - self._last_flush < self.flush_interval:
+            return
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_flush = time.monotonic()
+            self.sweep()
+            conn = get_connection()
+            if conn is None:
+                return
+            try:
+                self.flush(conn)
+            except Exception as err:
+                print(f"[Presence] Could not write online status: {err}")
+            finally:
+                conn.close()
+        finally:
+            self._flush_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {'online': len(self._seen), 'stores': len(self._by_store), 'pending': len(self._dirty)}
@@ -0,0 +1,310 @@
+# Product Import
+# Project Bin - นำเข้าสินค้าจากไฟล์ CSV ทีละชุด (ตรวจสอบทีละแถวระหว่างอ่าน, upsert ด้วย executemany) พร้อมรายงานข้อผิดพลาดรายแถว
+#
+# The CSV has the columns export_products_csv() writes (CSV_HEADER), so an export can be edited
+# and imported again. The file is read one row at a time and every row is checked as it is read;
+# valid rows are written `batch_size` at a time with one executemany() INSERT ... ON DUPLICATE
+# KEY UPDATE and a commit, so memory stays flat and a catalog of thousands of products costs a
+# few dozen statements instead of one INSERT + commit per product. Rows that cannot be imported
+# are listed in the report with their line number and the reason; the others are imported.
+#
+# Usage:
+#   python product_import.py import <file.csv> [store_id]   # import a file and print the report and timing
+
+import codecs
+import csv
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+import mysql.connector
+
+from db_config import DB_CONFIG
+import data_versions
+import search_index
+
+
+# (tbl_products column, CSV header written by export_products_csv())
+FIELDS = (
+    ('products_id', 'Product ID'),
+    ('products_name', 'Product Name'),
+    ('stock', 'Stock'),
+    ('price', 'Price'),
+    ('category_id', 'Category ID'),
+    ('description', 'Description'),
+    ('barcode_id', 'Barcode ID'),
+    ('store_id', 'Store ID'),
+)
+CSV_HEADER = [header for _, header in FIELDS]
+REQUIRED_FIELDS = ('products_id', 'products_name')
+
+BATCH_SIZE = 500
+MAX_ROWS = 50000
+MAX_REPORTED_ERRORS = 1000
+MAX_TEXT_LENGTH = 255
+MAX_STOCK = 2**31 - 1
+MAX_PRICE = Decimal('99999999.99')  # decimal(10,2)
+
+UPDATABLE_FIELDS = ('products_name', 'stock', 'price', 'category_id', 'description', 'barcode_id')
+
+
+@lru_cache(maxsize=64)
+def upsert_sql(present_fields):
+    """
+    INSERT ... ON DUPLICATE KEY UPDATE for the values validate_row() returns. An existing product
+    only gets the columns the file has (`present_fields`); an empty barcode keeps the current one
+    (the product forms never set it).
+    """
+    updates = [f"{field} = VALUES({field})" for field in UPDATABLE_FIELDS if field in present_fields and field != 'barcode_id']
+    updates.append("barcode_id = COALESCE(VALUES(barcode_id), barcode_id)")
+    return f"""
+        INSERT INTO tbl_products (products_id, products_name, stock, price, category_id, description, barcode_id, store_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE {', '.join(updates)}
+    """
+
+
+class ImportFileError(Exception):
+    """The file as a whole cannot be imported (e.g. missing columns). The message is shown to the user."""
+
+
+def _column_map(header):
+    """Maps tbl_products columns to their index in the CSV header (export headers or column names)."""
+    names = {}
+    for field, label in FIELDS:
+        names[label.lower()] = field
+        names[field] = field
+    columns = {}
+    for index, name in enumerate(header):
+        field = names.get(name.strip().lower())
+        if field and field not in columns:
+            columns[field] = index
+    missing = [label for field, label in FIELDS if field in REQUIRED_FIELDS and field not in columns]
+    if missing:
+        raise ImportFileError(f"ไฟล์ CSV ไม่มีคอลัมน์ {', '.join(missing)} (ใช้หัวคอลัมน์เดียวกับไฟล์ที่ส่งออก: {', '.join(CSV_HEADER)})")
+    return columns
+
+
+def _optional_int(value, name, minimum=0, maximum=MAX_STOCK):
+    if value == '':
+        return None
+    try:
+        number = Decimal(value)
+        if number != number.to_integral_value():
+            raise InvalidOperation
+        number = int(number)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"{name} ต้องเป็นจำนวนเต็ม: '{value}'")
+    if not minimum <= number <= maximum:
+        raise ValueError(f"{name} ต้องอยู่ระหว่าง {minimum} ถึง {maximum}: {number}")
+    return number
+
+
+def validate_row(values, columns, store_id=None, stores=None, categories=None):
+    """
+    Checks one CSV row and returns the tbl_products values in upsert_sql() order.
+    `store_id` forces the store (users bound to one store); otherwise the row's Store ID is used
+    and must be in `stores`. Category IDs must be in `categories` (None: not checked).
+    Raises ValueError with the message for the report.
+    """
+    def get(field):
+        index = columns.get(field)
+        return values[index].strip() if index is not None and index < len(values) else ''
+
+    products_id, products_name = get('products_id'), get('products_name')
+    if not products_id:
+        raise ValueError("ไม่มีรหัสสินค้า")
+    if not products_name:
+        raise ValueError("ไม่มีชื่อสินค้า")
+    description, barcode_id = get('description'), get('barcode_id') or None
+    for name, text in (('รหัสสินค้า', products_id), ('ชื่อสินค้า', products_name), ('บาร์โค้ด', barcode_id or '')):
+        if len(text) > MAX_TEXT_LENGTH:
+            raise ValueError(f"{name} ยาวเกิน {MAX_TEXT_LENGTH} ตัวอักษร")
+
+    stock = _optional_int(get('stock'), 'สต็อก') or 0  # empty stock/price count as 0, like the add form
+    try:
+        price = Decimal(get('price') or '0').quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"ราคาต้องเป็นตัวเลข: '{get('price')}'")
+    if not Decimal(0) <= price <= MAX_PRICE:
+        raise ValueError(f"ราคาต้องอยู่ระหว่าง 0 ถึง {MAX_PRICE}: {price}")
+
+    category_id = _optional_int(get('category_id'), 'รหัสหมวดหมู่', maximum=MAX_STOCK)
+    if category_id is not None and categories is not None and category_id not in categories:
+        raise ValueError(f"ไม่พบหมวดหมู่ {category_id} ในร้านค้าของคุณ")
+
+    if store_id is None:
+        store_id = _optional_int(get('store_id'), 'รหัสร้านค้า', minimum=1, maximum=MAX_STOCK)
+        if store_id is None:
+            raise ValueError("ไม่ได้ระบุรหัสร้านค้า (Store ID)")
+        if stores is not None and store_id not in stores:
+            raise ValueError(f"ไม่พบร้านค้า {store_id}")
+
+    return (products_id, products_name, stock, price, category_id, description, barcode_id, store_id)
+
+
+class ProductImport:
+    """One import run: feed() rows in, finish() writes the last batch and returns the report."""
+
+    def __init__(self, conn, columns, store_id=None, stores=None, categories=None, batch_size=BATCH_SIZE):
+        self.conn = conn
+        self.columns = columns
+        self.sql = upsert_sql(frozenset(columns))
+        self.store_id = store_id
+        self.stores = stores
+        self.categories = categories
+        self.batch_size = batch_size
+        self.report = {'rows': 0, 'inserted': 0, 'updated': 0, 'failed': 0, 'batches': 0, 'errors': []}
+        self._batch = []             # (line, values)
+        self._seen_products = set()  # products_id already in the file
+        self._seen_barcodes = set()  # (barcode_id, store_id) already in the file
+
+    def error(self, line, products_id, message):
+        self.report['failed'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'line': line, 'products_id': products_id, 'message': message})
+
+    def feed(self, line, values):
+        self.report['rows'] += 1
+        try:
+            row = validate_row(values, self.columns, self.store_id, self.stores, self.categories)
+        except ValueError as err:
+            index = self.columns['products_id']
+            products_id = values[index].strip() if index < len(values) else ''
+            self.error(line, products_id, str(err))
+            return
+        products_id, barcode_key = row[0], (row[6], row[7])
+        if products_id in self._seen_products:
+            self.error(line, products_id, "รหัสสินค้าซ้ำกับแถวก่อนหน้าในไฟล์")
+            return
+        if row[6] and barcode_key in self._seen_barcodes:
+            self.error(line, products_id, f"บาร์โค้ด {row[6]} ซ้ำกับแถวก่อนหน้าในไฟล์")
+            return
+        self._seen_products.add(products_id)
+        if row[6]:
+            self._seen_barcodes.add(barcode_key)
+        self._batch.append((line, row))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch, self._batch = self._batch, []
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        """Upserts one batch and commits; if the batch fails, retries its rows one by one to find the bad ones."""
+        cursor = self.conn.cursor()
+        accepted = None  # set once the rows are checked against the table
+        try:
+            products_ids = [row[0] for _, row in batch]
+            placeholders = ', '.join(['%s'] * len(products_ids))
+            cursor.execute(f"SELECT products_id, store_id FROM tbl_products WHERE products_id IN ({placeholders})", products_ids)
+            owners = dict(cursor.fetchall())
+            barcodes = [row[6] for _, row in batch if row[6]]
+            taken = {}
+            accepted = []
+            if barcodes:
+                placeholders = ', '.join(['%s'] * len(barcodes))
+                cursor.execute(f"SELECT barcode_id, store_id, products_id FROM tbl_products WHERE barcode_id IN ({placeholders})", barcodes)
+                taken = {(barcode_id, store_id): products_id for barcode_id, store_id, products_id in cursor.fetchall()}
+
+            for line, row in batch:
+                products_id, barcode_id, store_id = row[0], row[6], row[7]
+                if products_id in owners and owners[products_id] != store_id:
+                    # products_id is unique across stores: never overwrite another store's product
+                    self.error(line, products_id, "รหัสสินค้านี้เป็นของร้านค้าอื่นแล้ว")
+                elif barcode_id and taken.get((barcode_id, store_id), products_id) != products_id:
+                    self.error(line, products_id, f"บาร์โค้ด {barcode_id} ใช้กับสินค้า {taken[(barcode_id, store_id)]} อยู่แล้ว")
+                else:
+                    accepted.append((line, row))
+            if not accepted:
+                return
+
+            cursor.executemany(self.sql, [row for _, row in accepted])
+            placeholders = ', '.join(['%s'] * len(accepted))
+            cursor.execute(f"SELECT id FROM tbl_products WHERE products_id IN ({placeholders})", [row[0] for _, row in accepted])
+            search_index.reindex(cursor, 'product', [row[0] for row in cursor.fetchall()])
+            # Order reports show the product's price, dropdowns its name and stock
+            data_versions.bump(cursor, ('orders', 'products'), *sorted({row[7] for _, row in accepted}))
+            self.conn.commit()
+        except mysql.connector.Error as err:
+            self.conn.rollback()
+            pending = batch if accepted is None else accepted
+            if len(pending) > 1:
+                for item in pending:
+                    self._write([item])
+                return
+            for line, row in pending:
+                self.error(line, row[0], f"บันทึกไม่สำเร็จ: {err}")
+            return
+        finally:
+            cursor.close()
+
+        self.report['batches'] += 1
+        updated = sum(1 for _, row in accepted if row[0] in owners)
+        self.report['updated'] += updated
+        self.report['inserted'] += len(accepted) - updated
+
+    def finish(self):
+        self.flush()
+        self.report['errors'].sort(key=lambda error: error['line'])
+        return self.report
+
+
+def import_csv(conn, lines, store_id=None, stores=None, categories=None, batch_size=BATCH_SIZE, max_rows=MAX_ROWS):
+    """
+    Imports products from CSV `lines` (an iterable of UTF-8 encoded lines, e.g. an uploaded file's
+    stream or a file opened in binary mode), reading and validating one row at a time. See ProductImport and validate_row() for
+    `store_id`, `stores` and `categories`. Raises ImportFileError if the file cannot be read at all.
+    Returns the report: rows, inserted, updated, failed, batches and errors [{line, products_id, message}].
+    """
+    reader = csv.reader(codecs.iterdecode(lines, 'utf-8-sig'))
+    try:
+        header = next(reader, None)
+    except (UnicodeDecodeError, csv.Error):
+        raise ImportFileError("อ่านหัวคอลัมน์ของไฟล์ไม่ได้ (ไฟล์ต้องเป็น CSV แบบ UTF-8)")
+    if header is None:
+        raise ImportFileError("ไฟล์ CSV ว่างเปล่า")
+    job = ProductImport(conn, _column_map(header), store_id, stores, categories, batch_size)
+    try:
+        for values in reader:
+            if not any(value.strip() for value in values):
+                continue  # blank line
+            if job.report['rows'] >= max_rows:
+                job.error(reader.line_num, '', f"ไฟล์มีเกิน {max_rows} แถว แถวที่เหลือไม่ถูกนำเข้า")
+                break
+            job.feed(reader.line_num, values)
+    except UnicodeDecodeError:
+        job.error(reader.line_num + 1, '', "ไฟล์ต้องเข้ารหัสเป็น UTF-8 แถวที่เหลือไม่ถูกนำเข้า")
+    except csv.Error as err:
+        job.error(reader.line_num, '', f"รูปแบบ CSV ไม่ถูกต้อง: {err} แถวที่เหลือไม่ถูกนำเข้า")
+    return job.finish()
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] != 'import':
+        print("Usage: python product_import.py import <file.csv> [store_id]")
+        return 2
+    store_id = int(argv[3]) if len(argv) > 3 else None
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        started = time.perf_counter()
+        with open(argv[2], 'rb') as csv_file:
+            report = import_csv(conn, csv_file, store_id=store_id)
+        elapsed = time.perf_counter() - started
+    except ImportFileError as err:
+        print(err)
+        return 1
+    finally:
+        conn.close()
+    print(f"{report['rows']} rows: {report['inserted']} inserted, {report['updated']} updated, {report['failed']} failed "
+          f"({report['batches']} batches, {elapsed:.2f}s, {report['rows'] / elapsed if elapsed else 0:.0f} rows/s)")
+    for error in report['errors']:
+        print(f"  line {error['line']}: {error['products_id']} {error['message']}")
+    return 0 if not report['failed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
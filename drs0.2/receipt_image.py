@@ -0,0 +1,197 @@
+# Receipt Image
+# Project Bin - วาดใบเสร็จ (รวมบาร์โค้ด) เป็น PNG ด้วย PIL ฝั่งเซิร์ฟเวอร์ และแคชไฟล์ไว้บนดิสก์ตาม content hash
+#
+# Replaces the html2canvas + JsBarcode rendering in the browser. The image is 384 px wide (58 mm
+# thermal paper at 203 dpi). A receipt's PNG is named after the hash of its content and the
+# renderer settings, so a file never changes once written and can be cached by browsers for good.
+
+import hashlib
+import json
+import os
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+import code128
+
+
+RENDERER_VERSION = 1  # bump when the layout changes, so old cached images are not reused
+WIDTH = 384
+PADDING = 16
+BARCODE_HEIGHT = 120
+
+# A Thai-capable TrueType font is needed for product names; the first one found is used
+FONT_CANDIDATES = (
+    'static/fonts/THSarabunNew.ttf',
+    '/usr/share/fonts/truetype/tlwg/Garuda.ttf',
+    '/usr/share/fonts/truetype/tlwg/Loma.ttf',
+    '/usr/share/fonts/truetype/noto/NotoSansThai-Regular.ttf',
+    '/usr/share/fonts/opentype/noto/NotoSansThai-Regular.ttf',
+)
+
+
+def find_font(root_path, configured=None):
+    """Path of the receipt font: `configured` if given, else the first candidate that exists (or None)."""
+    if configured:
+        return configured
+    for candidate in FONT_CANDIDATES:
+        path = os.path.join(root_path, candidate)
+        if os.path.exists(path):
+            return path
+    print("[Receipt] No Thai font found (set RECEIPT_FONT); Thai text will not render correctly")
+    return None
+
+
+def _fonts(font_path):
+    # THSarabunNew is small for its point size, so it gets larger sizes than other fonts
+    scale = 1.4 if font_path and 'sarabun' in font_path.lower() else 1.0
+    sizes = {'text': int(24 * scale), 'heading': int(28 * scale), 'small': int(18 * scale)}
+    if font_path:
+        return {name: ImageFont.truetype(font_path, size) for name, size in sizes.items()}
+    return {name: ImageFont.load_default(size) for name, size in sizes.items()}
+
+
+def _wrap(draw, text, font, width):
+    """Splits text into lines that fit `width` pixels (on spaces, or anywhere for Thai runs without spaces)."""
+    lines, line = [], ''
+    for char in text:
+        if draw.textlength(line + char, font=font) <= width or not line:
+            line += char
+            continue
+        cut = line.rfind(' ')
+        if cut > 0:
+            lines.append(line[:cut])
+            line = line[cut + 1:] + char
+        else:
+            lines.append(line)
+            line = char
+    if line:
+        lines.append(line)
+    return lines
+
+
+def _money(value):
+    return f"฿{value:,.2f}"
+
+
+def render_png(receipt, font_path=None):
+    """Draws a receipt context (see receipts.load_receipt) and returns the PNG bytes."""
+    fonts = _fonts(font_path)
+    measure = ImageDraw.Draw(Image.new('L', (1, 1)))
+    line_height = {name: int(font.size * 1.25) for name, font in fonts.items()}
+    inner = WIDTH - 2 * PADDING
+
+    # Layout first (so the image is exactly as tall as its content), then draw
+    ops = []  # (kind, y, payload)
+    y = PADDING
+    if receipt['barcode_id']:
+        ops.append(('barcode', y, receipt['barcode_id']))
+        y += BARCODE_HEIGHT + 4
+        ops.append(('center', y, (receipt['barcode_id'], 'small')))
+        y += line_height['small'] + 8
+    ops.append(('left', y, (f"รหัสคำสั่งซื้อ: {receipt['current_order_id']}", 'text')))
+    y += line_height['text'] + 8
+    ops.append(('left', y, ("รายการสินค้า", 'heading')))
+    y += line_height['heading']
+    ops.append(('rule', y, 1))
+    y += 8
+
+    for item in receipt['orders']:
+        amount = _money(item['quantity'] * item['price'])
+        amount_width = measure.textlength(amount, font=fonts['text'])
+        name_lines = _wrap(measure, f"{item['quantity']} {item['products_name']}", fonts['text'], inner - amount_width - 8)
+        ops.append(('right', y, (amount, 'text')))
+        for name_line in name_lines:
+            ops.append(('left', y, (name_line, 'text')))
+            y += line_height['text']
+        if item['quantity'] > 1:
+            ops.append(('right', y, (f"@{item['price']:,.2f}", 'small')))
+            y += line_height['small']
+        y += 6
+
+    y += 8
+    ops.append(('rule', y, 2))
+    y += 10
+    ops.append(('left', y, (f"รวมทั้งหมด ({receipt['total_quantity']})", 'heading')))
+    ops.append(('right', y, (_money(receipt['total_price']), 'heading')))
+    y += line_height['heading'] + PADDING
+
+    image = Image.new('L', (WIDTH, y), 255)  # grayscale: smaller files, thermal printers are monochrome anyway
+    draw = ImageDraw.Draw(image)
+    for kind, top, payload in ops:
+        if kind == 'barcode':
+            code128.draw(draw, payload, PADDING, top, inner, BARCODE_HEIGHT)
+        elif kind == 'rule':
+            draw.rectangle([PADDING, top, WIDTH - PADDING - 1, top + payload - 1], fill=0)
+        else:
+            text, font_name = payload
+            font = fonts[font_name]
+            text_width = draw.textlength(text, font=font)
+            x = {'left': PADDING, 'right': WIDTH - PADDING - text_width, 'center': (WIDTH - text_width) / 2}[kind]
+            draw.text((x, top), text, font=font, fill=0)
+
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class ReceiptImageCache:
+    """
+    Receipt PNGs on disk, named by content hash. Keeps at most `max_files`; the least recently
+    used are removed first.
+    """
+
+    def __init__(self, cache_dir, font_path=None, max_files=2000):
+        self.cache_dir = cache_dir
+        self.font_path = font_path
+        self.max_files = max_files
+        self._writes = 0
+
+    def digest(self, receipt):
+        """Content hash of the image a receipt renders to (receipt content + renderer settings)."""
+        parts = {'receipt': receipt, 'renderer': RENDERER_VERSION,
+                 'font': os.path.basename(self.font_path) if self.font_path else None}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.png")
+
+    def cached(self, digest):
+        """Path of the cached image, or None if it has not been rendered (or was cleaned up)."""
+        path = self.path(digest)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)  # mark as recently used
+        return path
+
+    def render(self, receipt):
+        """Renders the receipt unless its image is already on disk. Returns (digest, path)."""
+        digest = self.digest(receipt)
+        path = self.cached(digest)
+        if path:
+            return digest, path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(digest)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as png_file:
+                png_file.write(render_png(receipt, self.font_path))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+        return digest, path
+
+    def _prune(self):
+        try:
+            files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.png')]
+            if len(files) <= self.max_files:
+                return
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - self.max_files]:
+                os.remove(path)
+        except OSError as err:
+            print(f"[Receipt] Image cache cleanup failed: {err}")
@@ -0,0 +1,132 @@
+# Receipts
+# Project Bin - ใบเสร็จที่เปิดซ้ำได้ตามรหัสคำสั่งซื้อ (query เดียวผ่าน index) พร้อมแคช HTML ที่ render แล้ว
+#
+# A receipt is rebuilt from tbl_order whenever it is asked for, so it can be reprinted or looked up
+# by the customer later. Rendered HTML is kept in an in-process LRU together with the store's data
+# version: while the version has not moved, a reprint costs one version lookup and no rendering.
+# When it has moved (any change in the store), the rows are read again and re-rendered only if
+# this receipt's own content changed.
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import data_versions
+
+
+RECEIPT_SQL = """
+    SELECT o.id, o.order_id, o.products_id, o.products_name, o.quantity, o.disquantity, o.email,
+           o.barcode_id, o.order_date, p.price
+    FROM tbl_order o
+    LEFT JOIN tbl_products p ON p.products_id = o.products_id
+    WHERE o.order_id = %s AND o.store_id = %s
+"""
+
+
+def versions(conn, store_id):
+    """The version a receipt of `store_id` depends on: its orders and (for prices) its products."""
+    found = data_versions.current_many(conn, [('orders', store_id), ('products', store_id)])
+    return found[('orders', store_id)], found[('products', store_id)]
+
+
+def load_receipt(cursor, store_id, order_id, email=None):
+    """
+    Reads one order's lines (only `email`'s lines, if given) with the idx_order_order_store index.
+    Returns the template context for receipt_png_template.html, or None if the order has no lines.
+    Needs a dictionary cursor.
+    """
+    query, params = RECEIPT_SQL, [order_id, store_id]
+    if email:
+        query += " AND o.email = %s"
+        params.append(email)
+    cursor.execute(query + " ORDER BY o.id", tuple(params))
+    orders = cursor.fetchall()
+    if not orders:
+        return None
+    for item in orders:
+        item['price'] = float(item['price'] or 0.0)
+    return {
+        'orders': orders,
+        'barcode_id': orders[0]['barcode_id'] or '',
+        'total_quantity': sum(item['quantity'] for item in orders),
+        'total_price': sum(item['quantity'] * item['price'] for item in orders),
+        'current_order_id': order_id,
+    }
+
+
+def fingerprint(receipt):
+    """Content hash of a receipt context; used as its ETag."""
+    return hashlib.sha256(json.dumps(receipt, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
+
+class ReceiptCache:
+    """
+    LRU of rendered receipts: (store_id, order_id, email) -> (version, etag, html).
+    Holds at most `max_entries` receipts.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        """Returns (etag, html) if the receipt was cached at `version`, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def get_any(self, key):
+        """Returns (etag, html) of the cached receipt whatever its version, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return (entry[1], entry[2]) if entry else None
+
+    def put(self, key, version, etag, html):
+        with self._lock:
+            self._entries[key] = (version, etag, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+cache = ReceiptCache()
+
+
+def rendered_receipt(conn, store_id, order_id, render, email=None):
+    """
+    Returns (etag, html) for a receipt, or None if the order does not exist.
+    `render(receipt)` turns the receipt context into HTML; it is only called when the
+    receipt's content changed since it was last rendered.
+    """
+    key = (int(store_id), str(order_id), email)
+    version = versions(conn, store_id)
+    cached = cache.get(key, version)
+    if cached is not None:
+        return cached
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        receipt = load_receipt(cursor, store_id, order_id, email)
+    finally:
+        cursor.close()
+    if receipt is None:
+        return None
+
+    etag = fingerprint(receipt)
+    previous = cache.get_any(key)
+    html = previous[1] if previous and previous[0] == etag else render(receipt)
+    cache.put(key, version, etag, html)
+    return etag, html
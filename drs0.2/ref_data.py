@@ -0,0 +1,133 @@
+# Reference Data Cache
+# Project Bin - แคชข้อมูลสำหรับ dropdown (ร้านค้า หมวดหมู่ สินค้า ผู้ใช้) แยกตามร้าน ตรวจเวอร์ชันด้วย query เดียวต่อหน้า
+#
+# Every list is cached in memory under (kind, store_id, variant) together with the data version
+# it was loaded at (see data_versions.py). A page asks for all of its lists at once: one query
+# reads their current versions and only lists whose version moved are loaded again.
+# Write paths bump the matching area ('stores', 'categories', 'products', 'users') before commit.
+
+import threading
+from collections import OrderedDict
+
+import data_versions
+
+
+def _load_stores(cursor, store_id, variant):
+    if store_id is None:
+        cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name")
+    else:
+        cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (store_id,))
+    return cursor.fetchall()
+
+
+def _load_categories(cursor, store_id, variant):
+    query = "SELECT category_id, category_name FROM tbl_category"
+    params = ()
+    if store_id is not None:
+        query += " WHERE store_id = %s"
+        params = (store_id,)
+    cursor.execute(query + " ORDER BY category_name", params)
+    return cursor.fetchall()
+
+
+PRODUCT_ORDER = {'name': 'products_name', 'id': 'products_id'}
+
+
+def _load_products(cursor, store_id, variant):
+    query = "SELECT products_id, products_name, stock, price, barcode_id, store_id FROM tbl_products"
+    params = ()
+    if store_id is not None:
+        query += " WHERE store_id = %s"
+        params = (store_id,)
+    cursor.execute(query + f" ORDER BY {PRODUCT_ORDER[variant or 'name']}", params)
+    return cursor.fetchall()
+
+
+def _load_users(cursor, store_id, variant):
+    # variant 'members': only members and viewers (what moderators and viewers may pick)
+    conditions, params = [], []
+    if store_id is not None:
+        conditions.append("store_id = %s")
+        params.append(store_id)
+    if variant == 'members':
+        conditions.append("(role = 'member' OR role = 'viewer')")
+    query = "SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    cursor.execute(query + " ORDER BY firstname", tuple(params))
+    return cursor.fetchall()
+
+
+LOADERS = {
+    'stores': _load_stores,
+    'categories': _load_categories,
+    'products': _load_products,
+    'users': _load_users,
+}
+
+
+class ReferenceCache:
+    """
+    Versioned in-memory cache of dropdown lists, shared by all requests of the process.
+    Holds at most `max_entries` lists; the least recently used are dropped first
+    (viewer stores come and go, so the set of store ids is unbounded).
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (kind, store_id, variant) -> (version, rows)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conn, *keys, versions=None):
+        """
+        Returns the lists for `keys`, each (kind, store_id) or (kind, store_id, variant), in order.
+        store_id None means every store. The rows are shared between requests: treat them as read-only.
+        `versions` may pass {(kind, store_id): version} already read by the caller (e.g. for an ETag).
+        """
+        keys = [(key[0], None if key[1] is None else int(key[1]), key[2] if len(key) > 2 else None) for key in keys]
+        if versions is None:
+            versions = data_versions.current_many(conn, {(kind, store_id) for kind, store_id, _ in keys})
+
+        results, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry and entry[0] == versions[key[:2]]:
+                    self._entries.move_to_end(key)
+                    results[key] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(key)
+                    self.misses += 1
+
+        if missing:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                for kind, store_id, variant in missing:
+                    results[(kind, store_id, variant)] = LOADERS[kind](cursor, store_id, variant)
+            finally:
+                cursor.close()
+            with self._lock:
+                for key in missing:
+                    # Keyed by the version read *before* loading: a write racing the load only
+                    # makes the next request reload, it can never pin stale rows under a new version
+                    self._entries[key] = (versions[key[:2]], results[key])
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return [list(results[key]) for key in keys]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+cache = ReferenceCache()
+
+
+def get(conn, *keys, versions=None):
+    """Shortcut for cache.get() on the process-wide cache."""
+    return cache.get(conn, *keys, versions=versions)
@@ -0,0 +1,236 @@
+# Report Jobs
+# Project Bin - คิวงานเบื้องหลังสำหรับสร้างรายงาน PDF (ทำใน process pool ไม่ผูก worker ของเว็บ และแคชไฟล์ตามเวอร์ชันข้อมูล)
+#
+# submit() hashes (report kind, store, filters, data version) into a cache key. A finished PDF
+# for that key is served straight from disk; an identical job already running is shared; otherwise
+# the build function runs in a separate process and writes the PDF into the cache directory.
+
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+from pdf_batches import BatchRenderer
+
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class ReportJobQueue:
+    """
+    In-process registry of report jobs backed by a process pool and an on-disk artifact cache.
+
+    cache_dir         -- where finished PDFs are kept (file name = cache key)
+    max_workers       -- report processes rendering at the same time
+    max_jobs          -- finished jobs remembered for status polling
+    max_cached_files  -- artifacts kept on disk; the least recently used are removed first
+    """
+
+    def __init__(self, cache_dir, max_workers=2, max_jobs=500, max_cached_files=200):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.max_cached_files = max_cached_files
+        self._jobs = {}  # job_id -> job dict (insertion ordered)
+        self._inflight = {}  # cache key -> job dict
+        self._lock = threading.RLock()  # done-callbacks may run inline while submit() holds it
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # spawn: the web process has pool/background threads that must not be forked mid-lock
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    @staticmethod
+    def cache_key(parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _artifact_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def submit(self, parts, func, *args, owner=None, filename='report.pdf'):
+        """
+        Queues func(*args, out_path) unless the artifact for `parts` is cached or already being built.
+        `func` must be a module-level function (it is pickled to the worker process).
+        Returns the job dict.
+        """
+        key = self.cache_key(parts)
+        path = self._artifact_path(key)
+        with self._lock:
+            job = {
+                'id': uuid.uuid4().hex, 'key': key, 'path': path, 'owner': owner, 'filename': filename,
+                'status': JOB_QUEUED, 'cached': False, 'error': None,
+                'created_at': time.time(), 'finished_at': None, 'future': None,
+            }
+            running = self._inflight.get(key)
+            if running is not None:
+                # Someone asked for the same report moment ago: share their build
+                job['future'] = running['future']
+                job['future'].add_done_callback(lambda future, job=job: self._finish(job, future))
+            elif os.path.exists(path):
+                os.utime(path)  # mark as recently used
+                job.update(status=JOB_DONE, cached=True, finished_at=time.time())
+            else:
+                try:
+                    job['future'] = self._executor().submit(func, *args, path)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed for memory); start a fresh pool instead of failing forever
+                    print("[Report] Process pool was broken, restarting it")
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = None
+                    job['future'] = self._executor().submit(func, *args, path)
+                self._inflight[key] = job
+                job['future'].add_done_callback(lambda future, job=job: self._finish(job, future))
+            self._jobs[job['id']] = job
+            self._prune_jobs()
+        return job
+
+    def _finish(self, job, future):
+        error = future.exception()
+        with self._lock:
+            job['finished_at'] = time.time()
+            if error is None:
+                job['status'] = JOB_DONE
+            else:
+                job['status'] = JOB_FAILED
+                job['error'] = str(error) or error.__class__.__name__
+                print(f"[Report] Job {job['id']} failed: {job['error']}")
+            if self._inflight.get(job['key']) is job:
+                del self._inflight[job['key']]
+        if error is None:
+            self._prune_cache()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job['status'] == JOB_QUEUED and job['future'] is not None and job['future'].running():
+                job['status'] = JOB_RUNNING
+            return job
+
+    def artifact(self, job):
+        """Returns the path of a finished job's PDF, or None if it is not (or no longer) available."""
+        if job['status'] != JOB_DONE or not os.path.exists(job['path']):
+            return None
+        return job['path']
+
+    @staticmethod
+    def public(job):
+        """The job fields that are safe to return to the browser."""
+        return {
+            'id': job['id'], 'status': job['status'], 'cached': job['cached'], 'error': job['error'],
+            'created_at': job['created_at'], 'finished_at': job['finished_at'],
+        }
+
+    def _prune_jobs(self):
+        while len(self._jobs) > self.max_jobs:
+            oldest_id = next(iter(self._jobs))
+            if self._jobs[oldest_id]['finished_at'] is None:
+                break  # keep unfinished jobs pollable
+            del self._jobs[oldest_id]
+
+    def _prune_cache(self):
+        try:
+            files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.pdf')]
+            if len(files) <= self.max_cached_files:
+                return
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - self.max_cached_files]:
+                os.remove(path)
+        except OSError as err:
+            print(f"[Report] Cache cleanup failed: {err}")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# --- Order report ---
+
+def order_filter_sql(filters, alias='o'):
+    """
+    Builds the WHERE conditions for an order report from a filters dict:
+    date_from / date_to ('YYYY-MM-DD', inclusive), store_id, email. Returns (conditions, params).
+    """
+    conditions, params = [], []
+    if filters.get('date_from'):
+        conditions.append(f"{alias}.order_date >= %s")
+        params.append(datetime.strptime(filters['date_from'], '%Y-%m-%d'))
+    if filters.get('date_to'):
+        conditions.append(f"{alias}.order_date < %s")
+        params.append(datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1))
+    if filters.get('store_id'):
+        conditions.append(f"{alias}.store_id = %s")
+        params.append(filters['store_id'])
+    if filters.get('email'):
+        conditions.append(f"{alias}.email = %s")
+        params.append(filters['email'])
+    return conditions, params
+
+
+ORDER_REPORT_SQL = """
+    SELECT o.id, o.order_id, o.products_id, o.products_name, o.quantity, o.disquantity,
+           o.email, o.order_date, o.barcode_id, p.category_id, p.price, s.store_name
+    FROM tbl_order o
+    LEFT JOIN tbl_products p ON o.products_id = p.products_id
+    LEFT JOIN tbl_stores s ON o.store_id = s.store_id
+"""
+
+
+def build_orders_pdf(db_config, template_dir, filters, batch_rows, render_workers, out_path):
+    """
+    Worker: streams the orders for `filters` in batches of `batch_rows` and renders them with
+    pdf_template.html on `render_workers` processes, then merges the parts into out_path.
+    """
+    conditions, params = order_filter_sql(filters)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    conn = mysql.connector.connect(**db_config)
+    try:
+        # One read-only snapshot, so the totals on the first page match the rows that follow
+        conn.start_transaction(readonly=True)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(o.quantity), 0) FROM tbl_order o{where}", tuple(params))
+        total_orders, total_quantity = cursor.fetchone()
+        cursor.close()
+
+        context = {
+            'current_date': datetime.now().strftime('%d/%m/%Y %H:%M'),
+            'total_orders': total_orders,
+            'total_quantity': int(total_quantity),
+        }
+        with BatchRenderer(template_dir, 'pdf_template.html', context, workers=render_workers,
+                           work_dir=os.path.dirname(out_path), row_key='order_id') as renderer:
+            cursor = conn.cursor(dictionary=True, buffered=False)
+            cursor.execute(f"{ORDER_REPORT_SQL}{where} ORDER BY o.order_date DESC", tuple(params))
+            first_batch = True
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows and not first_batch:
+                    break
+                for row in rows:
+                    row['price'] = float(row['price'] or 0.0)
+                renderer.add(rows, {'first_batch': first_batch})
+                first_batch = False
+            cursor.close()
+            conn.rollback()  # ends the read-only snapshot
+
+            renderer.wait()
+            if renderer.skipped:
+                print(f"[Report] Orders left out of the PDF: {renderer.skipped}")
+            renderer.add_part('pdf_template.html', {'summary': True, 'skipped_orders': renderer.skipped})
+            renderer.finish(out_path)
+    finally:
+        conn.close()
@@ -0,0 +1,431 @@
+# Viewer Sandbox
+# Project Bin - ฐานข้อมูลจำลองในหน่วยความจำ (SQLite) สำหรับผู้ใช้ viewer แยกจากฐานข้อมูลจริง ทิ้งเมื่อออกจากระบบ
+#
+# A viewer used to get a real temporary store: login searched tbl_stores for a free random id and
+# inserted a row, every demo order and product went into the shared tables, and logout cleaned
+# up with four UPDATEs and a DELETE. Now each viewer gets a private in-memory SQLite database with
+# the same tables, holding only their own store. get_db() hands it out in place of a pooled MySQL
+# connection, so the routes run unchanged and the production database sees none of the traffic.
+#
+# SandboxConnection/SandboxCursor mimic the mysql.connector API the routes use, and translate the
+# MySQL dialect found in this code base (ON DUPLICATE KEY UPDATE, LAST_INSERT_ID(), CONCAT(),
+# GREATEST(), INSERT IGNORE, ... FOR UPDATE) to SQLite. SQLite errors are raised as
+# mysql.connector errors, so the routes' error handling keeps working.
+#
+# Sandboxes live in the process, like MemoryStore in server_session.py: with several worker
+# processes a viewer needs sticky sessions, or gets a fresh, empty sandbox on another worker.
+
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+
+import mysql.connector
+
+from barcode_codec import SANDBOX_BARCODE_SEED_START
+from data_versions import ALL_STORES
+from sequences import BARCODE_SEQUENCE
+
+
+# Sandbox store ids start far above real (auto-increment) and legacy temporary (6-digit) store
+# ids, offset per process so two workers do not hand out the same ids.
+SANDBOX_STORE_ID_START = 900_000_000 + (os.getpid() % 10_000) * 10_000
+DATA_VERSION_AREAS = ('orders', 'stores', 'categories', 'products', 'users')
+
+SCHEMA = """
+CREATE TABLE tbl_stores (
+  store_id INTEGER PRIMARY KEY,
+  store_name TEXT NOT NULL,
+  address TEXT, phone TEXT, location TEXT, contact_email TEXT,
+  moderator_user_id INTEGER
+);
+CREATE TABLE tbl_users (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  firstname TEXT NOT NULL, lastname TEXT NOT NULL,
+  email TEXT NOT NULL UNIQUE, password TEXT NOT NULL,
+  role TEXT NOT NULL DEFAULT 'member',
+  store_id INTEGER,
+  is_online INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE tbl_category (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  category_id INTEGER NOT NULL UNIQUE,
+  category_name TEXT NOT NULL,
+  store_id INTEGER
+);
+CREATE TABLE tbl_products (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  products_id TEXT NOT NULL UNIQUE,
+  products_name TEXT NOT NULL,
+  price NUMERIC NOT NULL,
+  stock INTEGER NOT NULL,
+  category_id INTEGER,
+  barcode_id TEXT,
+  store_id INTEGER,
+  description TEXT,
+  UNIQUE (barcode_id, store_id)
+);
+CREATE TABLE tbl_order (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  order_id TEXT NOT NULL,
+  products_id TEXT,
+  products_name TEXT NOT NULL,
+  quantity INTEGER NOT NULL,
+  disquantity INTEGER NOT NULL DEFAULT 0,
+  email TEXT,
+  order_date TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+  barcode_id TEXT,
+  store_id INTEGER,
+  price NUMERIC,
+  UNIQUE (order_id, products_id, email, store_id)
+);
+CREATE INDEX idx_order_barcode ON tbl_order (barcode_id, products_id);
+CREATE INDEX idx_order_order_store ON tbl_order (order_id, store_id);
+CREATE TABLE tbl_bin (
+  id INTEGER PRIMARY KEY,
+  category_id INTEGER UNIQUE,
+  value INTEGER DEFAULT 0
+);
+CREATE TABLE tbl_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE tbl_data_version (scope TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE tbl_sequence (name TEXT PRIMARY KEY, last_value INTEGER NOT NULL);
+CREATE TABLE tbl_order_sequence (store_id INTEGER PRIMARY KEY, last_value INTEGER NOT NULL);
+CREATE TABLE tbl_search_index (
+  doc_type TEXT NOT NULL, gram TEXT NOT NULL, doc_id INTEGER NOT NULL, field TEXT NOT NULL,
+  weight INTEGER NOT NULL DEFAULT 1,
+  PRIMARY KEY (doc_type, gram, doc_id, field)
+);
+CREATE INDEX idx_search_doc ON tbl_search_index (doc_type, doc_id);
+"""
+
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' ', 'seconds'))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+
+# --- MySQL -> SQLite ---
+
+def _strip_nested(sql):
+    """`sql` with everything inside parentheses blanked out, to look at the top level only."""
+    depth, out = 0, []
+    for char in sql:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        out.append(char if depth == 0 or char in '()' else ' ')
+    return ''.join(out)
+
+
+def _split_args(args):
+    """Splits a function's argument list on top-level commas (not inside parentheses or quotes)."""
+    parts, depth, quote, start = [], 0, None, 0
+    for index, char in enumerate(args):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(args[start:index].strip())
+            start = index + 1
+    parts.append(args[start:].strip())
+    return parts
+
+
+def _rewrite_concat(sql):
+    while True:
+        match = re.search(r'\bCONCAT\s*\(', sql, re.IGNORECASE)
+        if not match:
+            return sql
+        depth, end = 1, match.end()
+        while depth:
+            depth += {'(': 1, ')': -1}.get(sql[end], 0)
+            end += 1
+        args = _split_args(sql[match.end():end - 1])
+        sql = f"{sql[:match.start()]}({' || '.join(args)}){sql[end:]}"
+
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """Rewrites one MySQL statement of this code base into SQLite."""
+    sql = sql.replace('%s', '?')
+    sql = re.sub(r'\bINSERT\s+IGNORE\b', 'INSERT OR IGNORE', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\s+FOR\s+UPDATE\b', '', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bGREATEST\s*\(', 'MAX(', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bLEAST\s*\(', 'MIN(', sql, flags=re.IGNORECASE)
+    sql = _rewrite_concat(sql)
+
+    upsert = re.search(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', sql, re.IGNORECASE)
+    if upsert:
+        head, tail = sql[:upsert.start()].rstrip(), sql[upsert.end():]
+        tail = re.sub(r'\bVALUES\s*\(\s*`?(\w+)`?\s*\)', r'excluded.\1', tail, flags=re.IGNORECASE)
+        top = _strip_nested(head).upper()
+        select_at = top.find('SELECT')
+        if select_at != -1 and 'WHERE' not in top[select_at:]:
+            head += ' WHERE true'  # INSERT ... SELECT needs a WHERE before ON CONFLICT in SQLite
+        sql = f"{head} ON CONFLICT DO UPDATE SET{tail}"
+    return sql
+
+
+def _mysql_error(err):
+    if isinstance(err, sqlite3.IntegrityError):
+        return mysql.connector.errors.IntegrityError(msg=str(err), errno=1062 if 'UNIQUE' in str(err) else None)
+    return mysql.connector.errors.DatabaseError(msg=str(err))
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class Sandbox:
+    """One viewer's in-memory database. Used by one request at a time (`lock`)."""
+
+    def __init__(self, store_id, store_name, user):
+        self.store_id = store_id
+        self.store_name = store_name
+        self.owner_id = user['id']
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.last_insert_id = 0
+        self.explicit_insert_id = None
+
+        self.db = sqlite3.connect(':memory:', check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.db.create_function('LAST_INSERT_ID', -1, self._last_insert_id)
+        self.db.create_function('NOW', 0, lambda: datetime.now().isoformat(' ', 'seconds'))
+        self.db.create_function('REGEXP', 2, lambda pattern, value: value is not None and re.search(pattern, str(value)) is not None)
+        self.db.executescript(SCHEMA)
+        self.db.execute("INSERT INTO tbl_stores (store_id, store_name, address, phone) VALUES (?, ?, ?, ?)",
+                        (store_id, store_name, "ที่อยู่จำลอง", "000-000-0000"))
+        # The viewer's own account, placed in the store so demo orders can be made out to them
+        self.db.execute("""
+            INSERT INTO tbl_users (id, firstname, lastname, email, password, role, store_id, is_online)
+            VALUES (?, ?, ?, ?, '', ?, ?, 1)
+        """, (user['id'], user.get('firstname') or '', user.get('lastname') or '', user['email'],
+              user.get('role') or 'viewer', store_id))
+        # Demo orders get barcodes from the sandbox range (see barcode_codec.py)
+        self.db.execute("INSERT INTO tbl_sequence (name, last_value) VALUES (?, ?)",
+                        (BARCODE_SEQUENCE, SANDBOX_BARCODE_SEED_START - 1))
+        # Data versions start at the creation time, so the process-wide caches (ref_data, receipts)
+        # never serve a recreated sandbox what its predecessor with the same store id had cached
+        generation = time.time_ns() // 1000
+        self.db.executemany("INSERT INTO tbl_data_version (scope, version) VALUES (?, ?)",
+                            [(f"{area}:{ALL_STORES}", generation) for area in DATA_VERSION_AREAS])
+        self.db.commit()
+
+    def _last_insert_id(self, *args):
+        # MySQL semantics: LAST_INSERT_ID(expr) sets the value reported afterwards and returns expr
+        if args:
+            self.last_insert_id = self.explicit_insert_id = args[0]
+            return args[0]
+        return self.last_insert_id
+
+
+class SandboxCursor:
+    """The subset of the mysql.connector cursor API the routes use, on a sandbox."""
+
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._sandbox = connection._sandbox
+        self._cursor = self._sandbox.db.cursor()
+        if dictionary:
+            self._cursor.row_factory = _dict_row
+        self.lastrowid = None
+
+    def _run(self, method, sql, params):
+        self._connection._check()
+        self._connection.query_count += 1
+        statement = translate(sql)
+        self._sandbox.explicit_insert_id = None
+        try:
+            method(statement, params)
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+        if self._sandbox.explicit_insert_id is not None:
+            self.lastrowid = self._sandbox.explicit_insert_id
+        elif statement.lstrip()[:6].upper() == 'INSERT':
+            self.lastrowid = self._sandbox.last_insert_id = self._cursor.lastrowid
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(self._cursor.execute, sql, tuple(params or ()))
+
+    def executemany(self, sql, seq_params):
+        return self._run(self._cursor.executemany, sql, [tuple(params) for params in seq_params])
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self._cursor.description or ())
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SandboxConnection:
+    """
+    A sandbox borrowed for one request; stands in for a PooledConnection. close() rolls back
+    anything uncommitted and lets the viewer's next request in (safe to call more than once).
+    """
+
+    def __init__(self, sandbox):
+        self._sandbox = sandbox
+        self._released = False
+        self.query_count = 0
+
+    def _check(self):
+        if self._released:
+            raise mysql.connector.errors.OperationalError("Sandbox connection already closed")
+
+    def cursor(self, dictionary=False, buffered=None, **kwargs):
+        self._check()
+        return SandboxCursor(self, dictionary=dictionary)
+
+    def commit(self):
+        self._check()
+        self._sandbox.db.commit()
+
+    def rollback(self):
+        self._check()
+        self._sandbox.db.rollback()
+
+    @property
+    def in_transaction(self):
+        return self._sandbox.db.in_transaction
+
+    def is_connected(self):
+        return not self._released
+
+    def ping(self, reconnect=False):
+        self._check()
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            if self._sandbox.db.in_transaction:
+                self._sandbox.db.rollback()
+        finally:
+            self._sandbox.last_used = time.monotonic()
+            self._sandbox.lock.release()
+
+    def __del__(self):
+        # Safety net for code paths that forget to close: don't lock the viewer out
+        if not getattr(self, '_released', True):
+            self.close()
+
+
+class SandboxRegistry:
+    """
+    The sandboxes of this process, by store id.
+    max_sandboxes  -- the least recently used sandbox is dropped beyond this many
+    idle_ttl       -- seconds after which an unused sandbox is dropped
+    lock_timeout   -- seconds a request waits for the viewer's previous request to finish
+    """
+
+    def __init__(self, max_sandboxes=200, idle_ttl=12 * 3600, lock_timeout=10.0):
+        self.max_sandboxes = max_sandboxes
+        self.idle_ttl = idle_ttl
+        self.lock_timeout = lock_timeout
+        self._sandboxes = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(SANDBOX_STORE_ID_START)
+        self.created = 0
+
+    def _add(self, store_id, user):
+        sandbox = Sandbox(store_id, f"ร้านค้าสาธิต Viewer {store_id}", user)
+        with self._lock:
+            self._sandboxes[store_id] = sandbox
+            self._sandboxes.move_to_end(store_id)
+            self.created += 1
+            while len(self._sandboxes) > self.max_sandboxes:
+                self._sandboxes.popitem(last=False)
+        return sandbox
+
+    def create(self, user):
+        """
+        New sandbox for `user` (a tbl_users row: id, firstname, lastname, email, role).
+        Returns (store_id, store_name).
+        """
+        self.sweep()
+        with self._lock:
+            store_id = next(self._ids)
+            while store_id in self._sandboxes:
+                store_id = next(self._ids)
+        sandbox = self._add(store_id, user)
+        return sandbox.store_id, sandbox.store_name
+
+    def connect(self, store_id, user):
+        """
+        Borrows the sandbox of `store_id` for one request; returns a SandboxConnection, or None if
+        the previous request still holds it after `lock_timeout`. A sandbox that was dropped
+        (idle, evicted or another worker) is recreated empty for the same store id.
+        """
+        with self._lock:
+            sandbox = self._sandboxes.get(store_id)
+            if sandbox is not None:
+                self._sandboxes.move_to_end(store_id)
+        if sandbox is not None and sandbox.owner_id != user['id']:
+            print(f"[Sandbox] Store {store_id} belongs to another viewer")
+            return None
+        if sandbox is None:
+            print(f"[Sandbox] Recreating sandbox {store_id} for viewer {user['id']}")
+            sandbox = self._add(store_id, user)
+        if not sandbox.lock.acquire(timeout=self.lock_timeout):
+            print(f"[Sandbox] Sandbox {store_id} still busy after {self.lock_timeout}s")
+            return None
+        return SandboxConnection(sandbox)
+
+    def discard(self, store_id):
+        """Drops a sandbox (logout). A request still using it finishes on its own copy."""
+        with self._lock:
+            self._sandboxes.pop(store_id, None)
+
+    def sweep(self):
+        """Drops sandboxes unused for `idle_ttl` seconds. Returns how many."""
+        cutoff = time.monotonic() - self.idle_ttl
+        with self._lock:
+            idle = [store_id for store_id, sandbox in self._sandboxes.items() if sandbox.last_used <= cutoff]
+            for store_id in idle:
+                del self._sandboxes[store_id]
+        return len(idle)
+
+    def stats(self):
+        with self._lock:
+            return {'sandboxes': len(self._sandboxes), 'created': self.created}
@@ -0,0 +1,305 @@
+# Search Index
+# Project Bin - ดัชนีค้นหาแบบ inverted index (n-gram ที่รองรับภาษาไทย) สำหรับคำสั่งซื้อ สินค้า และผู้ใช้งาน
+#
+# Usage:
+#   python search_index.py rebuild [order|product|user]   # rebuild the index from the base tables
+#   python search_index.py bench [term ...]               # compare indexed search against LIKE '%term%'
+#
+# Text is normalized (NFC, lower case) and split into tokens. Thai has no spaces between words,
+# so each token is cut into character clusters (a consonant together with its vowel/tone marks,
+# and a leading vowel such as เ แ โ ใ ไ together with the consonant after it) and indexed as
+# overlapping cluster bigrams. Documents containing every bigram of the query are the candidates;
+# a LIKE '%query%' on the searched columns then keeps only those that contain the query itself
+# (the bigrams of 100010 are also all in 100100 or 101000). Product and user searches are ranked
+# with search(); the order listing uses match_condition() as a filter and keeps its keyset order.
+
+import sys
+import time
+import unicodedata
+
+import mysql.connector
+
+from db_config import DB_CONFIG
+
+
+INDEX_TABLE = 'tbl_search_index'
+GRAM_SIZE = 2  # clusters per gram
+BATCH_SIZE = 1000
+
+# doc_type -> source query (id first, then the indexed columns), per-field ranking weights and
+# the columns (with the joins they need) the query text is checked against
+DOC_TYPES = {
+    'order': {
+        'table': 'tbl_order', 'alias': 'o', 'joins': "",
+        'source': "SELECT o.id, o.order_id, o.products_name, o.email FROM tbl_order o",
+        'fields': (('order_id', 3), ('products_name', 2), ('email', 2)),
+        'columns': ('o.order_id', 'o.products_name', 'o.email'),
+    },
+    'product': {
+        'table': 'tbl_products', 'alias': 'p', 'joins': "LEFT JOIN tbl_category c ON p.category_id = c.category_id",
+        'source': """SELECT p.id, p.products_id, p.products_name, c.category_name
+                     FROM tbl_products p LEFT JOIN tbl_category c ON p.category_id = c.category_id""",
+        'fields': (('products_id', 3), ('products_name', 2), ('category_name', 1)),
+        'columns': ('p.products_id', 'p.products_name', 'c.category_name'),
+    },
+    'user': {
+        'table': 'tbl_users', 'alias': 'u', 'joins': "",
+        'source': "SELECT u.id, u.firstname, u.lastname, u.email, u.role FROM tbl_users u",
+        'fields': (('email', 3), ('firstname', 2), ('lastname', 2), ('role', 1)),
+        'columns': ('u.firstname', 'u.lastname', 'u.email', 'u.role'),
+    },
+}
+
+_THAI_LEADING_VOWELS = set('เแโใไ')
+
+
+def _is_word_char(char):
+    return char.isalnum() or unicodedata.category(char) in ('Mn', 'Mc') or '\u0e00' <= char <= '\u0e7f'
+
+
+def _clusters(token):
+    """Splits a token into clusters: base character + combining marks, leading vowel + consonant."""
+    clusters = []
+    pending_leading = ''
+    for char in token:
+        if unicodedata.category(char) in ('Mn', 'Mc') and clusters and not pending_leading:
+            clusters[-1] += char
+        elif char in _THAI_LEADING_VOWELS:
+            if pending_leading:
+                clusters.append(pending_leading)
+            pending_leading = char
+        else:
+            clusters.append(pending_leading + char)
+            pending_leading = ''
+    if pending_leading:
+        clusters.append(pending_leading)
+    return clusters
+
+
+def tokenize(text):
+    """Returns the list of tokens in `text`, each as a list of clusters."""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFC', str(text)).lower()
+    tokens, current = [], []
+    for char in text:
+        if _is_word_char(char):
+            current.append(char)
+        elif current:
+            tokens.append(_clusters(''.join(current)))
+            current = []
+    if current:
+        tokens.append(_clusters(''.join(current)))
+    return tokens
+
+
+def grams(text):
+    """Returns the set of cluster n-grams for `text` (tokens shorter than GRAM_SIZE contribute none)."""
+    result = set()
+    for clusters in tokenize(text):
+        for i in range(len(clusters) - GRAM_SIZE + 1):
+            result.add(''.join(clusters[i:i + GRAM_SIZE]))
+    return result
+
+
+def _row_values(row, columns):
+    if isinstance(row, dict):
+        return [row[column] for column in columns]
+    return list(row)
+
+
+def _postings(doc_type, rows):
+    spec = DOC_TYPES[doc_type]
+    columns = ['id'] + [field for field, _ in spec['fields']]
+    postings = {}
+    for row in rows:
+        values = _row_values(row, columns)
+        doc_id = values[0]
+        for (field, weight), value in zip(spec['fields'], values[1:]):
+            for gram in grams(value):
+                postings[(gram, doc_id, field)] = weight
+    return [(doc_type, gram, doc_id, field, weight) for (gram, doc_id, field), weight in postings.items()]
+
+
+def _insert_postings(cursor, postings):
+    for start in range(0, len(postings), BATCH_SIZE):
+        cursor.executemany(
+            f"INSERT IGNORE INTO {INDEX_TABLE} (doc_type, gram, doc_id, field, weight) VALUES (%s, %s, %s, %s, %s)",
+            postings[start:start + BATCH_SIZE])
+
+
+def reindex(cursor, doc_type, doc_ids):
+    """
+    Rewrites the index entries of the given documents from their source rows.
+    Documents that no longer exist are simply removed. Does not commit: call it before
+    the caller's own commit so the index changes together with the data.
+    """
+    ids = sorted({int(doc_id) for doc_id in doc_ids if doc_id is not None})
+    if not ids:
+        return
+    spec = DOC_TYPES[doc_type]
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"DELETE FROM {INDEX_TABLE} WHERE doc_type = %s AND doc_id IN ({placeholders})", [doc_type] + ids)
+    cursor.execute(f"{spec['source']} WHERE {spec['alias']}.id IN ({placeholders})", ids)
+    _insert_postings(cursor, _postings(doc_type, cursor.fetchall()))
+
+
+def ids_where(cursor, doc_type, condition, params):
+    """Returns the ids of the documents matching a SQL condition on the source table (e.g. before a bulk update)."""
+    spec = DOC_TYPES[doc_type]
+    cursor.execute(f"SELECT {spec['alias']}.id FROM {spec['table']} {spec['alias']} WHERE {condition}", params)
+    return [_row_values(row, ['id'])[0] for row in cursor.fetchall()]
+
+
+def rebuild(cursor, doc_type):
+    """Rebuilds the whole index for one document type, reading the source table in id batches."""
+    spec = DOC_TYPES[doc_type]
+    cursor.execute(f"DELETE FROM {INDEX_TABLE} WHERE doc_type = %s", (doc_type,))
+    last_id = 0
+    total = 0
+    while True:
+        cursor.execute(f"{spec['source']} WHERE {spec['alias']}.id > %s ORDER BY {spec['alias']}.id LIMIT %s",
+                       (last_id, BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        _insert_postings(cursor, _postings(doc_type, rows))
+        last_id = _row_values(rows[-1], ['id'])[0]
+        total += len(rows)
+    return total
+
+
+def contains_condition(doc_type, text):
+    """(sql, params): one of the searched columns contains `text` (on the doc type's alias and joins)."""
+    columns = DOC_TYPES[doc_type]['columns']
+    return " OR ".join(f"{column} LIKE %s" for column in columns), ['%' + text + '%'] * len(columns)
+
+
+def match_condition(doc_type, text, key):
+    """
+    Returns (sql, params) for a WHERE condition restricting `key` (e.g. 'o.id') to documents
+    that contain `text`, or None when the text has no indexable gram (the caller falls back to LIKE).
+    The index narrows the candidates; contains_condition() checks them.
+    """
+    query_grams = sorted(grams(text))
+    if not query_grams:
+        return None
+    spec = DOC_TYPES[doc_type]
+    alias = spec['alias']
+    placeholders = ', '.join(['%s'] * len(query_grams))
+    contains_sql, contains_params = contains_condition(doc_type, text)
+    sql = (f"{key} IN (SELECT {alias}.id FROM {spec['table']} {alias} {spec['joins']}"
+           f" WHERE {alias}.id IN (SELECT doc_id FROM {INDEX_TABLE} WHERE doc_type = %s AND gram IN ({placeholders})"
+           f" GROUP BY doc_id HAVING COUNT(DISTINCT gram) = %s) AND ({contains_sql}))")
+    return sql, [doc_type] + query_grams + [len(query_grams)] + contains_params
+
+
+def search(cursor, doc_type, text, where_clauses=(), params=(), per_page=50, page=1):
+    """
+    Ranked search: documents containing `text` (candidates from the index, checked with
+    contains_condition()), best score first (sum of the weights of the fields that matched),
+    newest first on ties. where_clauses/params filter on the source table alias (e.g. "p.store_id = %s").
+    Returns (ids, has_more), or None when the text has no indexable gram.
+    """
+    query_grams = sorted(grams(text))
+    if not query_grams:
+        return None
+    spec = DOC_TYPES[doc_type]
+    alias = spec['alias']
+    placeholders = ', '.join(['%s'] * len(query_grams))
+    contains_sql, contains_params = contains_condition(doc_type, text)
+    conditions = (["si.doc_type = %s", f"si.gram IN ({placeholders})", f"({contains_sql})"]
+                  + [f"({clause})" for clause in where_clauses])
+    cursor.execute(f"""
+        SELECT si.doc_id, SUM(si.weight) AS score
+        FROM {INDEX_TABLE} si
+        JOIN {spec['table']} {alias} ON {alias}.id = si.doc_id
+        {spec['joins']}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY si.doc_id
+        HAVING COUNT(DISTINCT si.gram) = %s
+        ORDER BY score DESC, si.doc_id DESC
+        LIMIT %s OFFSET %s
+    """, [doc_type] + query_grams + contains_params + list(params)
+         + [len(query_grams), per_page + 1, (page - 1) * per_page])
+    ids = [_row_values(row, ['doc_id'])[0] for row in cursor.fetchall()]
+    return ids[:per_page], len(ids) > per_page
+
+
+def order_by_ids(rows, ids, key='id'):
+    """Puts rows fetched with `WHERE id IN (...)` back into the ranked order of `ids`."""
+    position = {doc_id: i for i, doc_id in enumerate(ids)}
+    return sorted(rows, key=lambda row: position.get(row[key], len(position)))
+
+
+# --- Benchmark: indexed search vs the LIKE queries it replaces ---
+LIKE_QUERIES = {
+    'order': ("SELECT o.id FROM tbl_order o WHERE o.order_id LIKE %s OR o.products_name LIKE %s OR o.email LIKE %s", 3),
+    'product': ("""SELECT p.id FROM tbl_products p LEFT JOIN tbl_category c ON p.category_id = c.category_id
+                   WHERE p.products_name LIKE %s OR p.products_id LIKE %s OR c.category_name LIKE %s""", 3),
+    'user': ("SELECT u.id FROM tbl_users u WHERE u.firstname LIKE %s OR u.lastname LIKE %s OR u.email LIKE %s OR u.role LIKE %s", 4),
+}
+
+
+def _time_query(cursor, sql, params, repeat):
+    best = None
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        rows = len(cursor.fetchall())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, rows
+
+
+def benchmark(conn, terms, repeat=5):
+    """Times each term against the LIKE query and the index. Returns a list of result dicts."""
+    results = []
+    cursor = conn.cursor()
+    try:
+        for doc_type, (like_sql, like_params) in LIKE_QUERIES.items():
+            for term in terms:
+                like_ms, like_rows = _time_query(cursor, like_sql, ['%' + term + '%'] * like_params, repeat)
+                condition = match_condition(doc_type, term, 'id')
+                if condition is None:
+                    index_ms, index_rows = None, None
+                else:
+                    sql, params = condition
+                    index_ms, index_rows = _time_query(
+                        cursor, f"SELECT id FROM {DOC_TYPES[doc_type]['table']} WHERE {sql}", params, repeat)
+                results.append({'doc_type': doc_type, 'term': term, 'like_ms': like_ms, 'like_rows': like_rows,
+                                'index_ms': index_ms, 'index_rows': index_rows})
+    finally:
+        cursor.close()
+    return results
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'bench'
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        if command == 'rebuild':
+            cursor = conn.cursor()
+            try:
+                for doc_type in (argv[2:] or DOC_TYPES):
+                    total = rebuild(cursor, doc_type)
+                    conn.commit()
+                    print(f"Indexed {total} {doc_type} rows")
+            finally:
+                cursor.close()
+        elif command == 'bench':
+            terms = argv[2:] or ['ขวด', 'น้ำ', 'gmail', '1000']
+            for r in benchmark(conn, terms):
+                index = f"{r['index_ms']:.2f} ms ({r['index_rows']} rows)" if r['index_ms'] is not None else 'n/a (term too short)'
+                print(f"{r['doc_type']:<8} {r['term']!r:<12} LIKE {r['like_ms']:.2f} ms ({r['like_rows']} rows)  index {index}")
+        else:
+            print(f"Unknown command: {command}")
+            return 2
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,70 @@
+# Sequence Allocators
+# Project Bin - ระบบออกเลขลำดับ (เลขคำสั่งซื้อต่อร้านค้า และบาร์โค้ดคำสั่งซื้อ) แบบ atomic
+
+from barcode_codec import BARCODE_LENGTH, BARCODE_SEED_START, encode
+
+ORDER_NUMBER_START = 100001  # First order number handed out for a store with no history
+
+# Legacy carts drew random seeds from [10^11, 10^12). Counter seeds start above that range
+# (BARCODE_SEED_START), so counter-issued barcodes can never collide with a legacy one
+# (encode() is a bijection).
+BARCODE_SEQUENCE = 'order_barcode'
+
+
+def _store_key(store_id):
+    # Sequences are keyed by store; orders without a store share bucket 0
+    return int(store_id) if store_id else 0
+
+
+def next_order_number(conn, store_id):
+    """
+    Atomically allocates the next order number for a store in O(1).
+    The upsert takes a row lock on the store's sequence row, so two cashiers opening
+    carts at the same time always get different numbers. The allocation is committed
+    immediately to keep that lock short; abandoned carts simply leave a gap.
+    The commit also commits anything else pending on `conn`, so pass a connection with no
+    open work (e.g. one borrowed just for the allocation).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO tbl_order_sequence (store_id, last_value) VALUES (%s, LAST_INSERT_ID(%s))
+            ON DUPLICATE KEY UPDATE last_value = LAST_INSERT_ID(last_value + 1)
+        """, (_store_key(store_id), ORDER_NUMBER_START))
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        value = cursor.fetchone()[0]
+        conn.commit()
+        return str(value)
+    finally:
+        cursor.close()
+
+
+def _next_counter_value(conn, name, start):
+    # Commits on `conn`, like next_order_number()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO tbl_sequence (name, last_value) VALUES (%s, LAST_INSERT_ID(%s))
+            ON DUPLICATE KEY UPDATE last_value = LAST_INSERT_ID(last_value + 1)
+        """, (name, start))
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        value = cursor.fetchone()[0]
+        conn.commit()
+        return value
+    finally:
+        cursor.close()
+
+
+def barcode_for_seed(seed):
+    """Formats the 13-digit barcode for a seed."""
+    return str(encode(seed)).zfill(BARCODE_LENGTH)
+
+
+def next_order_barcode(conn):
+    """
+    Allocates a globally unique 13-digit order barcode.
+    The seed comes from a persisted counter and encode() maps distinct seeds to distinct
+    barcodes, so no lookup of existing barcodes is needed.
+    Commits on `conn`; see next_order_number().
+    """
+    return barcode_for_seed(_next_counter_value(conn, BARCODE_SEQUENCE, BARCODE_SEED_START))
@@ -0,0 +1,264 @@
+# Server-side Sessions
+# Project Bin - เก็บข้อมูล session ไว้ฝั่งเซิร์ฟเวอร์ (หน่วยความจำ ไฟล์ หรือตารางในฐานข้อมูล) คุกกี้เก็บแค่ session id
+#
+# Flask's default session signs the whole session dict into the cookie, so everything put in
+# `session` (e.g. a receipt with every order line) travels with every request. With
+# ServerSessionInterface the cookie holds a random session id and the data stays in a store:
+#
+#   MemoryStore  -- in this process only (one worker, or tests); LRU + TTL eviction
+#   FileStore    -- one file per session in a directory, shared by the workers of one host
+#   SQLStore     -- tbl_session in the application database, shared by every host
+#
+# Stores keep the serialized session together with an expiry time. Each save pushes the expiry
+# TTL seconds ahead; a session that is only read is re-saved once less than half its TTL is left,
+# so idle sessions expire without a write on every request.
+
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{43}$')  # secrets.token_urlsafe(32)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it was changed during the request."""
+
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class MemoryStore:
+    """In-process store. Holds at most `max_entries` sessions; the least recently used go first."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # sid -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return entry
+
+    def set(self, sid, payload, expires_at):
+        with self._lock:
+            self._entries[sid] = (expires_at, payload)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for sid in expired:
+                del self._entries[sid]
+        return len(expired)
+
+
+class FileStore:
+    """One file per session; the file's mtime is set to the session's expiry time."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, f"{sid}.session")
+
+    def get(self, sid):
+        path = self._path(sid)
+        try:
+            expires_at = os.path.getmtime(path)
+            if expires_at <= time.time():
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as session_file:
+                return expires_at, session_file.read()
+        except OSError:
+            return None
+
+    def set(self, sid, payload, expires_at):
+        path = self._path(sid)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as session_file:
+                session_file.write(payload)
+            os.utime(tmp_path, (expires_at, expires_at))
+            os.replace(tmp_path, path)  # concurrent requests never read a half-written session
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+    def sweep(self):
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.session') and entry.stat().st_mtime <= now:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass  # another worker got there first
+        return removed
+
+
+class SQLStore:
+    """
+    Sessions in tbl_session (created by migration 9). `get_connection` returns a DB-API connection
+    whose close() releases it (e.g. a pooled connection); each call commits on its own, outside the
+    request's transaction.
+    """
+
+    def __init__(self, get_connection, table='tbl_session'):
+        self.get_connection = get_connection
+        self.table = table
+
+    def _run(self, query, params, fetch=False):
+        conn = self.get_connection()
+        if conn is None:
+            raise RuntimeError("no database connection for the session store")
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            row = cursor.fetchone() if fetch else None
+            affected = cursor.rowcount
+            conn.commit()
+            return row if fetch else affected
+        finally:
+            cursor.close()
+            conn.close()
+
+    def get(self, sid):
+        row = self._run(f"SELECT expires_at, data FROM {self.table} WHERE sid = %s AND expires_at > NOW()", (sid,), fetch=True)
+        if row is None:
+            return None
+        return row[0].timestamp(), row[1]
+
+    def set(self, sid, payload, expires_at):
+        self._run(f"""
+            INSERT INTO {self.table} (sid, data, expires_at) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE data = VALUES(data), expires_at = VALUES(expires_at)
+        """, (sid, payload, datetime.fromtimestamp(expires_at)))
+
+    def delete(self, sid):
+        self._run(f"DELETE FROM {self.table} WHERE sid = %s", (sid,))
+
+    def sweep(self, limit=1000):
+        # In chunks, so a large backlog never holds long locks on the table
+        return self._run(f"DELETE FROM {self.table} WHERE expires_at <= NOW() LIMIT {int(limit)}", ())
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Keeps session data in `store`; the cookie carries only the session id.
+    ttl          -- seconds an unused session is kept (permanent sessions use
+                    app.permanent_session_lifetime instead)
+    sweep_every  -- remove expired sessions from the store every this many saves
+    """
+
+    serializer = session_json_serializer  # same encoding as Flask's cookie sessions
+
+    def __init__(self, store, ttl=86400, sweep_every=500):
+        self.store = store
+        self.ttl = ttl
+        self.sweep_every = sweep_every
+        self._saves = 0
+        self._saves_lock = threading.Lock()
+
+    def _lifetime(self, app, session):
+        if session.permanent:
+            return app.permanent_session_lifetime.total_seconds()
+        return self.ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID_PATTERN.match(sid):
+            try:
+                entry = self.store.get(sid)
+            except Exception as err:
+                print(f"[Session] Could not load session: {err}")
+                entry = None
+            if entry is not None:
+                expires_at, payload = entry
+                try:
+                    return ServerSession(self.serializer.loads(payload), sid=sid, expires_at=expires_at)
+                except ValueError:
+                    pass  # unreadable data: start over
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def _sweep_now(self):
+        with self._saves_lock:
+            self._saves += 1
+            return self._saves % self.sweep_every == 0
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                # Cleared (logout): drop the stored data and the cookie
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        lifetime = self._lifetime(app, session)
+        refresh = session.expires_at is not None and session.expires_at - time.time() < lifetime / 2
+        if not (session.modified or session.new or refresh):
+            return
+
+        expires_at = time.time() + lifetime
+        try:
+            self.store.set(session.sid, self.serializer.dumps(dict(session)), expires_at)
+        except Exception as err:
+            print(f"[Session] Could not save session: {err}")
+            return
+        if self._sweep_now():
+            try:
+                self.store.sweep()
+            except Exception as err:
+                print(f"[Session] Cleanup failed: {err}")
+
+        response.vary.add('Cookie')
+        response.set_cookie(name, session.sid,
+                            expires=datetime.now() + timedelta(seconds=lifetime) if session.permanent else None,
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
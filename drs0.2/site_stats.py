@@ -0,0 +1,127 @@
+# Homepage Statistics
+# Project Bin - สถิติภาพรวมที่อัปเดตทีละส่วน (ไม่ต้อง COUNT/SUM ทั้งตารางทุกครั้ง)
+#
+# Counters live in tbl_stats and are bumped by the write paths inside the same transaction
+# as the change they describe. reconcile() recomputes them from the base tables to fix drift.
+
+import threading
+import time
+
+import mysql.connector
+
+
+STAT_KEYS = ('total_users', 'total_quantity', 'total_disquantity')
+CACHE_TTL = 30  # seconds the homepage serves counters from memory
+
+_cache = {'value': None, 'expires_at': 0.0}
+_cache_lock = threading.Lock()
+
+
+def bump(cursor, **deltas):
+    """
+    Adds the given deltas to the counters, e.g. bump(cursor, total_quantity=2, total_disquantity=-1).
+    Does not commit: call it before the caller's own commit so the counters move with the data.
+    """
+    rows = [(name, int(delta)) for name, delta in deltas.items() if delta]
+    if not rows:
+        return
+    placeholders = ', '.join(['(%s, %s)'] * len(rows))
+    params = [value for row in rows for value in row]
+    cursor.execute(f"""
+        INSERT INTO tbl_stats (name, value) VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+    """, params)
+
+
+def read_counters(conn):
+    """Reads the counters straight from tbl_stats (missing keys count as 0)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT name, value FROM tbl_stats WHERE name IN (%s, %s, %s)", STAT_KEYS)
+        counters = {name: 0 for name in STAT_KEYS}
+        counters.update({name: int(value) for name, value in cursor.fetchall()})
+        return counters
+    finally:
+        cursor.close()
+
+
+def get_counters(get_connection):
+    """
+    Returns the counters, served from an in-process cache for CACHE_TTL seconds.
+    `get_connection` is only called on a cache miss, so cached hits never touch the database.
+    Returns None when the counters are not cached and no connection is available.
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        if _cache['value'] is not None and now < _cache['expires_at']:
+            return dict(_cache['value'])
+    conn = get_connection()
+    if not conn:
+        return None
+    counters = read_counters(conn)
+    with _cache_lock:
+        _cache['value'] = counters
+        _cache['expires_at'] = now + CACHE_TTL
+    return dict(counters)
+
+
+def invalidate_cache():
+    with _cache_lock:
+        _cache['value'] = None
+
+
+def reconcile(conn):
+    """
+    Recomputes every counter from tbl_users and tbl_order and overwrites tbl_stats.
+    Returns {name: (old, new)} for counters that had drifted.
+    """
+    cursor = conn.cursor()
+    try:
+        # Lock the counters first: in-flight writers finish (and are counted) before the
+        # totals are read, and new writers wait until the corrected values are committed
+        cursor.execute("SELECT name, value FROM tbl_stats FOR UPDATE")
+        stored = {name: int(value) for name, value in cursor.fetchall()}
+        cursor.execute("SELECT COUNT(*) FROM tbl_users")
+        total_users = cursor.fetchone()[0] or 0
+        cursor.execute("SELECT COALESCE(SUM(quantity), 0), COALESCE(SUM(disquantity), 0) FROM tbl_order")
+        total_quantity, total_disquantity = cursor.fetchone()
+        actual = {
+            'total_users': int(total_users),
+            'total_quantity': int(total_quantity),
+            'total_disquantity': int(total_disquantity),
+        }
+        cursor.executemany("""
+            INSERT INTO tbl_stats (name, value) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE value = VALUES(value)
+        """, list(actual.items()))
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    invalidate_cache()
+    return {name: (stored.get(name, 0), value) for name, value in actual.items() if stored.get(name, 0) != value}
+
+
+def start_reconcile_thread(get_connection, interval=3600):
+    """Starts a daemon thread that runs reconcile() every `interval` seconds."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            conn = get_connection()
+            if not conn:
+                print("[Stats] Reconcile skipped: no database connection")
+                continue
+            try:
+                drift = reconcile(conn)
+                if drift:
+                    print(f"[Stats] Reconciled drifted counters: {drift}")
+            except mysql.connector.Error as err:
+                print(f"[Stats] Reconcile failed: {err}")
+            finally:
+                conn.close()
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
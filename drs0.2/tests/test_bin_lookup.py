@@ -0,0 +1,78 @@
+# Bin lookup tests
+# Project Bin - ทดสอบการค้นหาใบเสร็จที่หน้า /bin (รวมบาร์โค้ดเก่าที่ระบบไม่ได้ออกให้)
+#
+# Runs against a viewer sandbox (sandbox.py), so no MySQL server is needed. bin.html is rendered
+# by a stand-in that records the template context.
+#
+# Usage:
+#   python -m pytest -q tests
+
+import os
+import sys
+
+os.environ.setdefault('SESSION_BACKEND', 'memory')
+os.environ.setdefault('BACKGROUND_JOBS', '0')
+os.environ.setdefault('PRESENCE_FLUSH_INTERVAL', '3600')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as app_module
+from barcode_codec import is_valid_barcode
+
+
+LEGACY_BARCODE = '1234567890123'  # typed in before the barcode counter; outside the issued seed ranges
+
+
+@pytest.fixture
+def viewer(monkeypatch):
+    user = {'id': 1, 'firstname': 'Test', 'lastname': 'Viewer', 'email': 'viewer@example.com', 'role': 'viewer'}
+    store_id, store_name = app_module.viewer_sandboxes.create(user)
+    conn = app_module.viewer_sandboxes.connect(store_id, user)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO tbl_category (category_id, category_name, store_id) VALUES (%s, %s, %s)", (1, 'PET', store_id))
+    cursor.execute("""
+        INSERT INTO tbl_products (products_id, products_name, price, stock, category_id, store_id)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, ('P1', 'ขวดน้ำ', 2.5, 10, 1, store_id))
+    cursor.execute("""
+        INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, ('100001', 'P1', 'ขวดน้ำ', 2, 0, user['email'], LEGACY_BARCODE, store_id))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    rendered = []
+    monkeypatch.setattr(app_module, 'render_template', lambda name, **context: rendered.append((name, context)) or '')
+
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session.update(loggedin=True, sandbox=True, store_id=store_id, store_name=store_name, **user)
+    yield client, rendered
+    app_module.viewer_sandboxes.discard(store_id)
+
+
+def test_legacy_barcode_order_is_found_at_bin(viewer):
+    client, rendered = viewer
+    assert not is_valid_barcode(LEGACY_BARCODE)
+
+    response = client.get('/bin', query_string={'barcode_id_filter': LEGACY_BARCODE})
+
+    assert response.status_code == 200
+    name, context = rendered[-1]
+    assert name == 'bin.html'
+    assert [(order['barcode_id'], order['products_id']) for order in context['orders']] == [(LEGACY_BARCODE, 'P1')]
+    with client.session_transaction() as session:
+        assert not session.get('_flashes')
+
+
+def test_unknown_foreign_barcode_is_reported(viewer):
+    client, rendered = viewer
+
+    response = client.get('/bin', query_string={'barcode_id_filter': 'NOT-A-RECEIPT'})
+
+    assert response.status_code == 200
+    assert rendered[-1][1]['orders'] == []
+    with client.session_transaction() as session:
+        assert [category for category, _ in session.get('_flashes', [])] == ['warning']
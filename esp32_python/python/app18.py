@@ -3,8 +3,12 @@ import mysql.connector
 import requests
 import threading
 import time
+import os
 from functools import wraps
 
+from barcode_codec import is_valid_barcode
+from db_pool import ConnectionPool, PoolTimeout
+
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here' # Set Secret Key for Flask Session
 
@@ -25,6 +29,16 @@ DB_CONFIG = {
     'database': 'project_bin'
 }
 
+# The servo loop borrows a connection every 0.1s, so reuse them instead of reconnecting
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    size=int(os.environ.get('DB_POOL_SIZE', 3)),
+    max_overflow=int(os.environ.get('DB_POOL_MAX_OVERFLOW', 5)),
+    timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    max_lifetime=int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+    health_check=os.environ.get('DB_POOL_HEALTH_CHECK', '1') != '0',
+)
+
 # List of Servo pins (IDs) used in the system
 SERVO_PINS = [12, 13, 14, 26, 27]
 servo_cache = {}  # Cache to store the latest status of Servos
@@ -40,13 +54,12 @@ current_item_awaiting_drop = None
 
 def get_db_connection():
     """
-    Establishes a database connection using DB_CONFIG.
+    Borrows a database connection from the pool (close() returns it to the pool).
     Returns a connection object, or None if an error occurs.
     """
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
-    except mysql.connector.Error as err:
+        return db_pool.get_connection()
+    except (mysql.connector.Error, PoolTimeout) as err:
         print(f"Error connecting to database: {err}")
         return None
 
@@ -188,7 +201,7 @@ def _handle_disquantity_logic(conn, cursor, is_sensor_trigger=False, flash_func=
 
         # Fetch order item to update disquantity
         cursor.execute("""
-            SELECT id, quantity, disquantity, products_name
+            SELECT id, quantity, disquantity, products_name, store_id
             FROM tbl_order
             WHERE barcode_id = %s AND products_id = %s
         """, (barcode_id_to_search, products_id_to_disquantity))
@@ -206,6 +219,16 @@ def _handle_disquantity_logic(conn, cursor, is_sensor_trigger=False, flash_func=
                 # Increment disquantity in the database
                 cursor.execute("UPDATE tbl_order SET disquantity = %s WHERE id = %s",
                                (proposed_disquantity, order_id))
+                # Keep the web app's homepage counter (tbl_stats) in step, same transaction
+                cursor.execute("""
+                    INSERT INTO tbl_stats (name, value) VALUES ('total_disquantity', 1)
+                    ON DUPLICATE KEY UPDATE value = value + 1
+                """)
+                # ...and the order data version, so cached order reports for this store are rebuilt
+                cursor.execute("""
+                    INSERT INTO tbl_data_version (scope, version) VALUES (%s, 1)
+                    ON DUPLICATE KEY UPDATE version = version + 1
+                """, (f"orders:{order_item_to_update['store_id'] or '*'}",))
                 
                 if is_sensor_trigger:
                     print(f"[Disquantity Update] Increased disquantity for item '{product_name}' to {proposed_disquantity}")
@@ -529,8 +552,14 @@ def bin():
             order_info = cursor.fetchone()
 
             if not order_info:
-                flash(f"ไม่พบบาร์โค้ด '{display_barcode_id}' ในระบบ", 'warning')
-                send_oled_text(["Barcode Not Found", "Scan New Receipt"])
+                # Every barcode is looked up (orders may carry legacy or typed-in barcodes);
+                # the codec only tells a mistyped or foreign scan apart in the message
+                if is_valid_barcode(display_barcode_id.strip()):
+                    flash(f"ไม่พบบาร์โค้ด '{display_barcode_id}' ในระบบ", 'warning')
+                    send_oled_text(["Barcode Not Found", "Scan New Receipt"])
+                else:
+                    flash(f"บาร์โค้ด '{display_barcode_id}' ไม่ใช่บาร์โค้ดใบเสร็จของระบบ", 'warning')
+                    send_oled_text(["Invalid Barcode", "Scan Again"])
                 session.pop('current_receipt_barcode', None)
                 return redirect(url_for('bin'))
 
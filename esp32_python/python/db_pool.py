@@ -0,0 +1,248 @@
+# Database Connection Pool
+# Project Bin - ระบบ pool การเชื่อมต่อฐานข้อมูล (ใช้การเชื่อมต่อซ้ำแทนการเปิดใหม่ทุกครั้ง)
+
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool timeout."""
+
+
+class CountingCursor:
+    """Cursor wrapper that counts statements executed through its connection."""
+
+    def __init__(self, owner, raw_cursor):
+        self._owner = owner
+        self._raw_cursor = raw_cursor
+
+    def execute(self, *args, **kwargs):
+        self._owner.query_count += 1
+        return self._raw_cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._owner.query_count += 1
+        return self._raw_cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._raw_cursor, name)
+
+    def __iter__(self):
+        return iter(self._raw_cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._raw_cursor.close()
+
+
+class PooledConnection:
+    """
+    Thin wrapper around a mysql.connector connection borrowed from a ConnectionPool.
+    Behaves like the real connection, except close() hands it back to the pool
+    so existing `conn.close()` calls in the routes keep working unchanged.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+        self.query_count = 0
+
+    def __getattr__(self, name):
+        if self._released:
+            raise mysql.connector.errors.OperationalError("Connection already returned to the pool")
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        if self._released:
+            raise mysql.connector.errors.OperationalError("Connection already returned to the pool")
+        return CountingCursor(self, self._raw.cursor(*args, **kwargs))
+
+    def is_connected(self):
+        if self._released:
+            return False
+        return self._raw.is_connected()
+
+    def close(self):
+        """Returns the connection to the pool (safe to call more than once)."""
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._raw, self._created_at)
+
+    def __del__(self):
+        # Safety net for code paths that forget to close: don't leak the pool slot
+        if not getattr(self, '_released', True):
+            self.close()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MySQL connections.
+
+    size          -- connections kept open and reused between requests
+    max_overflow  -- extra connections opened under load, closed again when returned
+    timeout       -- seconds to wait for a free connection before raising PoolTimeout
+    max_lifetime  -- seconds before a connection is retired and reopened
+    health_check  -- ping connections on borrow and replace dead ones
+    """
+
+    RATE_WINDOW = 60.0  # seconds used for checkouts_per_sec
+
+    def __init__(self, db_config, size=5, max_overflow=5, timeout=10.0, max_lifetime=1800, health_check=True):
+        self.db_config = dict(db_config)
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+
+        self._idle = deque()  # (raw connection, created_at)
+        self._open_count = 0  # idle + in use
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        # Statistics
+        self._started_at = time.monotonic()
+        self._checkouts = 0
+        self._recent_checkouts = deque()  # monotonic timestamps within the rate window
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._health_check_failures = 0
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self.db_config)
+        with self._cond:
+            self._created += 1
+        return raw, time.monotonic()
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except mysql.connector.Error:
+            pass
+
+    def _is_healthy(self, raw, created_at):
+        if self.max_lifetime and time.monotonic() - created_at > self.max_lifetime:
+            with self._cond:
+                self._recycled += 1
+            return False
+        if self.health_check:
+            try:
+                raw.ping(reconnect=False)
+            except (mysql.connector.Error, AttributeError):
+                with self._cond:
+                    self._health_check_failures += 1
+                return False
+        return True
+
+    def get_connection(self):
+        """
+        Borrows a connection from the pool, opening a new one if the pool has room.
+        Blocks up to `timeout` seconds when every connection is in use.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw, created_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._open_count < self.size + self.max_overflow:
+                    raw, created_at = None, None
+                    self._open_count += 1
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+
+        try:
+            if raw is not None and not self._is_healthy(raw, created_at):
+                self._discard(raw)
+                raw = None
+            if raw is None:
+                raw, created_at = self._connect()
+        except Exception:
+            with self._cond:
+                self._open_count -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        now = time.monotonic()
+        waited = now - started
+        with self._cond:
+            self._checkouts += 1
+            self._recent_checkouts.append(now)
+            self._trim_recent(now)
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return PooledConnection(self, raw, created_at)
+
+    def _release(self, raw, created_at):
+        keep = True
+        try:
+            # Never hand the next borrower an open transaction or a stale snapshot
+            if raw.in_transaction:
+                raw.rollback()
+        except mysql.connector.Error:
+            keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.size:
+                self._idle.append((raw, created_at))
+            else:
+                self._open_count -= 1
+                keep = False
+            self._cond.notify()
+        if not keep:
+            self._discard(raw)
+
+    def _trim_recent(self, now):
+        while self._recent_checkouts and now - self._recent_checkouts[0] > self.RATE_WINDOW:
+            self._recent_checkouts.popleft()
+
+    def close_all(self):
+        """Closes every idle connection (connections in use are closed when returned)."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open_count -= len(idle)
+        for raw, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        """Returns a snapshot of live pool statistics."""
+        with self._cond:
+            now = time.monotonic()
+            self._trim_recent(now)
+            window = min(self.RATE_WINDOW, max(now - self._started_at, 1e-9))
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self._open_count,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'checkouts_per_sec': round(len(self._recent_checkouts) / window, 3),
+                'wait_avg_ms': round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+                'timeouts': self._timeouts,
+                'connections_created': self._created,
+                'connections_recycled': self._recycled,
+                'health_check_failures': self._health_check_failures,
+            }